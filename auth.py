@@ -8,7 +8,7 @@ from sqlalchemy import update
 import models
 import schemas
 from dependencies import SECRET_KEY, ALGORITHM, pwd_context, oauth2_scheme
-from database import get_db
+from database import get_db, get_read_db
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -29,7 +29,7 @@ async def authenticate_user(db: AsyncSession, username: str, password: str):
         return False
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def _user_from_token(token: str, db: AsyncSession):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -48,6 +48,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
         raise credentials_exception
     return user
 
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await _user_from_token(token, db)
+
+async def get_current_user_read(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)):
+    """Como get_current_user, mas na sessão de leitura, para rotas que não escrevem"""
+    return await _user_from_token(token, db)
+
 async def get_current_admin(current_user: models.User = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(
@@ -0,0 +1 @@
+"""Ferramentas de benchmark e de carga (não são carregadas pela aplicação)."""
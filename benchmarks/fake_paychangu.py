@@ -0,0 +1,137 @@
+"""Gateway Paychangu falso para testes de carga offline.
+
+Implementa os dois endpoints usados por `payment.PaychanguClient`
+(inicialização e consulta de status) com latência, taxa de erro e atraso
+de liquidação configuráveis. O pagamento fica pendente até liquidar; com
+`DEPOSIT_CREDIT_ON_VERIFY=1` a aplicação só credita o depósito quando
+`/wallet/verify-deposit` vir o estado final, como no gateway real. Para usar,
+arranque este servidor e defina `PAYCHANGU_BASE_URL` na aplicação:
+
+    python -m benchmarks.fake_paychangu --port 9100 --latency-ms 80 --error-rate 0.02
+    PAYCHANGU_BASE_URL=http://127.0.0.1:9100 DEPOSIT_CREDIT_ON_VERIFY=1 python main.py
+
+Um pagamento sai da memória quando a consulta devolve o estado final (uma
+segunda consulta dá 404) e nunca se guardam mais de `--max-payments`: os
+mais antigos são descartados.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class GatewaySettings:
+    def __init__(self):
+        self.latency_ms = float(os.getenv("FAKE_PAYCHANGU_LATENCY_MS", 50))
+        self.jitter_ms = float(os.getenv("FAKE_PAYCHANGU_JITTER_MS", 20))
+        self.error_rate = float(os.getenv("FAKE_PAYCHANGU_ERROR_RATE", 0.0))
+        self.settle_seconds = float(os.getenv("FAKE_PAYCHANGU_SETTLE_SECONDS", 2.0))
+        self.failure_rate = float(os.getenv("FAKE_PAYCHANGU_FAILURE_RATE", 0.0))
+        self.max_payments = int(os.getenv("FAKE_PAYCHANGU_MAX_PAYMENTS", 100_000))
+
+
+settings = GatewaySettings()
+# ref_id -> (momento de liquidação, estado final), por ordem de criação
+payments = OrderedDict()
+
+app = FastAPI(title="Fake Paychangu")
+
+
+async def _simulate_network():
+    delay = settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if random.random() < settings.error_rate:
+        return JSONResponse(
+            status_code=502,
+            content={"status": "failed", "message": "Simulated gateway error", "data": None},
+        )
+    return None
+
+
+@app.post("/mobile-money/payments/initialize")
+async def initialize_payment(request: Request):
+    error = await _simulate_network()
+    if error:
+        return error
+
+    body = await request.json()
+    ref_id = uuid.uuid4().hex
+    final_status = "failed" if random.random() < settings.failure_rate else "success"
+    payments[ref_id] = (time.monotonic() + settings.settle_seconds, final_status)
+    while len(payments) > settings.max_payments:
+        payments.popitem(last=False)
+    return {
+        "status": "success",
+        "message": "Payment initialized",
+        "data": {
+            "ref_id": ref_id,
+            "charge_id": body.get("charge_id"),
+            "amount": body.get("amount"),
+            "mobile": body.get("mobile"),
+            "status": "pending",
+        },
+    }
+
+
+@app.get("/mobile-money/payments/{ref_id}/status")
+async def payment_status(ref_id: str):
+    error = await _simulate_network()
+    if error:
+        return error
+
+    payment = payments.get(ref_id)
+    if payment is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "failed", "message": "Payment not found", "data": None},
+        )
+    settles_at, final_status = payment
+    if time.monotonic() < settles_at:
+        status = "pending"
+    else:
+        status = final_status
+        del payments[ref_id]
+    return {"status": status, "message": f"Payment {status}", "data": {"ref_id": ref_id, "status": status}}
+
+
+@app.get("/_stats")
+async def stats():
+    return {"payments": len(payments)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway Paychangu falso")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate,
+                        help="fração de chamadas que devolvem 502")
+    parser.add_argument("--settle-seconds", type=float, default=settings.settle_seconds,
+                        help="tempo até um pagamento deixar de estar pendente")
+    parser.add_argument("--failure-rate", type=float, default=settings.failure_rate,
+                        help="fração de pagamentos que terminam como falhados")
+    parser.add_argument("--max-payments", type=int, default=settings.max_payments,
+                        help="pagamentos guardados em memória; os mais antigos são descartados")
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.error_rate = args.error_rate
+    settings.settle_seconds = args.settle_seconds
+    settings.failure_rate = args.failure_rate
+    settings.max_payments = args.max_payments
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""Gerador de dados sintéticos para testes de carga.
+
+Popula o banco configurado (ver engine_config.py) com utilizadores, cursos
+com ZIPs e capas falsos, likes e matrículas com popularidade enviesada
+(Zipf) e histórico de wallet coerente com as compras (o saldo de cada
+wallet é a soma das suas transações). Tudo é determinístico a partir de
+`--seed`. Os ids são atribuídos aqui, o que permite ligar matrículas às
+transações sem RETURNING, e as linhas são inseridas em lotes com
+executemany (INSERT multi-linha no MySQL). Todos os utilizadores partilham
+um único hash bcrypt pré-calculado. Os nomes dos utilizadores seguem o id
+(`user<id>`); com `--users-file` os nomes criados ficam gravados num
+ficheiro, um por linha, para quem precise de fazer login com eles.
+
+    DATABASE_BACKEND=sqlite SQLITE_PATH=/tmp/load.db \\
+        python -m benchmarks.seed --users 1000000 --courses 20000 --media-dir /tmp/media
+"""
+import argparse
+import asyncio
+import os
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+import models
+from auth import get_password_hash
+from database import engine
+from migrations import run_migrations
+
+CODE_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# PNG de 1x1 pixel usado como capa
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def unique_code(n: int, length: int) -> str:
+    """Código alfanumérico único por `n`: bijeção afim módulo 36**length."""
+    modulus = 36 ** length
+    # Multiplicador primo com 36 (nem par nem múltiplo de 3), logo a função é uma permutação de [0, modulus)
+    value = (n * 2862933555777941759 + 3037000493) % modulus
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 36)
+        chars.append(CODE_ALPHABET[digit])
+    return "".join(chars)
+
+
+def zipf_weights(count: int, exponent: float, rng) -> np.ndarray:
+    """Popularidade Zipf, com os ranks baralhados para não favorecer os ids baixos."""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def sample_pairs(rng, user_ids: np.ndarray, course_count: int, mean: float, minimum: int, weights) -> tuple:
+    """Pares (usuário, índice de curso) únicos, com número de itens por usuário ~ Poisson."""
+    counts = np.maximum(rng.poisson(mean, size=len(user_ids)), minimum)
+    counts = np.minimum(counts, course_count)
+    users = np.repeat(user_ids, counts)
+    courses = rng.choice(course_count, size=len(users), p=weights)
+    keys = np.unique(users.astype(np.int64) * course_count + courses)
+    return keys // course_count, keys % course_count
+
+
+def write_media(media_dir: str, distinct: int, zip_kb: int, rng):
+    """Gera `distinct` ZIPs e capas falsos, reutilizados em rodízio pelos cursos."""
+    os.makedirs(os.path.join(media_dir, "files"), exist_ok=True)
+    os.makedirs(os.path.join(media_dir, "covers"), exist_ok=True)
+    files, covers = [], []
+    for i in range(distinct):
+        zip_path = os.path.join(media_dir, "files", f"seed_{i}.zip")
+        if not os.path.exists(zip_path):
+            size = max(1, int(rng.integers(zip_kb // 2, zip_kb * 2 + 1))) * 1024
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("README.txt", f"Seed course archive {i}\n")
+                archive.writestr("lesson.bin", rng.bytes(size), compress_type=zipfile.ZIP_STORED)
+        cover_path = os.path.join(media_dir, "covers", f"seed_{i}.png")
+        if not os.path.exists(cover_path):
+            with open(cover_path, "wb") as f:
+                f.write(TINY_PNG)
+        files.append(zip_path)
+        covers.append(cover_path)
+    return files, covers
+
+
+class Seeder:
+    def __init__(self, conn, args):
+        self.conn = conn
+        self.args = args
+        self.batch_size = args.batch_size
+        self.rows_inserted = 0
+
+    async def insert(self, table, rows):
+        for start in range(0, len(rows), self.batch_size):
+            await self.conn.execute(table.insert(), rows[start:start + self.batch_size])
+        self.rows_inserted += len(rows)
+
+    async def next_id(self, model) -> int:
+        result = await self.conn.execute(select(func.max(model.id)))
+        return (result.scalar() or 0) + 1
+
+
+async def seed(args):
+    await run_migrations(engine)
+    rng = np.random.default_rng(args.seed)
+    started = time.monotonic()
+    now = datetime(2026, 1, 1)
+    hashed_password = get_password_hash(args.password)
+
+    if args.course_file:
+        course_files = [args.course_file]
+        cover_files = [args.cover_file]
+    else:
+        # Gerador próprio: reutilizar ficheiros já gerados não altera o resto dos dados
+        media_rng = np.random.default_rng([args.seed, 1])
+        course_files, cover_files = write_media(args.media_dir, args.distinct_media, args.zip_kb, media_rng)
+
+    tables = models.Base.metadata.tables
+    usernames = []
+    async with engine.begin() as conn:
+        seeder = Seeder(conn, args)
+        user_id = await seeder.next_id(models.User)
+        wallet_id = await seeder.next_id(models.Wallet)
+        course_id = await seeder.next_id(models.Course)
+        like_id = await seeder.next_id(models.CourseLike)
+        download_id = await seeder.next_id(models.CourseDownload)
+        transaction_id = await seeder.next_id(models.WalletTransaction)
+
+        admin_id = user_id
+        await seeder.insert(tables["users"], [{
+            "id": admin_id, "email": f"admin{admin_id}@example.com", "username": f"admin{admin_id}",
+            "hashed_password": hashed_password, "is_admin": True, "created_at": now,
+        }])
+        user_id += 1
+
+        # Cursos: todos em memória (dezenas de milhares cabem folgadamente)
+        course_ids = np.arange(course_id, course_id + args.courses)
+        prices = np.round(rng.uniform(5, 100, size=args.courses), 2)
+        durations = rng.integers(30, 1200, size=args.courses)
+        course_ages = rng.integers(0, args.history_days, size=args.courses)
+        await seeder.insert(tables["courses"], [
+            {
+                "id": int(cid),
+                "course_code": unique_code(int(cid), 6),
+                "title": f"Course {int(cid)}",
+                "description": f"Synthetic course {int(cid)}",
+                "price": float(prices[i]),
+                "duration_minutes": int(durations[i]),
+                "cover_image": cover_files[i % len(cover_files)],
+                "file_path": course_files[i % len(course_files)],
+                "uploaded_by": admin_id,
+                "created_at": now - timedelta(days=int(course_ages[i])),
+                "status": "published",
+            }
+            for i, cid in enumerate(course_ids)
+        ])
+        like_weights = zipf_weights(args.courses, args.zipf, rng)
+        enrollment_weights = zipf_weights(args.courses, args.zipf, rng)
+
+        for chunk_start in range(0, args.users, args.chunk_size):
+            n = min(args.chunk_size, args.users - chunk_start)
+            user_ids = np.arange(user_id, user_id + n)
+            user_ages = rng.integers(0, args.history_days, size=n)
+            await seeder.insert(tables["users"], [
+                {
+                    "id": int(uid),
+                    # Pelo id, que começa depois do maior já existente: sem colisões num banco com dados
+                    "email": f"user{int(uid)}@example.com",
+                    "username": f"user{int(uid)}",
+                    "hashed_password": hashed_password,
+                    "is_admin": False,
+                    "created_at": now - timedelta(days=int(user_ages[i])),
+                }
+                for i, uid in enumerate(user_ids)
+            ])
+            if args.users_file:
+                usernames.extend(f"user{int(uid)}" for uid in user_ids)
+
+            like_users, like_courses = sample_pairs(
+                rng, user_ids, args.courses, args.likes_mean, 0, like_weights
+            )
+            like_ages = rng.integers(0, args.history_days * 24 * 60, size=len(like_users))
+            await seeder.insert(tables["course_likes"], [
+                {
+                    "id": like_id + i,
+                    "user_id": int(like_users[i]),
+                    "course_id": int(course_ids[like_courses[i]]),
+                    "created_at": now - timedelta(minutes=int(like_ages[i])),
+                }
+                for i in range(len(like_users))
+            ])
+            like_id += len(like_users)
+
+            enrolled_users, enrolled_courses = sample_pairs(
+                rng, user_ids, args.courses, args.enrollments_mean, args.min_enrollments, enrollment_weights
+            )
+            spent = np.zeros(n)
+            np.add.at(spent, enrolled_users - user_id, prices[enrolled_courses])
+
+            # Depósitos cobrem as compras mais uma sobra; o saldo final bate com o extrato
+            deposit_counts = rng.poisson(args.deposits_mean, size=n) + 1
+            extra = np.round(rng.uniform(0, args.wallet_balance, size=n), 2)
+            wallets, transactions = [], []
+            for i, uid in enumerate(user_ids):
+                total = round(float(spent[i] + extra[i]), 2)
+                parts = deposit_counts[i]
+                amounts = np.round(np.full(parts, total / parts), 2)
+                amounts[-1] = round(total - float(amounts[:-1].sum()), 2)
+                for k, amount in enumerate(amounts):
+                    transactions.append({
+                        "id": transaction_id,
+                        "wallet_id": wallet_id + i,
+                        "amount": float(amount),
+                        "transaction_type": "deposit",
+                        "payment_ref": f"seed-{transaction_id}",
+                        "status": "completed",
+                        "created_at": now - timedelta(days=int(user_ages[i])) + timedelta(minutes=k),
+                    })
+                    transaction_id += 1
+                wallets.append({
+                    "id": wallet_id + i,
+                    "user_id": int(uid),
+                    "balance": round(float(extra[i]), 2),
+                    "created_at": now - timedelta(days=int(user_ages[i])),
+                })
+
+            downloads = []
+            progress = np.round(rng.uniform(0, 100, size=len(enrolled_users)), 1)
+            completed = rng.random(size=len(enrolled_users)) < args.completion_rate
+            # Cada matrícula é posterior à criação da conta do usuário
+            enrolled_index = enrolled_users - user_id
+            enrolled_ages = (rng.random(size=len(enrolled_users)) * (user_ages[enrolled_index] + 1)).astype(int)
+            for i in range(len(enrolled_users)):
+                index = int(enrolled_index[i])
+                downloaded_at = now - timedelta(days=int(enrolled_ages[i]))
+                transactions.append({
+                    "id": transaction_id,
+                    "wallet_id": wallet_id + index,
+                    "amount": -float(prices[enrolled_courses[i]]),
+                    "transaction_type": "purchase",
+                    "payment_ref": None,
+                    "status": "completed",
+                    "created_at": downloaded_at,
+                })
+                downloads.append({
+                    "id": download_id + i,
+                    "enrollment_code": unique_code(download_id + i, 8),
+                    "user_id": int(enrolled_users[i]),
+                    "course_id": int(course_ids[enrolled_courses[i]]),
+                    "transaction_id": transaction_id,
+                    "downloaded_at": downloaded_at,
+                    "status": "completed" if completed[i] else "active",
+                    "progress": 100.0 if completed[i] else float(progress[i]),
+                    "last_accessed": downloaded_at,
+                })
+                transaction_id += 1
+
+            await seeder.insert(tables["wallets"], wallets)
+            await seeder.insert(tables["wallet_transactions"], transactions)
+            await seeder.insert(tables["course_downloads"], downloads)
+            download_id += len(downloads)
+            wallet_id += n
+            user_id += n
+
+            if not args.quiet:
+                elapsed = time.monotonic() - started
+                print(
+                    f"{chunk_start + n}/{args.users} usuários, {seeder.rows_inserted} linhas, "
+                    f"{seeder.rows_inserted / elapsed:,.0f} linhas/s"
+                )
+
+    await engine.dispose()
+    if args.users_file:
+        with open(args.users_file, "w") as f:
+            f.writelines(f"{username}\n" for username in usernames)
+    if not args.quiet:
+        print(f"Concluído: {seeder.rows_inserted} linhas em {time.monotonic() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de dados sintéticos")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--courses", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--likes-mean", type=float, default=5.0, help="likes por usuário (média Poisson)")
+    parser.add_argument("--enrollments-mean", type=float, default=2.0, help="matrículas por usuário (média Poisson)")
+    parser.add_argument("--min-enrollments", type=int, default=0)
+    parser.add_argument("--deposits-mean", type=float, default=1.0)
+    parser.add_argument("--completion-rate", type=float, default=0.2)
+    parser.add_argument("--zipf", type=float, default=1.1, help="expoente da popularidade dos cursos")
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--wallet-balance", type=float, default=100.0, help="saldo livre máximo por wallet")
+    parser.add_argument("--password", default="seed-password")
+    parser.add_argument("--media-dir", default=os.path.join("courses", "seed"))
+    parser.add_argument("--distinct-media", type=int, default=64, help="ZIPs/capas distintos gerados")
+    parser.add_argument("--zip-kb", type=int, default=256)
+    parser.add_argument("--course-file", help="usar este ZIP em todos os cursos em vez de gerar")
+    parser.add_argument("--cover-file", help="capa usada com --course-file")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="usuários gerados por lote")
+    parser.add_argument("--batch-size", type=int, default=5_000, help="linhas por executemany")
+    parser.add_argument("--users-file", help="gravar neste ficheiro os nomes dos utilizadores criados")
+    parser.add_argument("--quiet", action="store_true")
+    asyncio.run(seed(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Registo de latências e cálculo de percentis para os benchmarks."""
+import math
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil pelo método do rank mais próximo; `sorted_values` já ordenado."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LatencyRecorder:
+    """Acumula latências e códigos de status por passo (endpoint ou etapa do fluxo)."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, step: str, seconds: float, status: int):
+        self.latencies[step].append(seconds)
+        self.statuses[step][status] += 1
+
+    @contextmanager
+    def measure(self, step: str):
+        """Mede um bloco; o bloco deve atribuir `holder["status"]`."""
+        holder = {"status": 0}
+        start = time.perf_counter()
+        try:
+            yield holder
+        finally:
+            self.record(step, time.perf_counter() - start, holder["status"])
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self) -> Dict[str, dict]:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        report = {}
+        for step, values in self.latencies.items():
+            ordered = sorted(values)
+            # Sem resposta (0), 4xx e 5xx: um fluxo saudável só recebe 2xx
+            errors = sum(
+                count for status, count in self.statuses[step].items()
+                if status == 0 or status >= 400
+            )
+            report[step] = {
+                "requests": len(ordered),
+                "errors": errors,
+                "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+                "statuses": {str(k): v for k, v in sorted(self.statuses[step].items())},
+            }
+        return report
+
+
+def print_summary(summary: Dict[str, dict]):
+    header = f"{'passo':<28}{'req':>8}{'err':>6}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}"
+    print(header)
+    print("-" * len(header))
+    for step, s in summary.items():
+        print(
+            f"{step:<28}{s['requests']:>8}{s['errors']:>6}{s['throughput_rps']:>10}"
+            f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}"
+        )
@@ -0,0 +1,322 @@
+"""Benchmarks dos endpoints mais usados.
+
+Para cada tamanho de catálogo cria um banco SQLite novo, popula-o, arranca
+o gateway falso e a aplicação (`main:app` via uvicorn) em subprocessos e
+mede throughput e p50/p95/p99 de cada endpoint. O resultado é gravado em
+JSON e pode ser comparado com um baseline guardado:
+
+    python -m benchmarks.suite --sizes 10 100 1000 --output bench.json
+    python -m benchmarks.suite --baseline bench.json --max-regression 15
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+import httpx
+
+from benchmarks.stats import LatencyRecorder, print_summary
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_PASSWORD = "bench-password"
+
+
+def _wait_for(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} while starting")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def _spawn(args, env, cwd):
+    return subprocess.Popen(
+        [sys.executable, *args],
+        env=env,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=None if env.get("BENCH_SHOW_SERVER_LOG") else subprocess.DEVNULL,
+    )
+
+
+def _stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+class Environment:
+    """Diretório temporário com banco SQLite, ZIP de curso e variáveis da aplicação."""
+
+    def __init__(self, catalog_size: int, args):
+        self.catalog_size = catalog_size
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix=f"boolen-bench-{catalog_size}-")
+        os.symlink(os.path.join(REPO_ROOT, "templates"), os.path.join(self.workdir, "templates"))
+        self.db_path = os.path.join(self.workdir, "bench.db")
+        self.zip_path = os.path.join(self.workdir, "course.zip")
+        with zipfile.ZipFile(self.zip_path, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr("lesson.bin", random.randbytes(args.zip_kb * 1024))
+
+        self.env = {
+            **os.environ,
+            "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+            "DATABASE_BACKEND": "sqlite",
+            "SQLITE_PATH": self.db_path,
+            "PAYCHANGU_BASE_URL": f"http://127.0.0.1:{args.gateway_port}",
+            "DB_ECHO": "false",
+        }
+        self.processes = []
+
+    def start(self):
+        gateway = _spawn([
+            "-m", "benchmarks.fake_paychangu",
+            "--port", str(self.args.gateway_port),
+            "--latency-ms", str(self.args.gateway_latency_ms),
+            "--settle-seconds", "0",
+        ], self.env, self.workdir)
+        self.processes.append(gateway)
+        _wait_for(f"http://127.0.0.1:{self.args.gateway_port}/_stats", gateway)
+
+        app = _spawn([
+            "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(self.args.port),
+            "--log-level", "warning", "--no-access-log",
+        ], self.env, self.workdir)
+        self.processes.append(app)
+        _wait_for(f"http://127.0.0.1:{self.args.port}/", app)
+
+    def stop(self):
+        for process in reversed(self.processes):
+            _stop(process)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def seed(environment: Environment, users: int) -> list:
+    """Popula o banco num subprocesso com as mesmas variáveis da aplicação; devolve os usernames criados."""
+    users_file = os.path.join(environment.workdir, "users.txt")
+    subprocess.run([
+        sys.executable, "-m", "benchmarks.seed",
+        "--users", str(users),
+        "--courses", str(environment.catalog_size),
+        "--course-file", environment.zip_path,
+        "--password", BENCH_PASSWORD,
+        "--wallet-balance", "1000000",
+        "--likes-mean", "5",
+        "--enrollments-mean", "1",
+        "--min-enrollments", "1",
+        "--seed", str(environment.args.seed),
+        "--users-file", users_file,
+        "--quiet",
+    ], env=environment.env, cwd=environment.workdir, check=True)
+    with open(users_file) as f:
+        return f.read().split()
+
+
+async def _drive(recorder, step, count, concurrency, make_request):
+    """Executa `count` pedidos com `concurrency` em paralelo e regista as latências."""
+    counter = iter(range(count))
+
+    async def worker():
+        for i in counter:
+            with recorder.measure(step) as holder:
+                try:
+                    holder["status"] = await make_request(i)
+                except httpx.HTTPError:
+                    pass
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_scenarios(base_url: str, catalog_size: int, args, usernames: list) -> dict:
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits) as client:
+        async def login(i):
+            response = await client.post("/auth/token", data={
+                "username": usernames[i % len(usernames)], "password": BENCH_PASSWORD,
+            })
+            return response.status_code
+
+        tokens = []
+        for username in usernames:
+            response = await client.post("/auth/token", data={"username": username, "password": BENCH_PASSWORD})
+            response.raise_for_status()
+            tokens.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+
+        enrollments = []
+        for headers in tokens:
+            response = await client.get("/courses/enrollments", headers=headers)
+            response.raise_for_status()
+            enrollments.append(response.json())
+
+        def auth(i):
+            return tokens[i % len(tokens)]
+
+        async def public_catalog(i):
+            return (await client.get("/courses/public")).status_code
+
+        async def catalog(i):
+            return (await client.get("/courses/", headers=auth(i))).status_code
+
+        async def like(i):
+            course_id = random.randint(1, catalog_size)
+            return (await client.post(f"/courses/{course_id}/like", headers=auth(i))).status_code
+
+        # Cada compra usa um par (usuário, curso) diferente
+        owned = {i: {e["course_id"] for e in enrollments[i]} for i in range(len(tokens))}
+
+        async def purchase(i):
+            user = i % len(tokens)
+            candidates = [c for c in range(1, catalog_size + 1) if c not in owned[user]]
+            if not candidates:
+                return 0
+            course_id = random.choice(candidates)
+            owned[user].add(course_id)
+            return (await client.post(f"/courses/{course_id}/purchase", headers=auth(user))).status_code
+
+        async def progress(i):
+            user = i % len(tokens)
+            if not enrollments[user]:
+                return 0
+            code = enrollments[user][0]["enrollment_code"]
+            response = await client.put(
+                f"/courses/enrollment/{code}/progress",
+                headers=auth(user),
+                json={"progress": (i % 99) + 0.5},
+            )
+            return response.status_code
+
+        async def download(i):
+            user = i % len(tokens)
+            if not enrollments[user]:
+                return 0
+            course_id = enrollments[user][0]["course_id"]
+            async with client.stream("GET", f"/courses/{course_id}/download", headers=auth(user)) as response:
+                async for _ in response.aiter_bytes():
+                    pass
+                return response.status_code
+
+        scenarios = [
+            ("login", login, args.login_requests),
+            ("courses_public", public_catalog, args.requests),
+            ("courses_authenticated", catalog, args.requests),
+            ("like_toggle", like, args.requests),
+            ("purchase", purchase, min(args.requests, sum(catalog_size - len(o) for o in owned.values()))),
+            ("enrollment_progress", progress, args.requests),
+            ("download_zip", download, args.requests),
+        ]
+        for name, make_request, count in scenarios:
+            if args.only and name not in args.only:
+                continue
+            recorder = LatencyRecorder()
+            await _drive(recorder, name, count, args.concurrency, make_request)
+            recorder.stop()
+            results.update(recorder.summary())
+    return results
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> bool:
+    """Mostra as diferenças para o baseline; devolve False se houver regressões."""
+    ok = True
+    print(f"\n{'tamanho/passo':<36}{'p95 base':>10}{'p95 atual':>10}{'Δp95':>9}{'rps base':>10}{'rps atual':>10}{'Δrps':>9}")
+    for size, steps in current["results"].items():
+        for step, stats in steps.items():
+            base = baseline.get("results", {}).get(size, {}).get(step)
+            if not base:
+                continue
+            p95_delta = (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 if base["p95_ms"] else 0.0
+            rps_delta = (stats["throughput_rps"] - base["throughput_rps"]) / base["throughput_rps"] * 100 if base["throughput_rps"] else 0.0
+            regressed = p95_delta > max_regression or rps_delta < -max_regression
+            ok = ok and not regressed
+            print(
+                f"{size + '/' + step:<36}{base['p95_ms']:>10}{stats['p95_ms']:>10}{p95_delta:>8.1f}%"
+                f"{base['throughput_rps']:>10}{stats['throughput_rps']:>10}{rps_delta:>8.1f}%"
+                f"{'  REGRESSION' if regressed else ''}"
+            )
+    return ok
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks dos endpoints principais")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="tamanhos de catálogo")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="pedidos por endpoint")
+    parser.add_argument("--login-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--zip-kb", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=42, help="semente do gerador de dados")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--gateway-port", type=int, default=8766)
+    parser.add_argument("--gateway-latency-ms", type=float, default=20)
+    parser.add_argument("--only", nargs="*", help="correr só estes passos")
+    parser.add_argument("--output", help="gravar os resultados em JSON")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="tolerância em %% para p95 e throughput")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": {},
+    }
+
+    for size in args.sizes:
+        print(f"\n== catálogo com {size} cursos ==")
+        environment = Environment(size, args)
+        try:
+            usernames = seed(environment, args.users)
+            environment.start()
+            results = asyncio.run(run_scenarios(f"http://127.0.0.1:{args.port}", size, args, usernames))
+        finally:
+            environment.stop()
+        report["results"][str(size)] = results
+        print_summary(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados gravados em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
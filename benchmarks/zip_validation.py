@@ -0,0 +1,130 @@
+"""Throughput da validação de arquivos de curso (zip_validation.py).
+
+Gera um arquivo com o tamanho pedido, parecido com um curso real: a maior
+parte em entradas STORED de dados aleatórios (vídeos já comprimidos) e uma
+fração DEFLATED de texto. Mede depois a validação completa (diretório
+central, limites e CRC de cada entrada) num processo e com vários
+processos em paralelo, como no pool de course_validation.py:
+
+    python -m benchmarks.zip_validation --size-mb 4096
+    python -m benchmarks.zip_validation --archive curso.zip --parallel 4
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from zip_validation import ZipLimits, validate_zip
+
+ENTRY_MB = 64
+WRITE_CHUNK = 1 << 20
+WORDS = b"aula modulo exercicio video resumo capitulo introducao pratica ".split()
+# Limites folgados: mede-se o custo das verificações, não os valores de produção
+BENCH_LIMITS = ZipLimits(
+    max_uncompressed_bytes=1 << 50,
+    max_ratio=1000.0,
+    ratio_min_bytes=1 << 20,
+    max_entries=1_000_000,
+)
+
+
+def _text_chunk(rng: random.Random, size: int) -> bytes:
+    out = bytearray()
+    while len(out) < size:
+        out += b" ".join(rng.choices(WORDS, k=4096)) + b"\n"
+    return bytes(out[:size])
+
+
+def build_archive(path: str, size_mb: int, deflated_fraction: float, seed: int):
+    rng = random.Random(seed)
+    deflated_mb = int(size_mb * deflated_fraction)
+    plan = []
+    remaining = size_mb - deflated_mb
+    while remaining > 0:
+        plan.append(("video", min(ENTRY_MB, remaining), zipfile.ZIP_STORED))
+        remaining -= ENTRY_MB
+    remaining = deflated_mb
+    while remaining > 0:
+        plan.append(("notes", min(ENTRY_MB, remaining), zipfile.ZIP_DEFLATED))
+        remaining -= ENTRY_MB
+
+    with zipfile.ZipFile(path, "w", allowZip64=True) as archive:
+        for index, (kind, mb, compression) in enumerate(plan):
+            info = zipfile.ZipInfo(f"modulo_{index // 10:03d}/{kind}_{index:04d}.bin")
+            info.compress_type = compression
+            with archive.open(info, "w", force_zip64=True) as entry:
+                for _ in range(mb):
+                    if compression == zipfile.ZIP_STORED:
+                        entry.write(os.urandom(WRITE_CHUNK))
+                    else:
+                        entry.write(_text_chunk(rng, WRITE_CHUNK))
+
+
+def _timed_validation(path: str):
+    start = time.perf_counter()
+    summary = validate_zip(path, BENCH_LIMITS)
+    return time.perf_counter() - start, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da validação de ZIP")
+    parser.add_argument("--archive", help="validar este arquivo em vez de gerar um")
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--deflated-fraction", type=float, default=0.1)
+    parser.add_argument("--parallel", type=int, default=os.cpu_count() or 1,
+                        help="validações simultâneas no pool de processos")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="gravar o resultado em JSON neste ficheiro")
+    args = parser.parse_args()
+
+    workdir = None
+    path = args.archive
+    if path is None:
+        workdir = tempfile.mkdtemp(prefix="boolen-zip-bench-")
+        path = os.path.join(workdir, "course.zip")
+        start = time.perf_counter()
+        build_archive(path, args.size_mb, args.deflated_fraction, args.seed)
+        print(f"Arquivo de {os.path.getsize(path) / 1024 ** 2:.0f} MB gerado em {time.perf_counter() - start:.1f}s")
+
+    try:
+        archive_mb = os.path.getsize(path) / 1024 ** 2
+        # Primeira leitura aquece a cache de páginas: as medições seguintes não dependem do disco
+        elapsed, summary = _timed_validation(path)
+        elapsed, summary = _timed_validation(path)
+        uncompressed_mb = summary["uncompressed_bytes"] / 1024 ** 2
+        print(f"1 processo: {elapsed:.2f}s, {archive_mb / elapsed:.0f} MB/s do arquivo, "
+              f"{uncompressed_mb / elapsed:.0f} MB/s descomprimidos ({summary['entries']} entradas)")
+
+        with ProcessPoolExecutor(max_workers=args.parallel) as pool:
+            start = time.perf_counter()
+            timings = list(pool.map(_timed_validation, [path] * args.parallel))
+            wall = time.perf_counter() - start
+        aggregate = archive_mb * args.parallel / wall
+        print(f"{args.parallel} processos: {wall:.2f}s no total, {aggregate:.0f} MB/s agregados, "
+              f"{max(t for t, _ in timings):.2f}s a validação mais lenta")
+
+        result = {
+            "archive_mb": round(archive_mb, 1),
+            "uncompressed_mb": round(uncompressed_mb, 1),
+            "entries": summary["entries"],
+            "single_seconds": round(elapsed, 3),
+            "single_mb_per_s": round(archive_mb / elapsed, 1),
+            "parallel": args.parallel,
+            "parallel_wall_seconds": round(wall, 3),
+            "parallel_mb_per_s": round(aggregate, 1),
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+    finally:
+        if workdir is not None:
+            os.remove(path)
+            os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import os
 
 # Configurações
 COURSE_DIR = "courses"
+PROFILES_DIR = "profiles"
 os.makedirs(COURSE_DIR, exist_ok=True)
 os.makedirs(os.path.join(COURSE_DIR, "covers"), exist_ok=True)
 os.makedirs(os.path.join(COURSE_DIR, "files"), exist_ok=True) 
\ No newline at end of file
@@ -0,0 +1,13 @@
+import pytest
+
+from instrumentation import query_budget as _query_budget
+
+
+@pytest.fixture
+def query_budget():
+    """Orçamento de consultas SQL por endpoint.
+
+    Uso: `with query_budget(4): client.get("/courses/", headers=auth)` falha
+    o teste se o pedido executar mais de 4 instruções.
+    """
+    return _query_budget
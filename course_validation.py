@@ -0,0 +1,142 @@
+"""Validação dos arquivos de curso num pool de processos (job `validate_course_file`).
+
+`create_course` grava o curso com `file_status = "pending"` e agenda este
+job. A validação (zip_validation.py) descomprime o arquivo inteiro, por
+isso corre num ProcessPoolExecutor de ZIP_VALIDATION_WORKERS processos e
+não no event loop nem no GIL dos workers HTTP. No fim o curso fica
+`ready` ou `invalid` (com o motivo em `file_error`); só cursos `ready`
+podem ser publicados, comprados ou descarregados.
+
+Sendo um job, uma validação interrompida por um worker que morreu é
+repetida por outro. No shutdown as validações em curso não são esperadas: o
+job volta para a fila e os processos do pool são terminados (a validação só
+lê o arquivo). Se as tentativas se esgotarem o curso fica `invalid` com o
+erro; `POST /courses/{id}/validate` agenda uma nova validação.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from sqlalchemy import select, update
+
+import models
+from engine_config import env_float, env_int
+from jobs import ERROR_MAX_LENGTH, JobContext, JobInterrupted, job_handler, job_runner
+from zip_validation import ZipLimits, ZipValidationError, validate_zip
+
+logger = logging.getLogger(__name__)
+
+ZIP_VALIDATION_WORKERS = env_int("ZIP_VALIDATION_WORKERS", 2)
+ZIP_LIMITS = ZipLimits(
+    max_uncompressed_bytes=env_int("ZIP_MAX_UNCOMPRESSED_BYTES", 16 * 1024 ** 3),
+    max_ratio=env_float("ZIP_MAX_RATIO", 100.0),
+    ratio_min_bytes=env_int("ZIP_RATIO_MIN_BYTES", 1024 ** 2),
+    max_entries=env_int("ZIP_MAX_ENTRIES", 50_000),
+)
+JOB_TYPE = "validate_course_file"
+# Intervalo entre verificações de shutdown enquanto o pool valida
+STOP_CHECK_SECONDS = 0.5
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: os processos não herdam o event loop, as conexões nem as threads do worker
+        _pool = ProcessPoolExecutor(
+            max_workers=ZIP_VALIDATION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _terminate(pool: ProcessPoolExecutor):
+    # O executor não cancela tarefas já a correr: termina-se os processos
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+async def shutdown_validation_pool():
+    """Chamado depois de `job_runner.stop()`: as validações em curso já voltaram para a fila."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.to_thread(_terminate, pool)
+
+
+async def validate_in_pool(path: str, limits: ZipLimits = ZIP_LIMITS, ctx: Optional[JobContext] = None) -> dict:
+    """Valida num processo do pool; com `ctx`, levanta JobInterrupted se o worker parar entretanto."""
+    global _pool
+    future = asyncio.get_running_loop().run_in_executor(_get_pool(), validate_zip, path, limits)
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=STOP_CHECK_SECONDS)
+            if done:
+                return future.result()
+            if ctx is not None and (ctx.lost or ctx.runner.stopping):
+                # Um processo já a validar continua até shutdown_validation_pool() o terminar
+                future.cancel()
+                raise JobInterrupted(ctx.job_id)
+    except BrokenProcessPool:
+        # Um processo morreu (ex.: sem memória): o próximo pedido cria um pool novo
+        _pool = None
+        raise
+
+
+async def enqueue_course_validation(db, course_id: int, requested_by: Optional[int] = None) -> models.Job:
+    return await job_runner.enqueue(
+        db,
+        JOB_TYPE,
+        {"course_id": course_id},
+        dedupe_key=f"{JOB_TYPE}:{course_id}",
+        requested_by=requested_by,
+    )
+
+
+@job_handler(JOB_TYPE)
+async def validate_course_file(ctx: JobContext, payload: dict) -> dict:
+    course_id = payload["course_id"]
+    async with ctx.session_factory() as session:
+        file_path = (await session.execute(
+            select(models.Course.file_path).where(models.Course.id == course_id)
+        )).scalar_one_or_none()
+    if file_path is None:
+        return {"course_id": course_id, "skipped": "course not found"}
+
+    try:
+        summary = await validate_in_pool(file_path, ctx=ctx)
+        values = {"file_status": "ready", "file_error": None}
+    except ZipValidationError as e:
+        summary = {"error": str(e)}
+        values = {"file_status": "invalid", "file_error": str(e)}
+    except FileNotFoundError:
+        summary = {"error": "Course file is missing"}
+        values = {"file_status": "invalid", "file_error": summary["error"]}
+    except JobInterrupted:
+        raise
+    except Exception as e:
+        if ctx.attempt >= ctx.max_attempts:
+            # Sem mais tentativas o curso não pode ficar `pending` para sempre
+            error = f"Validation failed: {type(e).__name__}: {e}"[:ERROR_MAX_LENGTH]
+            await _set_file_status(ctx, course_id, {"file_status": "invalid", "file_error": error})
+        raise
+
+    await _set_file_status(ctx, course_id, values)
+    logger.info("Course %d file %s", course_id, values["file_status"])
+    return {"course_id": course_id, "file_status": values["file_status"], **summary}
+
+
+async def _set_file_status(ctx: JobContext, course_id: int, values: dict):
+    async with ctx.session_factory() as session:
+        await session.execute(
+            update(models.Course.__table__).where(models.Course.id == course_id).values(**values)
+        )
+        await session.commit()
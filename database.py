@@ -1,34 +1,141 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-# Configuração do MySQL
-MYSQL_USER = "avnadmin"
-MYSQL_PASSWORD = "AVNS_ykNZYlJpoMZgLzg37yx"
-MYSQL_HOST = "mysql-3cab6e4e-jorgesebastiao900-366f.k.aivencloud.com"
-MYSQL_PORT = "15277"
-MYSQL_DB = "defaultdb"
+from instrumentation import instrument_engine
+from metrics import instrument_pool
+from engine_config import (
+    configure_engine,
+    primary_settings,
+    replica_settings,
+    REPLICA_MAX_LAG_SECONDS,
+    REPLICA_CHECK_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
 
-# String de conexão para MySQL
-DATABASE_URL = f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}?ssl-mode=REQUIRED"
+# Configuração lida do ambiente (ver engine_config.py)
+settings = primary_settings()
+DATABASE_URL = settings.url
 
 # Criar engine assíncrona
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
-)
+engine = create_async_engine(DATABASE_URL, **settings.engine_kwargs())
+configure_engine(engine, settings)
+instrument_engine(engine)
+instrument_pool("primary", engine)
 
 # Criar fábrica de sessões assíncrona
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
+class Replica:
+    def __init__(self, replica_settings):
+        self.settings = replica_settings
+        self.engine = create_async_engine(replica_settings.url, **replica_settings.engine_kwargs())
+        configure_engine(self.engine, replica_settings)
+        instrument_engine(self.engine)
+        instrument_pool(f"replica:{self.engine.url.host or self.engine.url.database}", self.engine)
+        self.session_factory = sessionmaker(
+            self.engine, class_=AsyncSession, expire_on_commit=False
+        )
+        # Fora da rotação até à primeira medição do atraso
+        self.healthy = False
+        self.lag_seconds = 0.0
+
+    async def check_lag(self):
+        """Mede o atraso da réplica; réplicas inacessíveis ou atrasadas saem da rotação."""
+        if self.settings.dialect != "mysql":
+            # Réplicas locais (ex.: cópia SQLite só de leitura) não têm atraso mensurável
+            self.healthy = True
+            return
+        try:
+            async with self.engine.connect() as conn:
+                result = await conn.execute(text("SHOW REPLICA STATUS"))
+                row = result.mappings().first()
+            if row is None:
+                # Não é uma réplica (ex.: ambiente local apontando para a primária)
+                self.lag_seconds = 0.0
+            else:
+                lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+                self.lag_seconds = float(lag) if lag is not None else float("inf")
+            self.healthy = self.lag_seconds <= REPLICA_MAX_LAG_SECONDS
+        except Exception as e:
+            logger.warning("Replica lag check failed for %s: %s", self.engine.url.host, e)
+            self.healthy = False
+
+class ReplicaRouter:
+    """Distribui as leituras pelas réplicas saudáveis, em round-robin."""
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._cycle = itertools.cycle(replicas) if replicas else None
+        self._last_check = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _refresh(self):
+        try:
+            await asyncio.gather(*(replica.check_lag() for replica in self.replicas))
+        finally:
+            self._last_check = time.monotonic()
+
+    def _maybe_refresh(self):
+        if self._task is not None and not self._task.done():
+            return
+        if time.monotonic() - self._last_check < REPLICA_CHECK_SECONDS:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._refresh())
+
+    def start(self):
+        """Mede o atraso logo no arranque; até lá as leituras vão para a primária."""
+        if self.replicas:
+            self._maybe_refresh()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def session_factory(self):
+        if not self.replicas:
+            return AsyncSessionLocal
+        self._maybe_refresh()
+        for _ in range(len(self.replicas)):
+            replica = next(self._cycle)
+            if replica.healthy:
+                return replica.session_factory
+        # Nenhuma réplica dentro do atraso tolerado: ler da primária
+        return AsyncSessionLocal
+
+    async def dispose(self):
+        await self.stop()
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+read_router = ReplicaRouter([Replica(s) for s in replica_settings()])
+
 async def get_db() -> AsyncSession:
     """Dependency para obter uma sessão do banco de dados."""
     async with AsyncSessionLocal() as session:
         try:
             yield session
         finally:
-            await session.close() 
+            await session.close()
+
+async def get_read_db() -> AsyncSession:
+    """Dependency para rotas só de leitura: usa uma réplica quando configurada."""
+    async with read_router.session_factory()() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
@@ -0,0 +1,181 @@
+"""Registo assíncrono de downloads, acessos e conclusões das matrículas.
+
+As rotas só acrescentam o evento a uma lista em memória; uma task de fundo
+grava-os em `download_events` com INSERT multi-linha a cada
+DOWNLOAD_LOG_FLUSH_SECONDS (ou antes, quando o lote enche) e atualiza
+`course_downloads.last_accessed` de todas as matrículas tocadas num UPDATE
+por lote. O pedido de download não faz nenhuma escrita no banco. Os
+eventos alimentam também os rollups diários (rollups.py).
+
+Com mais de DOWNLOAD_LOG_MAX_PENDING eventos à espera (banco em baixo ou
+lento) os novos eventos são descartados e contados em
+`download_events_total{outcome="dropped"}`. Um lote que falhe a gravar
+volta para o início da fila e é repetido no flush seguinte; se a falha for
+uma restrição violada (ex.: o usuário do evento foi apagado entretanto por
+user_deletion.py), o lote é dividido ao meio até isolar os eventos
+inválidos, e só esses são descartados. São dados analíticos: perder alguns
+não afeta nada.
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from database import AsyncSessionLocal
+from engine_config import env_float, env_int
+from metrics import Counter, registry
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_LOG_FLUSH_SECONDS = env_float("DOWNLOAD_LOG_FLUSH_SECONDS", 2.0)
+DOWNLOAD_LOG_BATCH_SIZE = env_int("DOWNLOAD_LOG_BATCH_SIZE", 1_000)
+DOWNLOAD_LOG_MAX_PENDING = env_int("DOWNLOAD_LOG_MAX_PENDING", 100_000)
+USER_AGENT_MAX_LENGTH = 255
+
+download_events_total = registry.register(Counter(
+    "download_events_total", "Download and access events by outcome", ("outcome",),
+))
+
+
+class DownloadEventLog:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        flush_seconds: float = DOWNLOAD_LOG_FLUSH_SECONDS,
+        batch_size: int = DOWNLOAD_LOG_BATCH_SIZE,
+        max_pending: int = DOWNLOAD_LOG_MAX_PENDING,
+    ):
+        self.session_factory = session_factory
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._events: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def record(
+        self,
+        event_type: str,
+        user_id: int,
+        course_id: int,
+        enrollment_id: Optional[int] = None,
+        user_agent: Optional[str] = None,
+    ):
+        if len(self._events) >= self.max_pending:
+            download_events_total.inc("dropped")
+            return
+        self._events.append({
+            "user_id": user_id,
+            "course_id": course_id,
+            "enrollment_id": enrollment_id,
+            "event_type": event_type,
+            "user_agent": user_agent[:USER_AGENT_MAX_LENGTH] if user_agent else None,
+            "created_at": datetime.utcnow(),
+        })
+        download_events_total.inc("recorded")
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        written = 0
+        while self._events:
+            batch = self._events[:self.batch_size]
+            del self._events[:self.batch_size]
+            written += await self._write_batch(batch)
+        return written
+
+    def _requeue(self, events: List[dict]):
+        """Devolve ao início da fila eventos não gravados, dentro de DOWNLOAD_LOG_MAX_PENDING."""
+        kept = events[:max(0, self.max_pending - len(self._events))]
+        self._events[:0] = kept
+        if len(kept) < len(events):
+            download_events_total.inc("dropped", amount=len(events) - len(kept))
+
+    async def _write_batch(self, batch: List[dict]) -> int:
+        """Grava o lote; se violar uma restrição, divide-o ao meio até isolar os eventos inválidos."""
+        pending = deque([batch])
+        written = 0
+        while pending:
+            part = pending[0]
+            try:
+                await self._write(part)
+            except IntegrityError as exc:
+                pending.popleft()
+                if len(part) == 1:
+                    logger.warning("Dropped download event %s: %s", part[0], exc.orig)
+                    download_events_total.inc("dropped")
+                else:
+                    middle = len(part) // 2
+                    pending.extendleft((part[middle:], part[:middle]))
+                continue
+            except Exception:
+                # Banco em baixo ou lento: o que falta gravar é repetido no próximo flush
+                self._requeue([event for rest in pending for event in rest])
+                raise
+            pending.popleft()
+            download_events_total.inc("written", amount=len(part))
+            written += len(part)
+        return written
+
+    async def _write(self, batch: List[dict]):
+        last_access: Dict[int, datetime] = {}
+        for event in batch:
+            enrollment_id = event["enrollment_id"]
+            if enrollment_id is not None:
+                last_access[enrollment_id] = max(last_access.get(enrollment_id, event["created_at"]), event["created_at"])
+
+        async with self.session_factory() as session:
+            await session.execute(insert(models.DownloadEvent.__table__), batch)
+            if last_access:
+                table = models.CourseDownload.__table__
+                accessed = case(last_access, value=table.c.id)
+                await session.execute(
+                    update(table)
+                    .where(
+                        table.c.id.in_(list(last_access)),
+                        or_(table.c.last_accessed.is_(None), table.c.last_accessed < accessed),
+                    )
+                    .values(last_accessed=accessed)
+                    .execution_options(synchronize_session=False)
+                )
+            await session.commit()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to write download events")
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        # Sem cancelar: um lote a meio da escrita termina antes do flush final
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Lost %d download events on shutdown", len(self._events))
+            download_events_total.inc("dropped", amount=len(self._events))
+            self._events = []
+
+
+download_log = DownloadEventLog()
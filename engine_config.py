@@ -0,0 +1,161 @@
+"""Configuração das engines do banco a partir de variáveis de ambiente.
+
+Variáveis reconhecidas (todas opcionais):
+
+    DATABASE_BACKEND             mysql (padrão) ou sqlite, usado quando não há DATABASE_URL
+    DATABASE_URL                 URL da primária (por omissão, o MySQL de produção)
+    DATABASE_REPLICA_URLS        URLs das réplicas de leitura, separadas por vírgula
+    DB_POOL_SIZE                 conexões mantidas por engine (10)
+    DB_MAX_OVERFLOW              conexões extra em picos (20)
+    DB_POOL_TIMEOUT              segundos à espera de uma conexão livre (30)
+    DB_POOL_RECYCLE              segundos até reciclar uma conexão (1800)
+    DB_POOL_PRE_PING             testar a conexão antes de usar (true)
+    DB_ECHO                      registar cada SQL no log (false)
+    DB_STATEMENT_TIMEOUT_MS      limite por SELECT no servidor, 0 = sem limite (0)
+    DB_REPLICA_MAX_LAG_SECONDS   atraso máximo tolerado numa réplica (5)
+    DB_REPLICA_CHECK_SECONDS     intervalo entre verificações de atraso (10)
+    DB_MIGRATE_ON_STARTUP        aplicar migrações no arranque de cada worker (true)
+
+Só para o backend sqlite (aiosqlite), aplicadas como PRAGMA em cada conexão:
+
+    SQLITE_PATH                  ficheiro do banco (data/database.db)
+    SQLITE_SYNCHRONOUS           NORMAL
+    SQLITE_MMAP_SIZE             bytes mapeados em memória (268435456)
+    SQLITE_BUSY_TIMEOUT_MS       espera por locks antes de falhar (5000)
+    SQLITE_CACHE_SIZE_KB         cache de páginas por conexão (65536)
+"""
+import math
+import os
+from typing import List
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+
+MYSQL_USER = os.getenv("MYSQL_USER", "avnadmin")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "AVNS_ykNZYlJpoMZgLzg37yx")
+MYSQL_HOST = os.getenv("MYSQL_HOST", "mysql-3cab6e4e-jorgesebastiao900-366f.k.aivencloud.com")
+MYSQL_PORT = os.getenv("MYSQL_PORT", "15277")
+MYSQL_DB = os.getenv("MYSQL_DB", "defaultdb")
+
+DEFAULT_DATABASE_URL = (
+    f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}?ssl-mode=REQUIRED"
+)
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join("data", "database.db"))
+BACKENDS = ("mysql", "sqlite")
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+class EngineSettings:
+    def __init__(self, url: str):
+        self.url = url
+        self.pool_size = env_int("DB_POOL_SIZE", 10)
+        self.max_overflow = env_int("DB_MAX_OVERFLOW", 20)
+        self.pool_timeout = env_int("DB_POOL_TIMEOUT", 30)
+        self.pool_recycle = env_int("DB_POOL_RECYCLE", 1800)
+        self.pool_pre_ping = env_bool("DB_POOL_PRE_PING", True)
+        self.echo = env_bool("DB_ECHO", False)
+        self.statement_timeout_ms = env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+
+    @property
+    def dialect(self) -> str:
+        return self.url.split(":", 1)[0].split("+", 1)[0]
+
+    @property
+    def in_memory(self) -> bool:
+        return self.dialect == "sqlite" and (":memory:" in self.url or self.url.endswith("://"))
+
+    def connect_args(self) -> dict:
+        args = {}
+        if self.dialect == "mysql" and self.statement_timeout_ms:
+            # max_execution_time só se aplica a SELECTs, que é o que queremos limitar
+            args["init_command"] = f"SET SESSION max_execution_time={self.statement_timeout_ms}"
+        return args
+
+    def engine_kwargs(self) -> dict:
+        kwargs = {
+            "echo": self.echo,
+            "connect_args": self.connect_args(),
+        }
+        if self.in_memory:
+            # Um único banco em memória partilhado por todas as sessões
+            kwargs["poolclass"] = StaticPool
+            return kwargs
+        if self.dialect == "sqlite":
+            kwargs["poolclass"] = AsyncAdaptedQueuePool
+        kwargs.update({
+            "pool_pre_ping": self.pool_pre_ping,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+        })
+        return kwargs
+
+
+def _sqlite_pragmas():
+    return [
+        ("journal_mode", "WAL"),
+        ("synchronous", os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")),
+        ("mmap_size", env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        ("busy_timeout", env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+        ("cache_size", -env_int("SQLITE_CACHE_SIZE_KB", 64 * 1024)),
+        ("temp_store", "MEMORY"),
+    ]
+
+
+def configure_engine(engine, settings: EngineSettings):
+    """Ajustes por backend que precisam de ser aplicados a cada nova conexão."""
+    if settings.dialect != "sqlite":
+        return
+    pragmas = _sqlite_pragmas()
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+        # pow() só existe em builds do SQLite com as funções matemáticas (ver trending.py)
+        dbapi_connection.create_function("pow", 2, math.pow, deterministic=True)
+
+
+def default_database_url() -> str:
+    backend = os.getenv("DATABASE_BACKEND", "mysql").strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"DATABASE_BACKEND must be one of {BACKENDS}, got {backend!r}")
+    if backend == "sqlite":
+        directory = os.path.dirname(SQLITE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return f"sqlite+aiosqlite:///{SQLITE_PATH}"
+    return DEFAULT_DATABASE_URL
+
+
+def primary_settings() -> EngineSettings:
+    return EngineSettings(os.getenv("DATABASE_URL") or default_database_url())
+
+
+def replica_settings() -> List[EngineSettings]:
+    urls = os.getenv("DATABASE_REPLICA_URLS", "")
+    return [EngineSettings(url.strip()) for url in urls.split(",") if url.strip()]
+
+
+REPLICA_MAX_LAG_SECONDS = env_float("DB_REPLICA_MAX_LAG_SECONDS", 5.0)
+REPLICA_CHECK_SECONDS = env_float("DB_REPLICA_CHECK_SECONDS", 10.0)
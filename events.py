@@ -0,0 +1,259 @@
+"""Pub/sub em memória dos eventos da wallet, consumido pelo stream SSE `/wallet/events`.
+
+As rotas que alteram saldo ou transações publicam aqui depois do commit.
+Cada utilizador tem um buffer curto com os últimos eventos para permitir
+retomar a ligação com o header `Last-Event-ID`. Os ids levam o prefixo do
+processo (`<instância>-<n>`), por isso a retoma só vale para o mesmo
+worker; um id de outro worker ou desconhecido resulta apenas no envio do
+saldo atual, que é sempre o primeiro evento de cada ligação.
+
+O broker é por processo. Com vários workers (serve.py) uma compra ou um
+depósito tratado noutro worker chega pelo relay: a cada
+WALLET_EVENTS_RELAY_SECONDS cada worker lê as `wallet_transactions` novas
+(por id) e publica as dos utilizadores com stream aberto nele, seguidas do
+saldo relido do banco. As que o próprio worker publicou são ignoradas.
+Mudanças de estado de transações já existentes (ex.: um depósito
+`pending` confirmado noutro worker) não têm id novo: só se refletem no
+saldo enviado ao reconectar ou com a transação seguinte.
+
+A rota inscreve-se antes de ler o saldo no banco: um evento publicado
+entre a leitura e o início do stream fica na fila e é enviado a seguir ao
+saldo. A inscrição é também a reserva da vaga em
+MAX_CONNECTIONS_PER_WORKER.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func, select
+
+import models
+from database import AsyncSessionLocal
+from engine_config import env_float
+
+logger = logging.getLogger(__name__)
+
+WALLET_EVENTS_RELAY_SECONDS = env_float("WALLET_EVENTS_RELAY_SECONDS", 1.0)
+RELAY_BATCH = 1_000
+# Ids atribuídos antes de um commit mais lento podem aparecer depois de ids maiores
+RELAY_LOOKBACK_IDS = 200
+SEEN_TRANSACTIONS_KEPT = 10_000
+EVENT_BUFFER_SIZE = 50
+MAX_BUFFERED_USERS = 10_000
+SUBSCRIBER_QUEUE_SIZE = 100
+MAX_CONNECTIONS_PER_WORKER = 1_000
+HEARTBEAT_SECONDS = 15
+
+
+def format_sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class WalletEventBroker:
+    def __init__(
+        self,
+        buffer_size: int = EVENT_BUFFER_SIZE,
+        max_buffered_users: int = MAX_BUFFERED_USERS,
+        max_connections: int = MAX_CONNECTIONS_PER_WORKER,
+        session_factory=AsyncSessionLocal,
+        relay_seconds: float = WALLET_EVENTS_RELAY_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.relay_seconds = relay_seconds
+        self.instance = uuid.uuid4().hex[:8]
+        self.buffer_size = buffer_size
+        self.max_buffered_users = max_buffered_users
+        self.max_connections = max_connections
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._buffers: "OrderedDict[int, deque]" = OrderedDict()
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self.connections = 0
+        # Transações já publicadas neste worker (localmente ou pelo relay)
+        self._seen: Set[int] = set()
+        self._seen_order: deque = deque()
+        self._relayed_up_to: Optional[int] = None
+        self._stopped = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def event_id(self, n: int) -> str:
+        return f"{self.instance}-{n}"
+
+    def publish(self, user_id: int, event: str, data: dict):
+        event_id = next(self._ids)
+        self._last_id = event_id
+
+        buffer = self._buffers.get(user_id)
+        if buffer is None:
+            buffer = self._buffers[user_id] = deque(maxlen=self.buffer_size)
+            if len(self._buffers) > self.max_buffered_users:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(user_id)
+        buffer.append((event_id, event, data))
+
+        for queue in self._subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait((event_id, event, data))
+            except asyncio.QueueFull:
+                # Cliente lento: descarta o evento, ele pode retomar pelo Last-Event-ID
+                pass
+
+    def replay(self, user_id: int, last_event_id: Optional[str]):
+        """Eventos posteriores a `last_event_id` (header Last-Event-ID) ainda presentes no buffer."""
+        instance, _, n = (last_event_id or "").rpartition("-")
+        if instance != self.instance or not n.isdigit() or int(n) > self._last_id:
+            return []
+        return [e for e in self._buffers.get(user_id, ()) if e[0] > int(n)]
+
+    def _mark_seen(self, transaction_id: int) -> bool:
+        """Regista a transação como publicada; False se já o tinha sido."""
+        if transaction_id in self._seen:
+            return False
+        self._seen.add(transaction_id)
+        self._seen_order.append(transaction_id)
+        if len(self._seen_order) > SEEN_TRANSACTIONS_KEPT:
+            self._seen.discard(self._seen_order.popleft())
+        return True
+
+    def publish_transaction(self, user_id: int, data: dict):
+        if self._mark_seen(data["id"]):
+            self.publish(user_id, "transaction", data)
+
+    def subscribe(self, user_id: int) -> Optional[asyncio.Queue]:
+        """Reserva uma ligação e devolve a fila dos eventos; None sem vagas no worker."""
+        if self.connections >= self.max_connections:
+            return None
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        self.connections += 1
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None and queue in queues:
+            queues.discard(queue)
+            self.connections -= 1
+            if not queues:
+                del self._subscribers[user_id]
+
+    async def stream(self, user_id: int, queue: asyncio.Queue, snapshot: dict, missed: List[tuple]):
+        """Gerador SSE: saldo atual, eventos perdidos, depois eventos ao vivo com heartbeat.
+
+        `queue` vem de `subscribe()` e `missed` de `replay()`, lido logo a
+        seguir à inscrição para não repetir eventos que já estejam na fila.
+        """
+        replayed_up_to = missed[-1][0] if missed else 0
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse("balance", snapshot)
+            for event_id, event, data in missed:
+                yield format_sse(event, data, self.event_id(event_id))
+            while True:
+                try:
+                    event_id, event, data = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if event_id > replayed_up_to:
+                    yield format_sse(event, data, self.event_id(event_id))
+        finally:
+            self.unsubscribe(user_id, queue)
+
+    async def relay(self) -> int:
+        """Publica as transações gravadas por outros workers para quem tem stream aberto aqui."""
+        tx, wallets = models.WalletTransaction, models.Wallet
+        async with self.session_factory() as session:
+            if self._relayed_up_to is None or not self._subscribers:
+                # Sem streams abertos só se avança a marca: nada a enviar
+                self._relayed_up_to = (await session.execute(select(func.max(tx.id)))).scalar() or 0
+                return 0
+            result = await session.execute(
+                select(tx.id, tx.amount, tx.transaction_type, tx.status, tx.payment_ref, wallets.user_id)
+                .join(wallets, wallets.id == tx.wallet_id)
+                .where(tx.id > self._relayed_up_to - RELAY_LOOKBACK_IDS)
+                .order_by(tx.id)
+                .limit(RELAY_BATCH + RELAY_LOOKBACK_IDS)
+            )
+            rows = result.all()
+            if rows:
+                self._relayed_up_to = max(self._relayed_up_to, rows[-1].id)
+            foreign = [row for row in rows if row.user_id in self._subscribers and row.id not in self._seen]
+            if not foreign:
+                return 0
+            users = {row.user_id for row in foreign}
+            result = await session.execute(
+                select(wallets.user_id, wallets.balance).where(wallets.user_id.in_(users))
+            )
+            balances = dict(result.all())
+        for row in foreign:
+            self.publish_transaction(row.user_id, {
+                "id": row.id,
+                "amount": row.amount,
+                "type": row.transaction_type,
+                "status": row.status,
+                "payment_ref": row.payment_ref,
+            })
+        for user_id in users:
+            self.publish(user_id, "balance", {"balance": balances.get(user_id) or 0.0})
+        return len(foreign)
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            try:
+                await self.relay()
+            except Exception:
+                logger.exception("Wallet event relay failed")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.relay_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self.relay_seconds > 0 and self._task is None:
+            self._stopped.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopped.set()
+            await self._task
+            self._task = None
+
+
+def publish_balance(user_id: int, balance: float):
+    wallet_events.publish(user_id, "balance", {"balance": balance})
+
+
+def publish_transaction(user_id: int, transaction):
+    wallet_events.publish_transaction(user_id, {
+        "id": transaction.id,
+        "amount": transaction.amount,
+        "type": transaction.transaction_type,
+        "status": transaction.status,
+        "payment_ref": transaction.payment_ref,
+    })
+
+
+def publish_transactions(user_id: int, rows: Iterable[dict]):
+    """Como `publish_transaction`, para linhas gravadas com INSERT em lote (com o `id` já lido)."""
+    for row in rows:
+        wallet_events.publish_transaction(user_id, {
+            "id": row["id"],
+            "amount": row["amount"],
+            "type": row["transaction_type"],
+            "status": row["status"],
+            "payment_ref": row["payment_ref"],
+        })
+
+
+wallet_events = WalletEventBroker()
@@ -0,0 +1,201 @@
+"""Sparse fieldsets: `?fields=id,title,price,cover_image`.
+
+Cada rota que aceita `fields` declara um `SparseFields(schema, modelo ORM)`
+como dependência. Os campos pedidos são validados contra o schema de
+resposta; campos de modelos aninhados usam ponto (`course.title`,
+`courses_created.instructor.username`) e um campo aninhado sozinho
+(`course`) traz o modelo inteiro. Sem `fields` a rota responde como antes.
+
+A seleção limita as duas pontas:
+
+    SQL        load_only só das colunas pedidas (mais chave primária e
+               chaves estrangeiras das relações) e selectinload só das
+               relações pedidas
+    resposta   um modelo pydantic gerado só com esses campos, serializado
+               direto para JSON
+
+Gerar o modelo e o TypeAdapter é caro, por isso cada combinação
+(schema, fields) fica num cache LRU de FIELDSET_CACHE_SIZE entradas
+(métrica `fieldsets`); um pedido repetido custa só uma consulta ao dict.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union, get_args, get_origin
+
+from fastapi import HTTPException, Query, Response
+from pydantic import BaseModel, ConfigDict, TypeAdapter, create_model
+from sqlalchemy import inspect
+from sqlalchemy.orm import RelationshipProperty, load_only, selectinload
+
+from engine_config import env_int
+from metrics import register_cache
+
+FIELDSET_CACHE_SIZE = env_int("FIELDSET_CACHE_SIZE", 512)
+FIELDS_MAX_LENGTH = 1000
+
+# nome do campo -> None (escalar) ou a árvore do modelo aninhado
+FieldTree = Dict[str, Optional[dict]]
+
+
+def _nested_model(annotation) -> Optional[type]:
+    """O modelo pydantic dentro de uma anotação (`Course`, `List[Course]`, `Optional[User]`)."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        nested = _nested_model(arg)
+        if nested is not None:
+            return nested
+    return None
+
+
+def _replace_model(annotation, old: type, new: type):
+    if annotation is old:
+        return new
+    origin = get_origin(annotation)
+    if origin is None:
+        return annotation
+    args = tuple(_replace_model(arg, old, new) for arg in get_args(annotation))
+    return Union[args] if origin is Union else origin[args]
+
+
+def _full_tree(model: type) -> FieldTree:
+    tree = {}
+    for name, field in model.model_fields.items():
+        nested = _nested_model(field.annotation)
+        tree[name] = _full_tree(nested) if nested is not None else None
+    return tree
+
+
+def _parse(schema: type, raw: str) -> FieldTree:
+    tree: FieldTree = {}
+    unknown = []
+    for path in raw.split(","):
+        path = path.strip()
+        if not path:
+            continue
+        node, model = tree, schema
+        parts = path.split(".")
+        for depth, name in enumerate(parts):
+            field = model.model_fields.get(name)
+            nested = _nested_model(field.annotation) if field is not None else None
+            if field is None or (depth < len(parts) - 1 and nested is None):
+                unknown.append(path)
+                break
+            if depth == len(parts) - 1:
+                node[name] = _full_tree(nested) if nested is not None else None
+            else:
+                if node.get(name) is None:
+                    node[name] = {}
+                node, model = node[name], nested
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if not tree:
+        raise HTTPException(status_code=400, detail="fields must not be empty")
+    return tree
+
+
+def _build_model(model: type, tree: FieldTree) -> type:
+    definitions = {}
+    # Pela ordem do schema, não pela do pedido
+    for name, field in model.model_fields.items():
+        if name not in tree:
+            continue
+        annotation = field.annotation
+        if tree[name] is not None:
+            nested = _nested_model(annotation)
+            annotation = _replace_model(annotation, nested, _build_model(nested, tree[name]))
+        definitions[name] = (annotation, ... if field.is_required() else field.default)
+    return create_model(model.__name__, __config__=ConfigDict(from_attributes=True), **definitions)
+
+
+def _loader_options(entity, tree: FieldTree, partial: bool, extra=()) -> list:
+    mapper = inspect(entity)
+    columns = {column.key for column in mapper.primary_key}
+    columns.update(attribute.key for attribute in extra)
+    options = []
+    for name, subtree in tree.items():
+        prop = mapper.attrs.get(name)
+        if prop is None:
+            # Campo calculado na rota, sem coluna
+            continue
+        if isinstance(prop, RelationshipProperty):
+            # A relação precisa das suas chaves locais para ser carregada
+            columns.update(mapper.get_property_by_column(column).key for column in prop.local_columns)
+            nested = _loader_options(prop.mapper.class_, subtree or {}, partial)
+            options.append(selectinload(getattr(entity, name)).options(*nested))
+        else:
+            columns.add(name)
+    if partial:
+        options.insert(0, load_only(*(getattr(entity, key) for key in sorted(columns))))
+    return options
+
+
+class FieldSelection:
+    """Uma combinação validada de campos, com o serializador já construído."""
+    __slots__ = ("tree", "_one", "_many")
+
+    def __init__(self, schema: type, tree: FieldTree):
+        self.tree = tree
+        model = _build_model(schema, tree)
+        self._one = TypeAdapter(model)
+        self._many = TypeAdapter(List[model])
+
+    def render(self, data) -> Response:
+        adapter = self._many if isinstance(data, (list, tuple)) else self._one
+        return Response(adapter.dump_json(adapter.validate_python(data)), media_type="application/json")
+
+
+class FieldSelectionCache:
+    def __init__(self, size: int = FIELDSET_CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[tuple, FieldSelection]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schema: type, raw: str) -> FieldSelection:
+        key = (schema, raw)
+        selection = self._entries.get(key)
+        if selection is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return selection
+        self.misses += 1
+        # Campos inválidos levantam antes de entrar no cache
+        selection = FieldSelection(schema, _parse(schema, raw))
+        self._entries[key] = selection
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return selection
+
+
+selection_cache = FieldSelectionCache()
+register_cache("fieldsets", selection_cache)
+
+
+class SparseFields:
+    """Dependência `fields` para as rotas que devolvem `schema`, lido de `entity`."""
+
+    def __init__(self, schema: type, entity):
+        self.schema = schema
+        self.entity = entity
+        self._full_tree = _full_tree(schema)
+
+    def __call__(
+        self,
+        fields: Optional[str] = Query(
+            None,
+            max_length=FIELDS_MAX_LENGTH,
+            description="Campos a devolver, separados por vírgula (ex.: id,title,course.title)",
+        ),
+    ) -> Optional[FieldSelection]:
+        if fields is None:
+            return None
+        return selection_cache.get(self.schema, fields)
+
+    def load_options(self, selection: Optional[FieldSelection], *extra) -> list:
+        """Opções de carregamento para a seleção; sem seleção carrega todas as relações do schema.
+
+        `extra` são atributos que a rota lê ela própria, fora da resposta.
+        """
+        if selection is None:
+            return _loader_options(self.entity, self._full_tree, partial=False)
+        return _loader_options(self.entity, selection.tree, partial=True, extra=extra)
@@ -0,0 +1,153 @@
+"""Suporte ao header `Idempotency-Key`.
+
+As chaves ficam na tabela `idempotency_keys`, única por
+(scope, user_id, key), por isso valem para todos os workers do serve.py.
+O primeiro pedido insere a linha em `in_progress` e executa; a resposta
+fica guardada durante IDEMPOTENCY_TTL_SECONDS. Repetições, em qualquer
+worker, recebem a resposta guardada e pedidos concorrentes com a mesma
+chave esperam (relendo a linha) que o primeiro termine, em vez de repetir
+as chamadas ao gateway e as escritas no banco. A linha `in_progress` de um
+worker que morreu a meio expira ao fim de IDEMPOTENCY_LOCK_SECONDS.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from database import AsyncSessionLocal
+from metrics import register_cache
+
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_LOCK_SECONDS = 5 * 60
+IDEMPOTENCY_WAIT_SECONDS = 30
+IDEMPOTENCY_POLL_SECONDS = 0.2
+IDEMPOTENCY_PURGE_SECONDS = 60 * 60
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hash do conteúdo do pedido, para detectar chaves reutilizadas com outro corpo."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS,
+        lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS,
+        wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self._next_purge = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    async def _claim(self, session, scope: str, user_id: int, key: str, fingerprint: str):
+        """Insere a chave; devolve `(id, None)` se ficou com ela ou `(None, linha existente)`."""
+        table = models.IdempotencyKey.__table__
+        now = datetime.utcnow()
+        same_key = (table.c.scope == scope, table.c.user_id == user_id, table.c.key == key)
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + IDEMPOTENCY_PURGE_SECONDS
+            await session.execute(delete(table).where(table.c.expires_at <= now))
+        else:
+            await session.execute(delete(table).where(*same_key, table.c.expires_at <= now))
+        try:
+            result = await session.execute(insert(table).values(
+                scope=scope,
+                user_id=user_id,
+                key=key,
+                fingerprint=fingerprint,
+                status="in_progress",
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.lock_seconds),
+            ))
+            await session.commit()
+            return result.inserted_primary_key[0], None
+        except IntegrityError:
+            await session.rollback()
+        result = await session.execute(
+            select(table.c.fingerprint, table.c.status, table.c.response).where(*same_key)
+        )
+        row = result.first()
+        await session.commit()
+        return None, row
+
+    async def run(
+        self,
+        scope: str,
+        user_id: int,
+        key: Optional[str],
+        fingerprint: str,
+        handler: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """Executa `handler` uma única vez por chave.
+
+        Devolve `(resposta, repetido)`. Sem chave, o handler é sempre executado.
+        Erros não são guardados: a chave é libertada e o próximo pedido tenta de novo.
+        """
+        if key is None:
+            return await handler(), False
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key header")
+
+        table = models.IdempotencyKey.__table__
+        deadline = time.monotonic() + self.wait_seconds
+        async with self.session_factory() as session:
+            while True:
+                entry_id, row = await self._claim(session, scope, user_id, key, fingerprint)
+                if entry_id is not None:
+                    break
+                if row is None:
+                    # Expirou ou foi libertada entre o INSERT e a leitura
+                    continue
+                if row.fingerprint != fingerprint:
+                    raise HTTPException(
+                        status_code=422,
+                        detail="Idempotency-Key was already used with a different request"
+                    )
+                if row.status == "completed":
+                    self.hits += 1
+                    return row.response, True
+                if time.monotonic() >= deadline:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="A request with this Idempotency-Key is still in progress"
+                    )
+                await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+            self.misses += 1
+            try:
+                response = await handler()
+            except BaseException:
+                await session.execute(delete(table).where(table.c.id == entry_id))
+                await session.commit()
+                raise
+
+            # Guardada como JSON: a repetição devolve o mesmo corpo que o primeiro pedido
+            response = jsonable_encoder(response)
+            now = datetime.utcnow()
+            await session.execute(
+                update(table)
+                .where(table.c.id == entry_id)
+                .values(status="completed", response=response, expires_at=now + timedelta(seconds=self.ttl_seconds))
+            )
+            await session.commit()
+        return response, False
+
+
+idempotency_store = IdempotencyStore()
+register_cache("idempotency", idempotency_store)
@@ -0,0 +1,144 @@
+"""Contagem e tempo das instruções SQL por pedido HTTP.
+
+Os hooks do SQLAlchemy somam cada instrução executada ao pedido corrente
+(via contextvar). No fim do pedido:
+
+- com SQL_DEBUG_HEADERS=true a resposta leva `X-DB-Queries` e `X-DB-Time` (ms);
+- instruções mais lentas que SQL_SLOW_QUERY_MS são registadas no log;
+- a mesma instrução repetida SQL_N_PLUS_ONE_THRESHOLD vezes gera um aviso de N+1.
+
+Nos testes, `query_budget(n)` falha se algum pedido feito dentro do bloco
+executar mais de `n` instruções (ver a fixture em conftest.py).
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+
+from engine_config import env_bool, env_float, env_int
+
+logger = logging.getLogger("sql")
+
+DEBUG_HEADERS = env_bool("SQL_DEBUG_HEADERS", False)
+SLOW_QUERY_MS = env_float("SQL_SLOW_QUERY_MS", 200.0)
+N_PLUS_ONE_THRESHOLD = env_int("SQL_N_PLUS_ONE_THRESHOLD", 10)
+SLOWEST_KEPT = 5
+
+
+class QueryStats:
+    __slots__ = ("count", "total_seconds", "statements", "slowest", "route")
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.statements = Counter()
+        self.slowest = []
+        self.route = None
+
+    def add(self, statement: str, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.statements[statement] += 1
+        if len(self.slowest) < SLOWEST_KEPT or seconds > self.slowest[-1][0]:
+            self.slowest.append((seconds, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[SLOWEST_KEPT:]
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("sql_query_stats", default=None)
+# Lista ativa durante query_budget(); recebe as estatísticas de cada pedido concluído
+_captured: Optional[List[QueryStats]] = None
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add(statement, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement[:500])
+
+
+def instrument_engine(engine):
+    """Instala os hooks numa engine assíncrona (primária ou réplica)."""
+    sync_engine = engine.sync_engine
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _report(scope, stats: QueryStats):
+    route = scope.get("route")
+    stats.route = getattr(route, "path", scope.get("path"))
+    repeated = [(sql, n) for sql, n in stats.statements.items() if n >= N_PLUS_ONE_THRESHOLD]
+    for sql, n in repeated:
+        logger.warning(
+            "Possible N+1 in %s %s: statement executed %d times: %s",
+            scope.get("method"), stats.route, n, sql[:300]
+        )
+    if _captured is not None:
+        _captured.append(stats)
+
+
+class SQLInstrumentationMiddleware:
+    """Middleware ASGI que abre as estatísticas do pedido e publica os headers."""
+
+    def __init__(self, app, debug_headers: bool = DEBUG_HEADERS):
+        self.app = app
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+
+        async def send_wrapper(message):
+            if self.debug_headers and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(stats.count).encode()))
+                headers.append((b"x-db-time", f"{stats.total_seconds * 1000:.2f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_stats.reset(token)
+            _report(scope, stats)
+
+
+@contextmanager
+def query_budget(max_queries: int):
+    """Falha se algum pedido feito dentro do bloco exceder `max_queries` instruções SQL."""
+    global _captured
+    previous, _captured = _captured, []
+    captured = _captured
+    try:
+        yield captured
+    finally:
+        _captured = previous
+    for stats in captured:
+        if stats.count > max_queries:
+            detail = "\n".join(
+                f"  {n}x {sql[:200]}" for sql, n in stats.statements.most_common()
+            )
+            raise AssertionError(
+                f"{stats.route} executed {stats.count} queries "
+                f"(budget {max_queries}):\n{detail}"
+            )
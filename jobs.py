@@ -0,0 +1,284 @@
+"""Jobs de fundo persistidos na tabela `jobs`.
+
+Operações pesadas de admin (ex.: apagar um usuário com milhares de linhas
+associadas) não correm no pedido: a rota chama `job_runner.enqueue()` e
+devolve o id do job, que se acompanha em `GET /admin/jobs/{id}`.
+
+Cada processo corre JOBS_CONCURRENCY workers (tasks asyncio). Um worker
+reclama o job mais antigo em `queued` com um UPDATE condicional
+(`WHERE id = :id AND status = 'queued'`), por isso vários processos podem
+partilhar a fila sem locks. Enquanto corre, o job renova `heartbeat_at` a
+cada JOBS_HEARTBEAT_SECONDS; um job em `running` sem heartbeat há mais de
+JOBS_STALE_SECONDS (worker morto a meio) volta para a fila, até
+`max_attempts` tentativas. Um handler que falha também é repetido, com
+espera crescente entre tentativas.
+
+Os handlers registam-se com `@job_handler("tipo")` e recebem um
+`JobContext` e o payload. Como um job pode ser repetido do início, têm de
+ser idempotentes e trabalhar em transações curtas, chamando
+`ctx.progress()` entre blocos; é aí que um shutdown interrompe o job, que
+volta para a fila sem gastar uma tentativa.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import select, update
+
+import models
+from database import AsyncSessionLocal
+from engine_config import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+JOBS_CONCURRENCY = env_int("JOBS_CONCURRENCY", 2)
+JOBS_POLL_SECONDS = env_float("JOBS_POLL_SECONDS", 5.0)
+JOBS_HEARTBEAT_SECONDS = env_float("JOBS_HEARTBEAT_SECONDS", 10.0)
+JOBS_STALE_SECONDS = env_float("JOBS_STALE_SECONDS", 120.0)
+JOBS_MAX_ATTEMPTS = env_int("JOBS_MAX_ATTEMPTS", 3)
+JOBS_RETRY_DELAY_SECONDS = env_float("JOBS_RETRY_DELAY_SECONDS", 30.0)
+ACTIVE_STATUSES = ("queued", "running")
+ERROR_MAX_LENGTH = 2000
+
+HANDLERS: Dict[str, Callable[["JobContext", dict], Awaitable[Optional[dict]]]] = {}
+
+
+def job_handler(job_type: str):
+    """Regista a função que executa os jobs de um tipo; o que devolver fica em `result`."""
+    def decorator(fn):
+        HANDLERS[job_type] = fn
+        return fn
+    return decorator
+
+
+class JobInterrupted(Exception):
+    """O worker está a parar ou perdeu o job; o trabalho feito fica, o resto volta para a fila."""
+
+
+class JobContext:
+    def __init__(self, runner: "JobRunner", job_id: int, attempt: int, max_attempts: int = JOBS_MAX_ATTEMPTS):
+        self.runner = runner
+        self.job_id = job_id
+        self.attempt = attempt
+        self.max_attempts = max_attempts
+        self.session_factory = runner.session_factory
+        self.lost = False
+
+    def _owned(self):
+        table = models.Job.__table__
+        return update(table).where(
+            table.c.id == self.job_id,
+            table.c.status == "running",
+            table.c.worker == self.runner.worker_id,
+        )
+
+    async def progress(self, processed: int, total: Optional[int] = None):
+        """Grava o avanço; é também o ponto em que o job pode ser interrompido."""
+        values = {"processed": processed, "heartbeat_at": datetime.utcnow()}
+        if total is not None:
+            values["total"] = total
+        async with self.session_factory() as session:
+            result = await session.execute(self._owned().values(**values))
+            await session.commit()
+        if result.rowcount != 1:
+            self.lost = True
+        if self.lost or self.runner.stopping:
+            raise JobInterrupted(self.job_id)
+
+    async def heartbeat(self):
+        async with self.session_factory() as session:
+            result = await session.execute(self._owned().values(heartbeat_at=datetime.utcnow()))
+            await session.commit()
+        if result.rowcount != 1:
+            self.lost = True
+
+
+class JobRunner:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        concurrency: int = JOBS_CONCURRENCY,
+        poll_seconds: float = JOBS_POLL_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    async def enqueue(
+        self,
+        db,
+        job_type: str,
+        payload: dict,
+        dedupe_key: Optional[str] = None,
+        requested_by: Optional[int] = None,
+        max_attempts: int = JOBS_MAX_ATTEMPTS,
+    ) -> models.Job:
+        """Grava o job na fila; com `dedupe_key` devolve o job ativo com a mesma chave, se houver."""
+        if job_type not in HANDLERS:
+            raise ValueError(f"Unknown job type {job_type!r}")
+        if dedupe_key is not None:
+            result = await db.execute(
+                select(models.Job)
+                .where(models.Job.dedupe_key == dedupe_key, models.Job.status.in_(ACTIVE_STATUSES))
+                .order_by(models.Job.id.desc())
+                .limit(1)
+            )
+            existing = result.scalar_one_or_none()
+            if existing is not None:
+                return existing
+        now = datetime.utcnow()
+        job = models.Job(
+            job_type=job_type,
+            payload=payload,
+            dedupe_key=dedupe_key,
+            status="queued",
+            attempts=0,
+            max_attempts=max_attempts,
+            processed=0,
+            requested_by=requested_by,
+            run_after=now,
+            created_at=now,
+        )
+        db.add(job)
+        await db.commit()
+        self._wakeup.set()
+        return job
+
+    async def _claim(self) -> Optional[models.Job]:
+        table = models.Job.__table__
+        now = datetime.utcnow()
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(table.c.id)
+                .where(table.c.status == "queued", table.c.run_after <= now)
+                .order_by(table.c.id)
+                .limit(self.concurrency)
+            )
+            for job_id in result.scalars().all():
+                claimed = await session.execute(
+                    update(table)
+                    .where(table.c.id == job_id, table.c.status == "queued")
+                    .values(
+                        status="running",
+                        worker=self.worker_id,
+                        attempts=table.c.attempts + 1,
+                        started_at=now,
+                        heartbeat_at=now,
+                    )
+                )
+                await session.commit()
+                if claimed.rowcount == 1:
+                    return await session.get(models.Job, job_id)
+        return None
+
+    async def recover_stale(self) -> int:
+        """Devolve à fila (ou falha, sem tentativas restantes) os jobs de workers que morreram."""
+        table = models.Job.__table__
+        now = datetime.utcnow()
+        stale = [table.c.status == "running", table.c.heartbeat_at < now - timedelta(seconds=JOBS_STALE_SECONDS)]
+        async with self.session_factory() as session:
+            failed = await session.execute(
+                update(table)
+                .where(*stale, table.c.attempts >= table.c.max_attempts)
+                .values(status="failed", error="Worker lost", worker=None, finished_at=now)
+            )
+            requeued = await session.execute(
+                update(table)
+                .where(*stale)
+                .values(status="queued", worker=None, run_after=now)
+            )
+            await session.commit()
+        if failed.rowcount or requeued.rowcount:
+            logger.warning("Recovered stale jobs: %d requeued, %d failed", requeued.rowcount, failed.rowcount)
+        return requeued.rowcount
+
+    async def _finish(self, context: JobContext, **values):
+        async with self.session_factory() as session:
+            await session.execute(context._owned().values(worker=None, **values))
+            await session.commit()
+
+    async def _keep_alive(self, context: JobContext):
+        while not context.lost:
+            await asyncio.sleep(JOBS_HEARTBEAT_SECONDS)
+            try:
+                await context.heartbeat()
+            except Exception:
+                logger.exception("Heartbeat of job %d failed", context.job_id)
+
+    async def _execute(self, job: models.Job):
+        context = JobContext(self, job.id, job.attempts, job.max_attempts)
+        handler = HANDLERS.get(job.job_type)
+        keep_alive = asyncio.get_running_loop().create_task(self._keep_alive(context))
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for job type {job.job_type!r}")
+            result = await handler(context, job.payload)
+        except JobInterrupted:
+            keep_alive.cancel()
+            if not context.lost:
+                # Parado pelo shutdown: volta para a fila sem contar a tentativa
+                await self._finish(context, status="queued", attempts=job.attempts - 1, run_after=datetime.utcnow())
+            logger.info("Job %d (%s) interrupted", job.id, job.job_type)
+        except Exception as exc:
+            keep_alive.cancel()
+            logger.exception("Job %d (%s) failed on attempt %d", job.id, job.job_type, job.attempts)
+            error = f"{type(exc).__name__}: {exc}"[:ERROR_MAX_LENGTH]
+            if job.attempts < job.max_attempts:
+                delay = JOBS_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+                await self._finish(
+                    context, status="queued", error=error,
+                    run_after=datetime.utcnow() + timedelta(seconds=delay),
+                )
+            else:
+                await self._finish(context, status="failed", error=error, finished_at=datetime.utcnow())
+        else:
+            keep_alive.cancel()
+            await self._finish(
+                context, status="succeeded", result=result, error=None, finished_at=datetime.utcnow(),
+            )
+            logger.info("Job %d (%s) succeeded", job.id, job.job_type)
+
+    async def _worker(self, index: int):
+        next_recovery = 0.0
+        loop = asyncio.get_running_loop()
+        while not self.stopping:
+            try:
+                if index == 0 and loop.time() >= next_recovery:
+                    next_recovery = loop.time() + JOBS_STALE_SECONDS / 2
+                    await self.recover_stale()
+                job = await self._claim()
+                if job is not None:
+                    await self._execute(job)
+                    continue
+            except Exception:
+                logger.exception("Job worker %d failed", index)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if not self._tasks and self.concurrency > 0:
+            self.stopping = False
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker(i)) for i in range(self.concurrency)]
+
+    async def stop(self):
+        # Sem cancelar: os jobs param no próximo ctx.progress() e voltam para a fila
+        if self._tasks:
+            self.stopping = True
+            self._wakeup.set()
+            await asyncio.gather(*self._tasks)
+            self._tasks = []
+
+
+job_runner = JobRunner()
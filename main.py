@@ -1,15 +1,58 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine
-import models
+import logging
+from database import engine, read_router
+from engine_config import env_bool
+from migrations import run_migrations, pending_migrations
+from instrumentation import SQLInstrumentationMiddleware
+from metrics import MetricsMiddleware, render_metrics, snapshot_writer
+from profiling import ProfilingMiddleware
+from progress_buffer import progress_buffer
+from download_log import download_log
+from rollups import rollup_scheduler
+from recommendations import recommender
+from trending import trending
+from events import wallet_events
+from jobs import job_runner
+from course_validation import shutdown_validation_pool
+
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Criar tabelas no banco de dados
-    async with engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+    # Aplicar migrações pendentes (uma única consulta se o esquema já está atualizado)
+    if env_bool("DB_MIGRATE_ON_STARTUP", True):
+        await run_migrations(engine)
+    else:
+        pending = await pending_migrations(engine)
+        if pending:
+            logger.warning("Database schema has %d pending migrations; run `python migrations.py`", len(pending))
+    read_router.start()
+    snapshot_writer.start()
+    progress_buffer.start()
+    download_log.start()
+    rollup_scheduler.start()
+    recommender.start()
+    trending.start()
+    wallet_events.start()
+    job_runner.start()
     yield
+    # Jobs em curso param no próximo bloco e voltam para a fila
+    await job_runner.stop()
+    await shutdown_validation_pool()
+    await wallet_events.stop()
+    await trending.stop()
+    await recommender.stop()
+    await rollup_scheduler.stop()
+    # Gravar o progresso e os eventos pendentes antes de fechar as conexões
+    await progress_buffer.stop()
+    await download_log.stop()
+    await snapshot_writer.stop()
+    # Cancela a medição do atraso das réplicas em curso e fecha as conexões
+    await read_router.dispose()
+    await engine.dispose()
 
 # Configuração do FastAPI
 app = FastAPI(
@@ -24,8 +67,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursor de paginação de /admin/users
+    expose_headers=["X-Next-After-Id", "Link"],
 )
 
+# Contagem de consultas SQL por pedido (headers X-DB-* com SQL_DEBUG_HEADERS=true)
+app.add_middleware(SQLInstrumentationMiddleware)
+# Latência e contagem por rota para o Prometheus (ver /metrics)
+app.add_middleware(MetricsMiddleware)
+# Profiler por pedido, só com X-Profile-Token ou PROFILER_SAMPLE_RATE (ver profiling.py)
+app.add_middleware(ProfilingMiddleware)
+
 # Importar e incluir routers
 from routes.auth import auth_router
 from routes.courses import course_router
@@ -43,7 +95,12 @@ app.include_router(user_router, prefix="/users", tags=["Users"])
 async def root():
     return {"message": "Welcome to Course Management System"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    # Processo único, para desenvolvimento; em produção usar `python serve.py` (vários workers)
     import os
     import uvicorn
     port = int(os.getenv("PORT", 8080))  # Usa 8080 como padrão
@@ -0,0 +1,193 @@
+"""Coleta de ficheiros órfãos em courses/ e profiles/ (job `media_gc`).
+
+Ficheiros ficam sem referência quando um `create_course` falha depois de
+gravar os uploads, quando um usuário troca de foto de perfil com outro nome
+ou quando usuários e cursos são apagados. O GC:
+
+1. lê do banco, em streaming, todos os caminhos referenciados
+   (`courses.cover_image`, `courses.file_path`, `users.profile_picture`)
+   para um set; as matrículas (`course_downloads`) chegam aos ficheiros
+   pelo curso, por isso um curso com alunos mantém os seus;
+2. percorre as pastas com `os.scandir`, em blocos de MEDIA_GC_BATCH
+   entradas numa thread, e compara cada ficheiro com o set;
+3. apaga os órfãos modificados há mais de MEDIA_GC_GRACE_HOURS (um upload
+   ainda por confirmar no banco nunca é apagado).
+
+Por omissão só produz o relatório (`dry_run`), com os bytes recuperáveis.
+
+    python media_gc.py                   # relatório
+    python media_gc.py --delete          # apaga os órfãos
+    POST /admin/media/gc?dry_run=false   # o mesmo, como job
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from itertools import islice
+from typing import Awaitable, Callable, Iterator, Optional, Set, Tuple
+
+from sqlalchemy import select, union
+
+import models
+from config import COURSE_DIR, PROFILES_DIR
+from database import AsyncSessionLocal
+from engine_config import env_float, env_int
+from jobs import job_handler, job_runner
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GC_GRACE_HOURS = env_float("MEDIA_GC_GRACE_HOURS", 24.0)
+MEDIA_GC_BATCH = env_int("MEDIA_GC_BATCH", 1000)
+MEDIA_ROOTS = (COURSE_DIR, PROFILES_DIR)
+REPORT_SAMPLE_SIZE = 20
+JOB_TYPE = "media_gc"
+
+
+def _normalize(path: str) -> str:
+    return os.path.abspath(path)
+
+
+async def referenced_paths(db) -> Set[str]:
+    stmt = union(
+        select(models.Course.cover_image.label("path")).where(models.Course.cover_image.isnot(None)),
+        select(models.Course.file_path).where(models.Course.file_path.isnot(None)),
+        select(models.User.profile_picture).where(models.User.profile_picture.isnot(None)),
+    )
+    result = await db.stream_scalars(stmt)
+    return {_normalize(path) async for path in result}
+
+
+def _walk(root: str) -> Iterator[Tuple[str, int, float]]:
+    """(caminho absoluto, tamanho, mtime) de cada ficheiro, sem seguir links simbólicos."""
+    stack = [_normalize(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        yield entry.path, stat.st_size, stat.st_mtime
+        except FileNotFoundError:
+            continue
+
+
+def _remove(paths) -> Tuple[int, int]:
+    removed = errors = 0
+    for path, size in paths:
+        try:
+            os.remove(path)
+            removed += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            errors += 1
+            logger.warning("Could not remove %s: %s", path, e)
+    return removed, errors
+
+
+async def collect_garbage(
+    session_factory=AsyncSessionLocal,
+    dry_run: bool = True,
+    grace_hours: float = MEDIA_GC_GRACE_HOURS,
+    roots=MEDIA_ROOTS,
+    on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+) -> dict:
+    # As referências são lidas antes de listar: um ficheiro gravado depois é recente e fica
+    async with session_factory() as session:
+        referenced = await referenced_paths(session)
+    cutoff = time.time() - grace_hours * 3600
+
+    report = {
+        "dry_run": dry_run,
+        "grace_hours": grace_hours,
+        "referenced": len(referenced),
+        "scanned_files": 0,
+        "scanned_bytes": 0,
+        "orphaned_files": 0,
+        "reclaimable_bytes": 0,
+        "recent_orphans": 0,
+        "deleted_files": 0,
+        "deleted_bytes": 0,
+        "errors": 0,
+        "sample": [],
+    }
+    for root in roots:
+        entries = _walk(root)
+        while True:
+            batch = await asyncio.to_thread(lambda: list(islice(entries, MEDIA_GC_BATCH)))
+            if not batch:
+                break
+            orphans = []
+            for path, size, mtime in batch:
+                report["scanned_files"] += 1
+                report["scanned_bytes"] += size
+                if path in referenced:
+                    continue
+                if mtime > cutoff:
+                    report["recent_orphans"] += 1
+                    continue
+                report["orphaned_files"] += 1
+                report["reclaimable_bytes"] += size
+                if len(report["sample"]) < REPORT_SAMPLE_SIZE:
+                    report["sample"].append(os.path.relpath(path))
+                orphans.append((path, size))
+            if orphans and not dry_run:
+                removed, errors = await asyncio.to_thread(_remove, orphans)
+                report["deleted_files"] += len(orphans) - errors
+                report["deleted_bytes"] += removed
+                report["errors"] += errors
+            if on_progress is not None:
+                await on_progress(report["scanned_files"])
+
+    logger.info(
+        "Media GC%s: %d of %d files orphaned, %d bytes reclaimable",
+        " (dry run)" if dry_run else "", report["orphaned_files"], report["scanned_files"], report["reclaimable_bytes"],
+    )
+    return report
+
+
+async def enqueue_media_gc(db, dry_run: bool, grace_hours: float, requested_by: int) -> models.Job:
+    return await job_runner.enqueue(
+        db,
+        JOB_TYPE,
+        {"dry_run": dry_run, "grace_hours": grace_hours},
+        dedupe_key=f"{JOB_TYPE}:{'dry_run' if dry_run else 'delete'}",
+        requested_by=requested_by,
+    )
+
+
+@job_handler(JOB_TYPE)
+async def media_gc(ctx, payload: dict) -> dict:
+    return await collect_garbage(
+        ctx.session_factory,
+        dry_run=payload.get("dry_run", True),
+        grace_hours=payload.get("grace_hours", MEDIA_GC_GRACE_HOURS),
+        on_progress=ctx.progress,
+    )
+
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Remove ficheiros de media sem referência no banco")
+    parser.add_argument("--delete", action="store_true", help="apagar os órfãos (por omissão só o relatório)")
+    parser.add_argument("--grace-hours", type=float, default=MEDIA_GC_GRACE_HOURS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    async def _run():
+        try:
+            report = await collect_garbage(dry_run=not args.delete, grace_hours=args.grace_hours)
+            print(json.dumps(report, indent=2))
+        finally:
+            await engine.dispose()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""Métricas em formato de texto Prometheus, servidas em `/metrics`.
+
+Implementação mínima sem dependências: contadores, gauges e histogramas
+com labels, guardados em dicionários por processo. Os pedidos HTTP são
+etiquetados pelo template da rota (`/courses/{course_id}`) e não pelo
+caminho real, para manter poucas séries.
+
+Com vários workers (serve.py define METRICS_DIR), cada worker grava os seus
+valores em `METRICS_DIR/worker-<pid>-<id>.json` a cada
+METRICS_WRITE_SECONDS e no shutdown, e `/metrics` soma os ficheiros de
+todos: qualquer worker que responda ao scrape devolve os totais do
+servidor. Contadores e histogramas de workers que já terminaram passam para
+`retired.json` (o mestre faz isso ao recolher o processo), por isso não
+diminuem quando um worker é reciclado; os gauges contam só os workers vivos.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from engine_config import env_float
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_WRITE_SECONDS = env_float("METRICS_WRITE_SECONDS", 5.0)
+RETIRED_FILE = "retired.json"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @property
+    def cumulative(self) -> bool:
+        """Valores que só crescem: somam-se também os dos workers que já terminaram."""
+        return self.kind in ("counter", "histogram")
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def render(self, values: Dict[Tuple, float]) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in values.items()
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Tuple, float]:
+        return dict(self._values)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+
+class CallbackGauge(Metric):
+    """Gauge lido no momento da recolha; `callback` devolve [(labels, valor)]."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames, callback: Callable[[], Iterable[Tuple[Tuple, float]]], kind: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self) -> Dict[Tuple, float]:
+        return {tuple(labels): value for labels, value in self.callback()}
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [contagens por bucket (não cumulativas) + overflow, soma]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, *labels, value: float):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def collect(self) -> Dict[Tuple, list]:
+        return {labels: [list(counts), total] for labels, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+    def render(self, values: Dict[Tuple, list]) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self) -> Dict[str, Dict[Tuple, object]]:
+        return {metric.name: metric.collect() for metric in self._metrics}
+
+    def merge_into(self, totals: Dict[str, Dict[Tuple, object]], snapshot, cumulative_only: bool = False):
+        for metric in self._metrics:
+            if cumulative_only and not metric.cumulative:
+                continue
+            target = totals.setdefault(metric.name, {})
+            for labels, value in snapshot.get(metric.name, {}).items():
+                target[labels] = metric.merge(target[labels], value) if labels in target else value
+
+    def render(self) -> str:
+        values = self.collect()
+        if os.getenv("METRICS_DIR"):
+            values = _aggregate_workers(values)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(values.get(metric.name, {})))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status",
+    ("method", "route", "status"),
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served",
+))
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route"),
+))
+db_pool_checkouts_total = registry.register(Counter(
+    "db_pool_checkouts_total", "Connections checked out from the pool", ("engine",),
+))
+db_pool_wait_seconds = registry.register(Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled connection", ("engine",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+))
+paychangu_request_duration_seconds = registry.register(Histogram(
+    "paychangu_request_duration_seconds", "Outbound Paychangu API latency",
+    ("operation", "status"),
+))
+
+_pools: Dict[str, object] = {}
+_caches: Dict[str, object] = {}
+
+
+def _pool_stats():
+    for name, pool in _pools.items():
+        for stat in ("size", "checkedout", "overflow"):
+            fn = getattr(pool, stat, None)
+            if fn is not None:
+                yield (name, stat), fn()
+
+
+def _cache_stats(attribute):
+    def collect():
+        for name, cache in _caches.items():
+            yield (name,), getattr(cache, attribute)
+    return collect
+
+
+registry.register(CallbackGauge(
+    "db_pool_connections", "Pool size, checked out and overflow connections",
+    ("engine", "state"), _pool_stats,
+))
+registry.register(CallbackGauge(
+    "cache_hits_total", "Cache hits", ("cache",), _cache_stats("hits"), kind="counter",
+))
+registry.register(CallbackGauge(
+    "cache_misses_total", "Cache misses", ("cache",), _cache_stats("misses"), kind="counter",
+))
+
+
+def register_cache(name: str, cache):
+    """Expõe um cache com atributos `hits` e `misses`."""
+    _caches[name] = cache
+
+
+def instrument_pool(name: str, engine):
+    """Conta checkouts e mede a espera por conexões do pool de uma engine assíncrona."""
+    pool = engine.sync_engine.pool
+    _pools[name] = pool
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        db_pool_checkouts_total.inc(name)
+
+    # Não há evento público antes do checkout: mede-se a espera envolvendo _do_get do pool
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            db_pool_wait_seconds.observe(name, value=time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: contagem, pedidos em curso e latência por rota."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            http_requests_total.inc(method, template, status_holder[0])
+            http_request_duration_seconds.observe(method, template, value=elapsed)
+
+
+def render_metrics() -> str:
+    return registry.render()
+
+
+# --- Agregação entre os workers do serve.py ---------------------------------
+
+_worker_file: Optional[Tuple[int, str]] = None  # (pid, nome do ficheiro deste processo)
+
+
+def _own_file() -> str:
+    global _worker_file
+    # Calculado no próprio worker: o nome não pode ser herdado do mestre no fork
+    if _worker_file is None or _worker_file[0] != os.getpid():
+        _worker_file = (os.getpid(), f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+    return _worker_file[1]
+
+
+def _dump(values) -> dict:
+    return {name: [[list(labels), value] for labels, value in series.items()] for name, series in values.items()}
+
+
+def _load(data) -> dict:
+    return {name: {tuple(labels): value for labels, value in series} for name, series in data.items()}
+
+
+def _read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_retired(directory: str) -> dict:
+    try:
+        return _read_json(os.path.join(directory, RETIRED_FILE))
+    except FileNotFoundError:
+        return {"files": [], "metrics": {}}
+
+
+def write_worker_snapshot():
+    directory = os.getenv("METRICS_DIR")
+    if directory:
+        _write_json(os.path.join(directory, _own_file()), _dump(registry.collect()))
+
+
+def _aggregate_workers(own: dict) -> dict:
+    directory = os.environ["METRICS_DIR"]
+    own_file = _own_file()
+    for _ in range(3):
+        # retired.json primeiro: um worker recolhido entretanto continua a ser lido do seu ficheiro
+        retired = _read_retired(directory)
+        totals = {}
+        registry.merge_into(totals, _load(retired["metrics"]), cumulative_only=True)
+        skip = set(retired["files"]) | {own_file}
+        try:
+            for name in os.listdir(directory):
+                if name.startswith("worker-") and name.endswith(".json") and name not in skip:
+                    registry.merge_into(totals, _load(_read_json(os.path.join(directory, name))))
+        except FileNotFoundError:
+            # Ficheiro passado para retired.json entre o listdir e a leitura: recomeçar
+            continue
+        registry.merge_into(totals, own)
+        return totals
+    logger.warning("Metrics of other workers changed during collection; serving this worker's only")
+    return own
+
+
+def retire_worker(directory: str, pid: int):
+    """Chamado pelo mestre quando um worker termina: guarda os seus contadores em retired.json."""
+    for name in os.listdir(directory):
+        if not (name.startswith(f"worker-{pid}-") and name.endswith(".json")):
+            continue
+        path = os.path.join(directory, name)
+        retired = _read_retired(directory)
+        totals = _load(retired["metrics"])
+        try:
+            registry.merge_into(totals, _load(_read_json(path)), cumulative_only=True)
+        except (OSError, ValueError):
+            logger.warning("Could not read metrics of worker %d", pid)
+            continue
+        # Só interessam os nomes cujo ficheiro ainda existe (ver _aggregate_workers)
+        files = [f for f in retired["files"] if os.path.exists(os.path.join(directory, f))]
+        _write_json(os.path.join(directory, RETIRED_FILE), {"files": files + [name], "metrics": _dump(totals)})
+        os.remove(path)
+
+
+def reset_metrics_dir(directory: str):
+    """Apaga os valores de uma execução anterior do servidor."""
+    for name in os.listdir(directory):
+        if name == RETIRED_FILE or (name.startswith("worker-") and name.endswith((".json", ".tmp"))):
+            os.remove(os.path.join(directory, name))
+
+
+class SnapshotWriter:
+    """Grava os valores deste worker em METRICS_DIR; sem METRICS_DIR não faz nada."""
+
+    def __init__(self, interval: float = METRICS_WRITE_SECONDS):
+        self.interval = interval
+        self._stopped = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                write_worker_snapshot()
+            except OSError:
+                logger.exception("Failed to write the metrics snapshot")
+
+    def start(self):
+        if self._task is None and os.getenv("METRICS_DIR"):
+            self._stopped.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        # O último ciclo grava os valores finais antes de o worker sair
+        if self._task is not None:
+            self._stopped.set()
+            await self._task
+            self._task = None
+
+
+snapshot_writer = SnapshotWriter()
+
+
+def timed_paychangu(operation: str):
+    """Context manager para medir uma chamada ao gateway."""
+    return _PaychanguTimer(operation)
+
+
+class _PaychanguTimer:
+    __slots__ = ("operation", "status", "start")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.status: Optional[int] = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        status = self.status if self.status is not None else "error"
+        paychangu_request_duration_seconds.observe(
+            self.operation, status, value=time.perf_counter() - self.start
+        )
+        return False
@@ -0,0 +1,284 @@
+"""Migrações versionadas do esquema.
+
+A versão aplicada fica na tabela `schema_migrations`. No arranque basta uma
+consulta a essa tabela: se o banco já está na última versão nada mais é
+feito (sem reflexão das tabelas). Migrações novas entram no fim de
+`MIGRATIONS` com a próxima versão e nunca são alteradas depois de publicadas.
+
+Para atualizar antes de reiniciar os workers (com DB_MIGRATE_ON_STARTUP=false):
+
+    python migrations.py            # aplica as migrações pendentes
+    python migrations.py --status   # mostra a versão atual e as pendentes
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.future import select
+
+import models
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_NAME = "boolen_schema_migrations"
+MIGRATION_LOCK_TIMEOUT = 300
+
+schema_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    schema_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+MIGRATIONS = []
+
+
+def migration(version: int, name: str):
+    """Regista uma migração; a função recebe uma Connection síncrona."""
+    def decorator(fn):
+        assert not MIGRATIONS or version == MIGRATIONS[-1][0] + 1, "migration versions must be sequential"
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return decorator
+
+
+def create_tables(conn, *table_names):
+    tables = [models.Base.metadata.tables[name] for name in table_names]
+    models.Base.metadata.create_all(conn, tables=tables, checkfirst=True)
+
+
+def index_exists(conn, table: str, index: str) -> bool:
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        result = conn.execute(text(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index LIMIT 1"
+        ), {"table": table, "index": index})
+    elif dialect == "sqlite":
+        result = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :index"
+        ), {"index": index})
+    else:
+        return False
+    return result.first() is not None
+
+
+def create_index_online(conn, index: str, table: str, columns, unique: bool = False):
+    """Cria o índice sem bloquear escritas (InnoDB online DDL) se ainda não existir."""
+    if index_exists(conn, table, index):
+        return
+    column_list = ", ".join(columns)
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    if conn.dialect.name == "mysql":
+        conn.execute(text(
+            f"CREATE {kind} {index} ON {table} ({column_list}) ALGORITHM=INPLACE LOCK=NONE"
+        ))
+    else:
+        conn.execute(text(f"CREATE {kind} IF NOT EXISTS {index} ON {table} ({column_list})"))
+    logger.info("Created index %s on %s(%s)", index, table, column_list)
+
+
+def add_column(conn, table: str, column: str, ddl: str) -> bool:
+    """Acrescenta a coluna se ainda não existir (bancos novos já a têm pelo baseline)."""
+    if column in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    logger.info("Added column %s.%s", table, column)
+    return True
+
+
+def has_unique(conn, table: str, columns) -> bool:
+    inspector = inspect(conn)
+    candidates = [c["column_names"] for c in inspector.get_unique_constraints(table)]
+    candidates += [i["column_names"] for i in inspector.get_indexes(table) if i.get("unique")]
+    return list(columns) in candidates
+
+
+def fill_codes(conn, table: str, column: str, generate):
+    """Gera os códigos em falta nas linhas que já existiam antes da coluna."""
+    ids = conn.execute(text(f"SELECT id FROM {table} WHERE {column} IS NULL")).scalars().all()
+    for row_id in ids:
+        conn.execute(text(f"UPDATE {table} SET {column} = :code WHERE id = :id"), {"code": generate(), "id": row_id})
+
+
+@migration(1, "baseline schema")
+def _baseline(conn):
+    # Bancos criados pelo antigo create_all já têm estas tabelas: checkfirst torna isto um no-op
+    create_tables(
+        conn,
+        "users", "wallets", "wallet_transactions",
+        "courses", "course_downloads", "course_likes",
+    )
+    # Os mais antigos (como o data/database.db distribuído) ainda não têm estas colunas;
+    # nos bancos criados acima todos os passos seguintes são no-ops
+    add_column(conn, "wallets", "created_at", "DATETIME NULL")
+    if add_column(conn, "courses", "status", "VARCHAR(20) DEFAULT 'draft'"):
+        # Antes dos rascunhos todos os cursos eram públicos
+        conn.execute(text("UPDATE courses SET status = 'published'"))
+    if add_column(conn, "courses", "course_code", "VARCHAR(6) NULL"):
+        fill_codes(conn, "courses", "course_code", models.generate_course_code)
+        create_index_online(conn, "ix_courses_course_code", "courses", ["course_code"], unique=True)
+    if add_column(conn, "course_downloads", "enrollment_code", "VARCHAR(8) NULL"):
+        fill_codes(conn, "course_downloads", "enrollment_code", models.generate_enrollment_code)
+        create_index_online(conn, "uq_course_downloads_enrollment_code", "course_downloads", ["enrollment_code"], unique=True)
+    add_column(conn, "course_downloads", "status", "VARCHAR(20) DEFAULT 'active'")
+    add_column(conn, "course_downloads", "progress", "FLOAT DEFAULT 0")
+    add_column(conn, "course_downloads", "last_accessed", "DATETIME NULL")
+    if not has_unique(conn, "course_downloads", ["user_id", "course_id"]):
+        create_index_online(conn, "uq_user_course", "course_downloads", ["user_id", "course_id"], unique=True)
+    if not has_unique(conn, "course_likes", ["user_id", "course_id"]):
+        create_index_online(conn, "uq_user_course_like", "course_likes", ["user_id", "course_id"], unique=True)
+
+
+@migration(2, "hot path indexes")
+def _hot_path_indexes(conn):
+    create_index_online(conn, "ix_wallet_transactions_payment_ref", "wallet_transactions", ["payment_ref"])
+    create_index_online(conn, "ix_wallet_transactions_wallet_created", "wallet_transactions", ["wallet_id", "created_at"])
+    create_index_online(conn, "ix_course_likes_course_id", "course_likes", ["course_id"])
+    create_index_online(conn, "ix_course_downloads_course_id", "course_downloads", ["course_id"])
+    create_index_online(conn, "ix_courses_status", "courses", ["status"])
+
+
+@migration(3, "download events")
+def _download_events(conn):
+    create_tables(conn, "download_events")
+
+
+@migration(4, "daily course rollups")
+def _daily_rollups(conn):
+    create_tables(conn, "course_daily_stats", "rollup_state")
+
+
+@migration(5, "course trending scores")
+def _course_trending(conn):
+    create_tables(conn, "course_trending")
+
+
+@migration(6, "background jobs")
+def _background_jobs(conn):
+    create_tables(conn, "jobs")
+
+
+@migration(7, "course file validation status")
+def _course_file_status(conn):
+    # Os arquivos já publicados continuam disponíveis
+    add_column(conn, "courses", "file_status", "VARCHAR(20) NOT NULL DEFAULT 'ready'")
+    add_column(conn, "courses", "file_error", "TEXT NULL")
+
+
+@migration(8, "enrollment progress timestamp")
+def _progress_updated_at(conn):
+    # Fica NULL nas matrículas existentes: o primeiro evento de progresso ganha
+    add_column(conn, "course_downloads", "progress_updated_at", "DATETIME NULL")
+
+
+@migration(9, "shared idempotency keys")
+def _idempotency_keys(conn):
+    create_tables(conn, "idempotency_keys")
+
+
+@migration(10, "backfill course trending")
+def _backfill_trending(conn):
+    # Até aqui só havia eventos posteriores ao deploy do ranking; substitui-os pelo histórico
+    from trending import backfill_scores
+    backfill_scores(conn)
+
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def current_version(conn):
+    """Versão aplicada, ou None se a tabela de controlo ainda não existe."""
+    try:
+        result = await conn.execute(select(func.max(schema_migrations.c.version)))
+        return result.scalar() or 0
+    except (OperationalError, ProgrammingError):
+        await conn.rollback()
+        return None
+
+
+async def _acquire_lock(conn):
+    # Vários workers podem arrancar ao mesmo tempo; só um aplica as migrações
+    if conn.dialect.name == "mysql":
+        result = await conn.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"),
+            {"name": MIGRATION_LOCK_NAME, "timeout": MIGRATION_LOCK_TIMEOUT},
+        )
+        if result.scalar() != 1:
+            raise RuntimeError("Timed out waiting for the schema migration lock")
+
+
+async def _release_lock(conn):
+    if conn.dialect.name == "mysql":
+        await conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK_NAME})
+
+
+async def pending_migrations(engine):
+    async with engine.connect() as conn:
+        version = await current_version(conn) or 0
+    return [(v, name) for v, name, _ in MIGRATIONS if v > version]
+
+
+async def run_migrations(engine):
+    """Aplica as migrações pendentes e devolve a lista das que foram aplicadas."""
+    applied = []
+    async with engine.connect() as conn:
+        if await current_version(conn) == LATEST_VERSION:
+            return applied
+
+        await _acquire_lock(conn)
+        try:
+            await conn.run_sync(schema_metadata.create_all)
+            await conn.commit()
+            # Reler depois do lock: outro worker pode ter migrado entretanto
+            version = await current_version(conn) or 0
+            for v, name, fn in MIGRATIONS:
+                if v <= version:
+                    continue
+                logger.info("Applying migration %s: %s", v, name)
+                await conn.run_sync(fn)
+                await conn.execute(
+                    insert(schema_migrations).values(version=v, name=name, applied_at=datetime.utcnow())
+                )
+                await conn.commit()
+                applied.append((v, name))
+        finally:
+            await _release_lock(conn)
+            await conn.commit()
+    return applied
+
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Migrações do esquema do banco")
+    parser.add_argument("--status", action="store_true", help="só mostrar as migrações pendentes")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    async def _run():
+        try:
+            if args.status:
+                pending = await pending_migrations(engine)
+                print(f"Última versão: {LATEST_VERSION}")
+                print(f"Pendentes: {len(pending)}")
+                for v, name in pending:
+                    print(f"  {v}: {name}")
+            else:
+                applied = await run_migrations(engine)
+                for v, name in applied:
+                    print(f"Aplicada {v}: {name}")
+                print(f"Esquema na versão {LATEST_VERSION}")
+        finally:
+            await engine.dispose()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Float, Text, UniqueConstraint
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Date, DateTime, Double, Float, JSON, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -46,11 +46,15 @@ class WalletTransaction(Base):
     wallet_id = Column(Integer, ForeignKey("wallets.id"))
     amount = Column(Float)
     transaction_type = Column(String(50))  # deposit, purchase, etc.
-    payment_ref = Column(String(255), nullable=True)
+    payment_ref = Column(String(255), nullable=True, index=True)
     status = Column(String(50))  # pending, completed, failed
     created_at = Column(DateTime, default=datetime.utcnow)
     wallet = relationship("Wallet", back_populates="transactions")
 
+    __table_args__ = (
+        Index('ix_wallet_transactions_wallet_created', 'wallet_id', 'created_at'),
+    )
+
 class Course(Base):
     __tablename__ = "courses"
 
@@ -64,7 +68,10 @@ class Course(Base):
     file_path = Column(String(255))
     uploaded_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
-    status = Column(String(20), default="draft")  # draft, published, archived
+    status = Column(String(20), default="draft", index=True)  # draft, published, archived
+    # pending até course_validation.py validar o ZIP; depois ready ou invalid
+    file_status = Column(String(20), default="ready", server_default="ready", nullable=False)
+    file_error = Column(Text, nullable=True)
     instructor = relationship("User", back_populates="courses_created")
     downloads = relationship("CourseDownload", back_populates="course")
 
@@ -79,12 +86,13 @@ class CourseDownload(Base):
     id = Column(Integer, primary_key=True, index=True)
     enrollment_code = Column(String(8), unique=True, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))
-    course_id = Column(Integer, ForeignKey("courses.id"))
+    course_id = Column(Integer, ForeignKey("courses.id"), index=True)
     transaction_id = Column(Integer, ForeignKey("wallet_transactions.id"))
     downloaded_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String(20), default="active")  # active, completed, cancelled
     progress = Column(Float, default=0.0)  # Progresso do curso em porcentagem
     last_accessed = Column(DateTime, nullable=True)
+    progress_updated_at = Column(DateTime, nullable=True)  # Última escrita de progresso (last-writer-wins)
     user = relationship("User", back_populates="courses_downloaded")
     course = relationship("Course", back_populates="downloads")
 
@@ -102,7 +110,7 @@ class CourseLike(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    course_id = Column(Integer, ForeignKey("courses.id"))
+    course_id = Column(Integer, ForeignKey("courses.id"), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", backref="course_likes")
@@ -110,4 +118,102 @@ class CourseLike(Base):
 
     __table_args__ = (
         UniqueConstraint('user_id', 'course_id', name='uq_user_course_like'),
+    )
+
+class DownloadEvent(Base):
+    """Registo de downloads e acessos a matrículas, gravado em lote (ver download_log.py)"""
+    __tablename__ = "download_events"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
+    enrollment_id = Column(Integer, ForeignKey("course_downloads.id"), nullable=True)
+    event_type = Column(String(20), nullable=False)  # download, access, completion
+    user_agent = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index('ix_download_events_course_created', 'course_id', 'created_at'),
+        Index('ix_download_events_user_id', 'user_id'),
+    )
+
+class CourseDailyStats(Base):
+    """Totais diários por curso, mantidos incrementalmente por rollups.py"""
+    __tablename__ = "course_daily_stats"
+
+    # Sem chave estrangeira: o histórico de receita fica mesmo que o curso seja apagado
+    course_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    purchases = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+    likes = Column(Integer, default=0, nullable=False)
+    downloads = Column(Integer, default=0, nullable=False)
+    completions = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        Index('ix_course_daily_stats_day', 'day'),
+    )
+
+class RollupState(Base):
+    """High-water mark de cada tabela de origem dos rollups"""
+    __tablename__ = "rollup_state"
+
+    source = Column(String(50), primary_key=True)
+    last_id = Column(Integer, default=0, nullable=False)  # último id já agregado
+    snapshot_id = Column(Integer, default=0, nullable=False)  # maior id visto na execução anterior
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class CourseTrending(Base):
+    """Pontuação de tendência por curso, com decaimento exponencial (ver trending.py)"""
+    __tablename__ = "course_trending"
+
+    course_id = Column(Integer, primary_key=True)
+    score = Column(Double, default=0.0, nullable=False)  # valor no instante updated_ts
+    updated_ts = Column(Double, nullable=False)  # unix timestamp
+
+class Job(Base):
+    """Tarefa de fundo persistida, executada pelos workers de jobs.py"""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    job_type = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    dedupe_key = Column(String(100), nullable=True)  # no máximo um job ativo por chave
+    status = Column(String(20), default="queued", nullable=False)  # queued, running, succeeded, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    processed = Column(Integer, default=0, nullable=False)
+    total = Column(Integer, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    worker = Column(String(100), nullable=True)
+    requested_by = Column(Integer, nullable=True)  # sem chave estrangeira: o admin pode ser apagado
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_jobs_status_run_after', 'status', 'run_after'),
+        Index('ix_jobs_dedupe_key', 'dedupe_key'),
+    )
+
+class IdempotencyKey(Base):
+    """Resposta guardada de um pedido com Idempotency-Key (idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True)
+    scope = Column(String(50), nullable=False)
+    user_id = Column(Integer, nullable=False)  # sem chave estrangeira: as chaves expiram sozinhas
+    key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False)  # in_progress, completed
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('scope', 'user_id', 'key', name='uq_idempotency_scope_user_key'),
+        Index('ix_idempotency_keys_expires_at', 'expires_at'),
     )
\ No newline at end of file
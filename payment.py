@@ -1,12 +1,17 @@
+import os
 import httpx
 from fastapi import HTTPException
 import schemas
+from metrics import timed_paychangu
 from typing import Dict
 
 class PaychanguClient:
-    def __init__(self):
-        self.base_url = "https://api.paychangu.com"
-        self.secret_key = "SEC-TEST-TXufbColCgWYrhZPvABr1jIK6djgMFB7"  # Sua chave secreta
+    def __init__(self, base_url: str = None, secret_key: str = None):
+        # PAYCHANGU_BASE_URL permite apontar para um gateway local (benchmarks/fake_paychangu.py)
+        self.base_url = (base_url or os.getenv("PAYCHANGU_BASE_URL", "https://api.paychangu.com")).rstrip("/")
+        self.secret_key = secret_key or os.getenv(
+            "PAYCHANGU_SECRET_KEY", "SEC-TEST-TXufbColCgWYrhZPvABr1jIK6djgMFB7"
+        )  # Sua chave secreta
         self.headers = {
             "Authorization": f"Bearer {self.secret_key}",
             "accept": "application/json",
@@ -15,16 +20,18 @@ class PaychanguClient:
 
     async def initialize_payment(self, payment: schemas.PaymentInitialize) -> Dict:
         async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/mobile-money/payments/initialize",
-                headers=self.headers,
-                json={
-                    "mobile_money_operator_ref_id": "20be6c20-adeb-4b5b-a7ba-0769820df4fb",
-                    "mobile": payment.mobile,
-                    "amount": payment.amount,
-                    "charge_id": payment.charge_id
-                }
-            )
+            with timed_paychangu("initialize") as timer:
+                response = await client.post(
+                    f"{self.base_url}/mobile-money/payments/initialize",
+                    headers=self.headers,
+                    json={
+                        "mobile_money_operator_ref_id": "20be6c20-adeb-4b5b-a7ba-0769820df4fb",
+                        "mobile": payment.mobile,
+                        "amount": payment.amount,
+                        "charge_id": payment.charge_id
+                    }
+                )
+                timer.status = response.status_code
             
             if response.status_code != 200:
                 raise HTTPException(
@@ -36,10 +43,12 @@ class PaychanguClient:
 
     async def verify_payment_status(self, payment_ref: str) -> Dict:
         async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/mobile-money/payments/{payment_ref}/status",
-                headers=self.headers
-            )
+            with timed_paychangu("verify_status") as timer:
+                response = await client.get(
+                    f"{self.base_url}/mobile-money/payments/{payment_ref}/status",
+                    headers=self.headers
+                )
+                timer.status = response.status_code
             
             if response.status_code != 200:
                 raise HTTPException(
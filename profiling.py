@@ -0,0 +1,185 @@
+"""Profiler estatístico opcional, por pedido.
+
+Um pedido é perfilado quando traz `X-Profile-Token` igual a PROFILER_TOKEN
+(segredo conhecido pelos admins) ou quando é sorteado por
+PROFILER_SAMPLE_RATE (0 desliga). Uma thread amostra a pilha da thread do
+event loop a cada PROFILER_INTERVAL_MS e o resultado é gravado em formato
+"folded" (flamegraph.pl, speedscope) em PROFILER_DIR, que guarda no máximo
+PROFILER_MAX_FILES ficheiros (os mais antigos são apagados).
+
+O event loop é partilhado: as amostras incluem outras tasks que correram
+durante o pedido. Só um pedido é perfilado de cada vez por worker. Sem
+gatilho o custo é a leitura de um header e um número aleatório.
+
+Respostas `text/event-stream` (ex.: `/wallet/events`) não são perfiladas: o
+perfil é descartado quando a resposta começa. Nenhum perfil amostra mais de
+PROFILER_MAX_SECONDS; depois disso a vaga fica livre para outro pedido e o
+perfil é gravado quando o pedido terminar, com o sufixo `_truncated`.
+"""
+import asyncio
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+from engine_config import env_float, env_int
+
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+PROFILER_SAMPLE_RATE = env_float("PROFILER_SAMPLE_RATE", 0.0)
+PROFILER_INTERVAL_MS = env_float("PROFILER_INTERVAL_MS", 5.0)
+PROFILER_DIR = os.getenv("PROFILER_DIR", os.path.join("data", "profiles"))
+PROFILER_MAX_FILES = env_int("PROFILER_MAX_FILES", 50)
+PROFILER_MAX_SECONDS = env_float("PROFILER_MAX_SECONDS", 30.0)
+
+PROFILE_NAME_RE = re.compile(r"^[\w.-]+\.folded$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """Amostra periodicamente a pilha de uma thread e agrega as pilhas iguais."""
+
+    def __init__(self, thread_id: int, interval: float, max_seconds: float = PROFILER_MAX_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.truncated = False
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval):
+            if time.monotonic() >= deadline:
+                self.truncated = True
+                return
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+def _write_profile(path: str, content: str):
+    os.makedirs(PROFILER_DIR, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    # Manter o diretório como um buffer circular
+    profiles = list_profiles()
+    for stale in profiles[PROFILER_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILER_DIR, stale["name"]))
+        except OSError:
+            pass
+
+
+def list_profiles() -> List[dict]:
+    """Perfis gravados, do mais recente para o mais antigo."""
+    if not os.path.isdir(PROFILER_DIR):
+        return []
+    profiles = []
+    for entry in os.scandir(PROFILER_DIR):
+        if entry.is_file() and PROFILE_NAME_RE.match(entry.name):
+            stat = entry.stat()
+            profiles.append({"name": entry.name, "size": stat.st_size, "created_at": stat.st_mtime})
+    profiles.sort(key=lambda p: p["created_at"], reverse=True)
+    return profiles
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Caminho de um perfil pelo nome do ficheiro ou pelo id do header X-Profile-Id."""
+    for profile in list_profiles():
+        if profile["name"] == name or profile["name"].startswith(f"{name}_"):
+            return os.path.join(PROFILER_DIR, profile["name"])
+    return None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, token: str = PROFILER_TOKEN, sample_rate: float = PROFILER_SAMPLE_RATE):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        # Perfil em curso e até quando ocupa a vaga (PROFILER_MAX_SECONDS no máximo)
+        self._owner: Optional[str] = None
+        self._busy_until = 0.0
+
+    def _triggered(self, scope) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        if self.token is None:
+            return False
+        for name, value in scope["headers"]:
+            if name == b"x-profile-token":
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    def _release(self, profile_id: str):
+        if self._owner == profile_id:
+            self._owner = None
+            self._busy_until = 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or time.monotonic() < self._busy_until or not self._triggered(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self._owner = profile_id
+        self._busy_until = time.monotonic() + PROFILER_MAX_SECONDS
+        sampler = StackSampler(threading.get_ident(), PROFILER_INTERVAL_MS / 1000)
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal streaming
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                content_type = next((v for k, v in headers if k == b"content-type"), b"")
+                if content_type.startswith(b"text/event-stream"):
+                    # Stream sem fim: descartar o perfil e libertar já a vaga
+                    streaming = True
+                    sampler.stop()
+                    self._release(profile_id)
+                else:
+                    headers.append((b"x-profile-id", profile_id.encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            self._release(profile_id)
+            if not streaming:
+                elapsed_ms = int((time.perf_counter() - start) * 1000)
+                route = getattr(scope.get("route"), "path", scope["path"])
+                slug = re.sub(r"[^\w-]+", "-", route).strip("-") or "root"
+                suffix = "_truncated" if sampler.truncated else ""
+                name = f"{profile_id}_{scope['method']}_{slug}_{elapsed_ms}ms{suffix}.folded"
+                await asyncio.to_thread(
+                    _write_profile, os.path.join(PROFILER_DIR, name), sampler.folded()
+                )
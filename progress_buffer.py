@@ -0,0 +1,339 @@
+"""Buffer write-behind do progresso das matrículas.
+
+Os players enviam `PUT /courses/enrollment/{code}/progress` a cada poucos
+segundos. Em vez de um SELECT + UPDATE por chamada, as atualizações ficam
+em memória, agrupadas por matrícula (maior progresso e último acesso), e
+são gravadas a cada PROGRESS_FLUSH_SECONDS num UPDATE por lote
+(`CASE id WHEN ...`), e também no shutdown. A conclusão (progresso 100) é
+gravada imediatamente.
+
+O mapeamento código -> (id, dono, concluída) é imutável no essencial e fica
+num cache LRU, por isso as chamadas repetidas não tocam no banco. O buffer é
+por processo: o progresso pode chegar ao banco até PROGRESS_FLUSH_SECONDS
+depois, e perde-se esse intervalo se o worker morrer sem shutdown.
+
+Clientes offline sincronizam vários eventos de uma vez com `sync()`: uma
+consulta resolve todos os códigos, vence o evento mais recente por
+matrícula (last-writer-wins pelo timestamp, comparado com
+`progress_updated_at`) e a escrita é um UPDATE por lote, gravado logo.
+As matrículas escritas são relidas com lock na mesma transação: um evento
+só é `applied` se o UPDATE gravou mesmo o seu timestamp; se uma escrita
+concorrente mais recente ganhou, a resposta é `stale` com o progresso
+gravado.
+O flush do buffer usa a mesma comparação. `last_accessed` também avança com
+acessos e downloads (download_log.py), por isso não entra na comparação.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, or_, select, update
+
+import models
+from database import AsyncSessionLocal
+from download_log import download_log
+from engine_config import env_float, env_int
+from metrics import register_cache
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_FLUSH_SECONDS = env_float("PROGRESS_FLUSH_SECONDS", 5.0)
+PROGRESS_FLUSH_BATCH = 500
+ENROLLMENT_CACHE_SIZE = env_int("ENROLLMENT_CACHE_SIZE", 100_000)
+
+
+def _as_utc_naive(value: datetime) -> datetime:
+    """Timestamps do cliente em UTC sem fuso, como os do banco; nunca no futuro."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(value, datetime.utcnow())
+
+
+class EnrollmentRef:
+    """Dados mínimos de uma matrícula para autorizar e encaminhar atualizações."""
+    __slots__ = ("id", "user_id", "course_id", "completed")
+
+    def __init__(self, id: int, user_id: int, course_id: int, completed: bool):
+        self.id = id
+        self.user_id = user_id
+        self.course_id = course_id
+        self.completed = completed
+
+
+class ProgressBuffer:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        flush_seconds: float = PROGRESS_FLUSH_SECONDS,
+        cache_size: int = ENROLLMENT_CACHE_SIZE,
+    ):
+        self.session_factory = session_factory
+        self.flush_seconds = flush_seconds
+        self.cache_size = cache_size
+        # enrollment_id -> [progresso, último acesso]
+        self._pending: Dict[int, list] = {}
+        self._refs: "OrderedDict[str, EnrollmentRef]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, code: str, ref: EnrollmentRef):
+        self._refs[code] = ref
+        self._refs.move_to_end(code)
+        if len(self._refs) > self.cache_size:
+            self._refs.popitem(last=False)
+
+    async def lookup(self, db, enrollment_code: str) -> Optional[EnrollmentRef]:
+        ref = self._refs.get(enrollment_code)
+        if ref is not None:
+            self.hits += 1
+            self._refs.move_to_end(enrollment_code)
+            return ref
+        self.misses += 1
+        result = await db.execute(
+            select(
+                models.CourseDownload.id,
+                models.CourseDownload.user_id,
+                models.CourseDownload.course_id,
+                models.CourseDownload.status,
+            ).where(models.CourseDownload.enrollment_code == enrollment_code)
+        )
+        row = result.first()
+        if row is None:
+            return None
+        ref = EnrollmentRef(row.id, row.user_id, row.course_id, row.status == "completed")
+        self._remember(enrollment_code, ref)
+        return ref
+
+    def record(self, enrollment_id: int, progress: float, accessed_at: Optional[datetime] = None):
+        accessed_at = accessed_at or datetime.utcnow()
+        entry = self._pending.get(enrollment_id)
+        if entry is None:
+            self._pending[enrollment_id] = [progress, accessed_at]
+        else:
+            entry[0] = max(entry[0], progress)
+            entry[1] = max(entry[1], accessed_at)
+
+    async def complete(self, db, ref: EnrollmentRef, accessed_at: Optional[datetime] = None) -> bool:
+        """Grava já a conclusão; o que estava pendente para a matrícula deixa de ser preciso.
+
+        O `ref.completed` em cache pode estar desatualizado (outro worker já
+        concluiu a matrícula): a condição no UPDATE garante uma só conclusão,
+        e só essa regista o evento. Devolve se foi esta chamada a concluir.
+        """
+        accessed_at = accessed_at or datetime.utcnow()
+        self._pending.pop(ref.id, None)
+        result = await db.execute(
+            update(models.CourseDownload)
+            .where(
+                models.CourseDownload.id == ref.id,
+                or_(models.CourseDownload.status.is_(None), models.CourseDownload.status != "completed"),
+            )
+            .values(progress=100.0, status="completed", last_accessed=accessed_at, progress_updated_at=accessed_at)
+        )
+        await db.commit()
+        ref.completed = True
+        if result.rowcount != 1:
+            return False
+        download_log.record("completion", ref.user_id, ref.course_id, ref.id)
+        return True
+
+    def pending(self, enrollment_id: int) -> Optional[Tuple[float, datetime]]:
+        entry = self._pending.get(enrollment_id)
+        return tuple(entry) if entry is not None else None
+
+    def overlay(self, enrollments: Iterable):
+        """Aplica o progresso ainda não gravado a matrículas lidas do banco (só para resposta)."""
+        for enrollment in enrollments:
+            entry = self._pending.get(enrollment.id)
+            if entry is not None and enrollment.status != "completed":
+                enrollment.progress = entry[0]
+                enrollment.last_accessed = entry[1]
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        table = models.CourseDownload.__table__
+        try:
+            async with self.session_factory() as session:
+                for start in range(0, len(items), PROGRESS_FLUSH_BATCH):
+                    await session.execute(self._batch_update(table, items[start:start + PROGRESS_FLUSH_BATCH]))
+                await session.commit()
+        except BaseException:
+            # Devolver ao buffer sem perder valores mais recentes recebidos entretanto;
+            # também se o flush for cancelado (CancelledError não é uma Exception)
+            for enrollment_id, (progress, accessed_at) in items:
+                self.record(enrollment_id, progress, accessed_at)
+            raise
+        return len(items)
+
+    @staticmethod
+    def _batch_update(table, items: List[Tuple[int, list]]):
+        ids = [enrollment_id for enrollment_id, _ in items]
+        progress = case({enrollment_id: entry[0] for enrollment_id, entry in items}, value=table.c.id)
+        timestamp = case({enrollment_id: entry[1] for enrollment_id, entry in items}, value=table.c.id)
+        newer = or_(table.c.progress_updated_at.is_(None), table.c.progress_updated_at < timestamp)
+        return (
+            update(table)
+            .where(table.c.id.in_(ids))
+            # Uma matrícula concluída ou com um sync mais recente mantém o progresso
+            .ordered_values(
+                (table.c.progress, case(
+                    (and_(newer, table.c.status != "completed"), progress),
+                    else_=table.c.progress,
+                )),
+                (table.c.progress_updated_at, case((newer, timestamp), else_=table.c.progress_updated_at)),
+                (table.c.last_accessed, ProgressBuffer._latest(table.c.last_accessed, timestamp)),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def _latest(column, timestamp):
+        return case((or_(column.is_(None), column < timestamp), timestamp), else_=column)
+
+    async def sync(self, db, user_id: int, events) -> List[dict]:
+        """Aplica eventos offline (código, progresso, timestamp) de um usuário."""
+        latest: Dict[str, Tuple[float, datetime]] = {}
+        for event in events:
+            timestamp = _as_utc_naive(event.timestamp)
+            current = latest.get(event.enrollment_code)
+            if current is None or timestamp > current[1]:
+                latest[event.enrollment_code] = (min(100.0, max(0.0, event.progress)), timestamp)
+
+        # DATETIME sem fração no MySQL: comparar com o valor que o banco vai guardar
+        if db.bind.dialect.name == "mysql":
+            latest = {code: (p, t.replace(microsecond=0)) for code, (p, t) in latest.items()}
+
+        result = await db.execute(
+            select(
+                models.CourseDownload.id,
+                models.CourseDownload.enrollment_code,
+                models.CourseDownload.user_id,
+                models.CourseDownload.course_id,
+                models.CourseDownload.status,
+                models.CourseDownload.progress,
+                models.CourseDownload.progress_updated_at,
+            ).where(models.CourseDownload.enrollment_code.in_(list(latest)))
+        )
+        rows = {row.enrollment_code: row for row in result}
+
+        outcomes, writes, written = [], [], []
+        for code, (progress, timestamp) in latest.items():
+            row = rows.get(code)
+            if row is None:
+                outcomes.append({"enrollment_code": code, "status": "not_found"})
+                continue
+            if row.user_id != user_id:
+                outcomes.append({"enrollment_code": code, "status": "forbidden"})
+                continue
+            ref = EnrollmentRef(row.id, row.user_id, row.course_id, row.status == "completed")
+            self._remember(code, ref)
+            pending = self._pending.get(row.id)
+            newest = max(filter(None, (row.progress_updated_at, pending[1] if pending else None)), default=None)
+            if newest is not None and newest >= timestamp:
+                current = pending[0] if pending and row.status != "completed" else row.progress
+                outcomes.append({"enrollment_code": code, "status": "stale", "progress": current})
+                continue
+            if row.status == "completed":
+                progress = row.progress
+            writes.append((row.id, progress, timestamp))
+            outcome = {"enrollment_code": code, "status": "applied", "progress": progress}
+            outcomes.append(outcome)
+            written.append((ref, row.status == "completed", timestamp, outcome))
+
+        table = models.CourseDownload.__table__
+        stored = {}
+        for start in range(0, len(writes), PROGRESS_FLUSH_BATCH):
+            chunk = writes[start:start + PROGRESS_FLUSH_BATCH]
+            await db.execute(self._sync_update(table, chunk))
+            # O UPDATE não diz que linhas a guarda deixou como estavam: reler com lock
+            result = await db.execute(
+                select(table.c.id, table.c.progress, table.c.status, table.c.progress_updated_at)
+                .where(table.c.id.in_([enrollment_id for enrollment_id, _, _ in chunk]))
+                .with_for_update()
+            )
+            stored.update((row.id, row) for row in result)
+        if writes:
+            await db.commit()
+        for ref, was_completed, timestamp, outcome in written:
+            row = stored.get(ref.id)
+            if row is None:
+                # Apagada entretanto (ex.: user_deletion.py)
+                outcome.pop("progress")
+                outcome["status"] = "not_found"
+                continue
+            outcome["progress"] = row.progress
+            if row.progress_updated_at != timestamp:
+                # Uma escrita concorrente mais recente ganhou
+                outcome["status"] = "stale"
+            elif row.status == "completed" and not was_completed:
+                ref.completed = True
+                download_log.record("completion", ref.user_id, ref.course_id, ref.id)
+        for enrollment_id, progress, timestamp in writes:
+            pending = self._pending.get(enrollment_id)
+            if pending is not None and pending[1] <= timestamp:
+                del self._pending[enrollment_id]
+        return outcomes
+
+    @staticmethod
+    def _sync_update(table, writes: List[Tuple[int, float, datetime]]):
+        ids = [enrollment_id for enrollment_id, _, _ in writes]
+        progress = case({i: p for i, p, _ in writes}, value=table.c.id)
+        timestamp = case({i: t for i, _, t in writes}, value=table.c.id)
+        # A condição repete-se no banco para não sobrescrever escritas concorrentes mais recentes
+        newer = or_(table.c.progress_updated_at.is_(None), table.c.progress_updated_at < timestamp)
+        return (
+            update(table)
+            .where(table.c.id.in_(ids))
+            # Ordem explícita: no MySQL cada SET já vê os valores atribuídos antes
+            .ordered_values(
+                (table.c.progress, case(
+                    (and_(newer, table.c.status != "completed"), progress),
+                    else_=table.c.progress,
+                )),
+                (table.c.status, case(
+                    (and_(newer, progress >= 100), "completed"),
+                    else_=table.c.status,
+                )),
+                (table.c.progress_updated_at, case((newer, timestamp), else_=table.c.progress_updated_at)),
+                (table.c.last_accessed, ProgressBuffer._latest(table.c.last_accessed, timestamp)),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush %d buffered progress updates", len(self._pending))
+
+    def start(self):
+        if self._task is None:
+            self._stopped.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        # Sem cancelar: um flush a meio termina (ou devolve as entradas ao buffer) antes do final
+        if self._task is not None:
+            self._stopped.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Lost %d buffered progress updates on shutdown", len(self._pending))
+
+
+progress_buffer = ProgressBuffer()
+register_cache("enrollment_refs", progress_buffer)
@@ -0,0 +1,414 @@
+"""Recomendações "quem comprou este curso também comprou".
+
+A partir de `course_downloads` constrói-se a matriz esparsa curso×curso de
+co-ocorrência (quantos usuários compraram os dois), em formato COO: chaves
+`a << 32 | b` ordenadas e as respetivas contagens, geradas com operações
+vetorizadas do NumPy. A pontuação de um par é normalizada pela
+popularidade, `co(a, b) / sqrt(n_a * n_b)` (cosseno), para que os cursos
+mais vendidos não apareçam em todas as listas. Cada curso guarda em memória
+o top-K dos seus vizinhos, servido por `/courses/{id}/related` e, somando
+as listas dos cursos do usuário, por `/courses/recommended`.
+
+O modelo é construído por um único processo, no job `recommender_rebuild`
+(jobs.py; a dedupe_key junta os pedidos de todos os workers), que lê
+`course_downloads` e grava as matrizes e as listas em
+RECOMMENDER_MODEL_PATH. Os workers só carregam esse ficheiro, no arranque e
+sempre que ele muda, por isso um worker reciclado pelo serve.py não volta a
+ler a tabela. O job é pedido quando o ficheiro não existe ou o seu snapshot
+é anterior à última RECOMMENDER_REBUILD_HOUR (UTC): uma reconstrução por
+dia. Com vários servidores o caminho tem de estar num disco partilhado.
+
+Entre reconstruções as compras feitas no próprio worker são aplicadas
+incrementalmente a cada RECOMMENDER_UPDATE_SECONDS: soma-se o par a cada
+curso que o usuário já tinha e recalcula-se a lista do curso comprado e a
+entrada dele nas listas desses cursos. Ao carregar um modelo novo, as
+compras do worker posteriores ao snapshot voltam a ser aplicadas. As listas
+de outros cursos só refletem a nova popularidade na reconstrução seguinte,
+e compras feitas noutros workers também.
+"""
+import asyncio
+import bisect
+import heapq
+import logging
+import math
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+import models
+from database import AsyncSessionLocal
+from engine_config import env_bool, env_float, env_int
+from jobs import job_handler, job_runner
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDER_ENABLED = env_bool("RECOMMENDER_ENABLED", True)
+RECOMMENDER_TOP_K = env_int("RECOMMENDER_TOP_K", 20)
+RECOMMENDER_MAX_BASKET = env_int("RECOMMENDER_MAX_BASKET", 200)
+RECOMMENDER_UPDATE_SECONDS = env_float("RECOMMENDER_UPDATE_SECONDS", 10.0)
+RECOMMENDER_REBUILD_HOUR = env_int("RECOMMENDER_REBUILD_HOUR", 4)
+RECOMMENDER_MODEL_PATH = os.getenv("RECOMMENDER_MODEL_PATH", os.path.join("data", "recommender.npz"))
+RECOMMENDER_RETRY_SECONDS = env_float("RECOMMENDER_RETRY_SECONDS", 15 * 60.0)
+RECENT_KEEP_SECONDS = 24 * 60 * 60
+JOB_TYPE = "recommender_rebuild"
+LOAD_CHUNK_IDS = 500_000
+POPULAR_KEPT = 100
+LOW_BITS = 0xFFFFFFFF
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def cooccurrence(user_ids: np.ndarray, course_ids: np.ndarray, max_basket: int = RECOMMENDER_MAX_BASKET):
+    """Chaves `a << 32 | b` (nos dois sentidos) e contagens dos pares comprados pelo mesmo usuário.
+
+    Usuários com mais de `max_basket` cursos contribuem só com os primeiros,
+    para o número de pares não crescer com o quadrado das maiores coleções.
+    """
+    if len(user_ids) == 0:
+        return _EMPTY, _EMPTY
+    order = np.lexsort((course_ids, user_ids))
+    users = user_ids[order]
+    courses = course_ids[order]
+
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    lengths = np.diff(np.r_[starts, len(users)])
+    position = np.arange(len(users)) - np.repeat(starts, lengths)
+    keep = position < max_basket
+    courses, position = courses[keep], position[keep]
+    lengths = np.minimum(lengths, max_basket)
+    group_length = np.repeat(lengths, lengths)
+
+    # Para cada distância d, os pares (i, i + d) que ficam dentro da mesma cesta
+    chunks = []
+    for offset in range(1, int(lengths.max())):
+        left = np.flatnonzero(position + offset < group_length)
+        a, b = courses[left], courses[left + offset]
+        chunks.append((a << 32) | b)
+        chunks.append((b << 32) | a)
+    if not chunks:
+        return _EMPTY, _EMPTY
+    return np.unique(np.concatenate(chunks), return_counts=True)
+
+
+def top_k_arrays(keys: np.ndarray, counts: np.ndarray, popularity: np.ndarray, k: int):
+    """Top-K vizinhos de cada curso, por co-ocorrência normalizada pela popularidade.
+
+    Devolve as linhas, colunas e pontuações, agrupadas por linha e por pontuação decrescente.
+    """
+    if len(keys) == 0:
+        return _EMPTY, _EMPTY, np.empty(0, dtype=np.float64)
+    rows = keys >> 32
+    cols = keys & LOW_BITS
+    scores = counts / np.sqrt(popularity[rows].astype(np.float64) * popularity[cols])
+
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    lengths = np.diff(np.r_[starts, len(rows)])
+    keep = (np.arange(len(rows)) - np.repeat(starts, lengths)) < k
+    return rows[keep], cols[keep], scores[keep]
+
+
+def top_k_lists(rows: np.ndarray, cols: np.ndarray, scores: np.ndarray) -> Dict[int, List[Tuple[int, float]]]:
+    """Listas por curso a partir do resultado de `top_k_arrays`."""
+    if len(rows) == 0:
+        return {}
+    boundaries = np.flatnonzero(rows[1:] != rows[:-1]) + 1
+    return {
+        int(row_slice[0]): list(zip(col_slice.tolist(), score_slice.tolist()))
+        for row_slice, col_slice, score_slice in zip(
+            np.split(rows, boundaries), np.split(cols, boundaries), np.split(scores, boundaries)
+        )
+    }
+
+
+class CoPurchaseModel:
+    def __init__(
+        self,
+        keys: np.ndarray,
+        counts: np.ndarray,
+        popularity: np.ndarray,
+        top_k: int = RECOMMENDER_TOP_K,
+        top_arrays: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+        snapshot_at: Optional[float] = None,
+    ):
+        self.keys = keys
+        self.counts = counts
+        self.popularity = popularity
+        self.top_k = top_k
+        # Início da leitura de course_downloads (unix timestamp)
+        self.snapshot_at = time.time() if snapshot_at is None else snapshot_at
+        # Pares somados desde a última reconstrução: curso -> {curso: contagem}
+        self.delta: Dict[int, Counter] = defaultdict(Counter)
+        if top_arrays is None:
+            top_arrays = top_k_arrays(keys, counts, popularity, top_k)
+        self.top_arrays = top_arrays
+        self.top = top_k_lists(*top_arrays)
+        self.popular = [int(c) for c in np.argsort(-popularity, kind="stable")[:POPULAR_KEPT] if popularity[c] > 0]
+
+    @classmethod
+    def build(cls, user_ids: np.ndarray, course_ids: np.ndarray, top_k: int = RECOMMENDER_TOP_K, snapshot_at: Optional[float] = None):
+        keys, counts = cooccurrence(user_ids, course_ids)
+        popularity = np.bincount(course_ids, minlength=1).astype(np.int64)
+        return cls(keys, counts, popularity, top_k, snapshot_at=snapshot_at)
+
+    def save(self, path: str):
+        """Grava o modelo de forma atómica: quem o carrega nunca vê um ficheiro a meio."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        rows, cols, scores = self.top_arrays
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                keys=self.keys, counts=self.counts, popularity=self.popularity,
+                top_rows=rows, top_cols=cols, top_scores=scores,
+                meta=np.array([self.snapshot_at, self.top_k], dtype=np.float64),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CoPurchaseModel":
+        with np.load(path, allow_pickle=False) as data:
+            snapshot_at, top_k = data["meta"].tolist()
+            return cls(
+                data["keys"], data["counts"], data["popularity"], int(top_k),
+                top_arrays=(data["top_rows"], data["top_cols"], data["top_scores"]),
+                snapshot_at=snapshot_at,
+            )
+
+    def _popularity(self, course_id: int) -> int:
+        return int(self.popularity[course_id]) if course_id < len(self.popularity) else 0
+
+    def _row_counts(self, course_id: int) -> Dict[int, int]:
+        lo = np.searchsorted(self.keys, course_id << 32)
+        hi = np.searchsorted(self.keys, (course_id + 1) << 32)
+        row = dict(zip((self.keys[lo:hi] & LOW_BITS).tolist(), self.counts[lo:hi].tolist()))
+        for other, n in self.delta.get(course_id, {}).items():
+            row[other] = row.get(other, 0) + n
+        return row
+
+    def _count(self, a: int, b: int) -> int:
+        key = (a << 32) | b
+        i = np.searchsorted(self.keys, key)
+        base = int(self.counts[i]) if i < len(self.keys) and self.keys[i] == key else 0
+        return base + self.delta.get(a, {}).get(b, 0)
+
+    def _score(self, a: int, b: int, n: int) -> float:
+        # Cursos comprados só noutros workers ainda não têm popularidade conhecida aqui
+        return n / math.sqrt(max(1, self._popularity(a)) * max(1, self._popularity(b)))
+
+    def add_purchase(self, course_id: int, previous: Iterable[int]):
+        """Aplica uma compra de `course_id` por um usuário que já tinha `previous`."""
+        if course_id >= len(self.popularity):
+            self.popularity = np.pad(self.popularity, (0, course_id + 1 - len(self.popularity)))
+        self.popularity[course_id] += 1
+        previous = [p for p in previous if p != course_id]
+        for other in previous:
+            self.delta[course_id][other] += 1
+            self.delta[other][course_id] += 1
+
+        row = self._row_counts(course_id)
+        self.top[course_id] = heapq.nlargest(
+            self.top_k,
+            ((other, self._score(course_id, other, n)) for other, n in row.items()),
+            key=lambda entry: entry[1],
+        )
+        for other in previous:
+            entries = [e for e in self.top.get(other, []) if e[0] != course_id]
+            entries.append((course_id, self._score(other, course_id, self._count(other, course_id))))
+            entries.sort(key=lambda entry: entry[1], reverse=True)
+            self.top[other] = entries[:self.top_k]
+
+    def related(self, course_id: int, limit: int) -> List[int]:
+        return [other for other, _ in self.top.get(course_id, [])[:limit]]
+
+    def recommend(self, owned: Sequence[int], limit: int) -> List[int]:
+        """Soma as listas dos cursos do usuário; sem histórico, os mais comprados."""
+        owned_set = set(owned)
+        scores: Counter = Counter()
+        for course_id in owned_set:
+            for other, score in self.top.get(course_id, []):
+                if other not in owned_set:
+                    scores[other] += score
+        ranked = [course_id for course_id, _ in scores.most_common(limit)]
+        if len(ranked) < limit:
+            seen = owned_set.union(ranked)
+            ranked.extend(c for c in self.popular if c not in seen)
+        return ranked[:limit]
+
+
+async def load_enrollments(session_factory=AsyncSessionLocal, on_progress=None):
+    download = models.CourseDownload
+    user_parts, course_parts = [], []
+    loaded = 0
+    async with session_factory() as session:
+        low, high = (await session.execute(select(func.min(download.id), func.max(download.id)))).one()
+        if low is None:
+            return _EMPTY, _EMPTY
+        for start in range(low, high + 1, LOAD_CHUNK_IDS):
+            result = await session.execute(
+                select(download.user_id, download.course_id)
+                .where(download.id >= start, download.id < start + LOAD_CHUNK_IDS)
+            )
+            rows = result.all()
+            if rows:
+                user_parts.append(np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)))
+                course_parts.append(np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows)))
+                loaded += len(rows)
+            if on_progress is not None:
+                await on_progress(loaded)
+    if not user_parts:
+        return _EMPTY, _EMPTY
+    return np.concatenate(user_parts), np.concatenate(course_parts)
+
+
+async def build_model(session_factory=AsyncSessionLocal, path: str = RECOMMENDER_MODEL_PATH, on_progress=None) -> dict:
+    """Reconstrói o modelo a partir de `course_downloads` e grava-o em `path`."""
+    started = time.time()
+    user_ids, course_ids = await load_enrollments(session_factory, on_progress)
+    # A parte numérica corre numa thread para não bloquear o event loop
+    model = await asyncio.to_thread(CoPurchaseModel.build, user_ids, course_ids, snapshot_at=started)
+    await asyncio.to_thread(model.save, path)
+    elapsed = time.time() - started
+    logger.info(
+        "Rebuilt co-purchase model from %d enrollments (%d pairs) in %.1fs",
+        len(user_ids), len(model.keys), elapsed,
+    )
+    return {"enrollments": len(user_ids), "pairs": len(model.keys), "seconds": round(elapsed, 1)}
+
+
+@job_handler(JOB_TYPE)
+async def rebuild_model(ctx, payload: dict) -> dict:
+    return await build_model(ctx.session_factory, on_progress=ctx.progress)
+
+
+class Recommender:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        update_seconds: float = RECOMMENDER_UPDATE_SECONDS,
+        model_path: str = RECOMMENDER_MODEL_PATH,
+    ):
+        self.session_factory = session_factory
+        self.update_seconds = update_seconds
+        self.model_path = model_path
+        self.model: Optional[CoPurchaseModel] = None
+        # Compras deste worker (instante, usuário, curso); as primeiras `_applied` já estão no modelo
+        self._recent: List[Tuple[float, int, int]] = []
+        self._applied = 0
+        self._loaded_mtime: Optional[int] = None
+        self._next_request = 0.0
+        self._stopped = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def record_purchase(self, user_id: int, course_ids: Iterable[int]):
+        if self._task is not None:
+            now = time.time()
+            self._recent.extend((now, user_id, course_id) for course_id in course_ids)
+
+    def related(self, course_id: int, limit: int) -> List[int]:
+        return self.model.related(course_id, limit) if self.model else []
+
+    def recommend(self, owned: Sequence[int], limit: int) -> List[int]:
+        return self.model.recommend(owned, limit) if self.model else []
+
+    async def load(self) -> bool:
+        """Carrega o modelo gravado pelo job, se o ficheiro mudou desde a última leitura."""
+        try:
+            mtime = os.stat(self.model_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._loaded_mtime:
+            return False
+        model = await asyncio.to_thread(CoPurchaseModel.load, self.model_path)
+        self.model, self._loaded_mtime = model, mtime
+        # As compras anteriores ao snapshot já lá estão; as seguintes voltam a ser aplicadas
+        self._recent = self._recent[bisect.bisect_left(self._recent, (model.snapshot_at,)):]
+        self._applied = 0
+        logger.info("Loaded co-purchase model with %d pairs from %s", len(model.keys), self.model_path)
+        return True
+
+    def _stale(self) -> bool:
+        """Sem modelo, ou com um snapshot anterior à última RECOMMENDER_REBUILD_HOUR."""
+        if self.model is None:
+            return True
+        if RECOMMENDER_REBUILD_HOUR < 0:
+            return False
+        now = datetime.utcnow()
+        due = now.replace(hour=RECOMMENDER_REBUILD_HOUR, minute=0, second=0, microsecond=0)
+        if due > now:
+            due -= timedelta(days=1)
+        return self.model.snapshot_at < due.replace(tzinfo=timezone.utc).timestamp()
+
+    async def request_rebuild(self):
+        """Enfileira o job de reconstrução; a dedupe_key junta os pedidos de todos os workers."""
+        if time.monotonic() < self._next_request:
+            return
+        self._next_request = time.monotonic() + RECOMMENDER_RETRY_SECONDS
+        async with self.session_factory() as db:
+            await job_runner.enqueue(db, JOB_TYPE, {}, dedupe_key=JOB_TYPE)
+
+    async def apply_pending(self) -> int:
+        # Sem um modelo carregado há mais de um dia, as compras mais antigas deixam de interessar
+        forgotten = bisect.bisect_left(self._recent, (time.time() - RECENT_KEEP_SECONDS,))
+        if forgotten:
+            del self._recent[:forgotten]
+            self._applied = max(0, self._applied - forgotten)
+        if self.model is None or self._applied == len(self._recent):
+            # Sem modelo ainda: ao carregá-lo, as compras posteriores ao snapshot são aplicadas
+            return 0
+        pending = [(user_id, course_id) for _, user_id, course_id in self._recent[self._applied:]]
+        self._applied = len(self._recent)
+        user_ids = {user_id for user_id, _ in pending}
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(models.CourseDownload.user_id, models.CourseDownload.course_id)
+                .where(models.CourseDownload.user_id.in_(user_ids))
+            )
+            owned = defaultdict(set)
+            for user_id, course_id in result:
+                owned[user_id].add(course_id)
+        # Os cursos do lote entram um a um, para cada par ser contado uma só vez
+        for user_id, course_id in pending:
+            owned[user_id].discard(course_id)
+        for user_id, course_id in pending:
+            self.model.add_purchase(course_id, owned[user_id])
+            owned[user_id].add(course_id)
+        return len(pending)
+
+    async def _refresh(self):
+        await self.load()
+        if self._stale():
+            await self.request_rebuild()
+        await self.apply_pending()
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            try:
+                await self._refresh()
+            except Exception:
+                logger.exception("Co-purchase model update failed")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.update_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if RECOMMENDER_ENABLED and self._task is None:
+            self._stopped.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        # Sem cancelar: a reconstrução corre no job runner e o ciclo acaba no próximo tick
+        if self._task is not None:
+            self._stopped.set()
+            await self._task
+            self._task = None
+
+
+recommender = Recommender()
@@ -0,0 +1,260 @@
+"""Auditoria de saldos das wallets.
+
+Compara o saldo de cada `Wallet` com a soma das suas `WalletTransaction`
+concluídas. As transações são lidas em faixas de id (varredura pela chave
+primária) com o SUM/GROUP BY feito no banco, e as somas parciais são
+acumuladas num vetor NumPy indexado pelo id da wallet, por isso a memória
+depende do número de wallets e não do número de transações. Cada faixa é
+lida na sua própria transação: nenhuma leitura fica aberta durante toda a
+auditoria.
+
+Como depósitos e compras continuam a chegar durante a varredura, uma
+diferença encontrada é só candidata: o saldo e a soma das transações dessas
+wallets são relidos juntos, numa única consulta, e só o que continua a
+divergir entra no relatório (até `max_discrepancies` entradas) e é corrigido.
+
+Uso:
+    python reconciliation.py                # apenas relatório
+    python reconciliation.py --repair       # corrige os saldos divergentes
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.future import select
+
+import models
+from database import AsyncSessionLocal
+
+DEFAULT_CHUNK_SIZE = 500_000
+DEFAULT_TOLERANCE = 0.01
+DEFAULT_MAX_DISCREPANCIES = 1000
+RECHECK_BATCH = 500
+
+wallets_table = models.Wallet.__table__
+transactions_table = models.WalletTransaction.__table__
+
+
+async def _id_bounds(db, column):
+    result = await db.execute(select(func.min(column), func.max(column)))
+    return result.one()
+
+
+async def _expected_balances(db, max_wallet_id: int, chunk_size: int):
+    """Soma as transações concluídas por wallet, faixa a faixa de ids."""
+    sums = np.zeros(max_wallet_id + 1, dtype=np.float64)
+    low, high = await _id_bounds(db, models.WalletTransaction.id)
+    if low is None:
+        return sums, 0, None
+
+    scanned = 0
+    for start in range(low, high + 1, chunk_size):
+        result = await db.execute(
+            select(
+                models.WalletTransaction.wallet_id,
+                func.sum(models.WalletTransaction.amount),
+                func.count(),
+            )
+            .where(
+                models.WalletTransaction.id >= start,
+                models.WalletTransaction.id < start + chunk_size,
+                models.WalletTransaction.status == "completed",
+                models.WalletTransaction.wallet_id.isnot(None),
+            )
+            .group_by(models.WalletTransaction.wallet_id)
+        )
+        rows = result.all()
+        await db.commit()
+        if not rows:
+            continue
+        wallet_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        amounts = np.fromiter((r[1] or 0.0 for r in rows), dtype=np.float64, count=len(rows))
+        # Transações de wallets criadas depois da leitura do max(id) ficam de fora
+        valid = wallet_ids <= max_wallet_id
+        np.add.at(sums, wallet_ids[valid], amounts[valid])
+        scanned += sum(r[2] for r in rows)
+
+    return sums, scanned, high
+
+
+async def _recheck(db, wallet_ids, tolerance: float):
+    """Relê saldo e soma das transações concluídas de cada wallet na mesma consulta.
+
+    Devolve as que continuam a divergir e o maior id de transação de cada
+    uma, usado pelo `_repair` para não sobrescrever transações mais recentes.
+    """
+    tx = transactions_table
+    completed = (
+        select(func.coalesce(func.sum(tx.c.amount), 0.0))
+        .where(tx.c.wallet_id == wallets_table.c.id, tx.c.status == "completed")
+        .scalar_subquery()
+    )
+    latest = select(func.max(tx.c.id)).where(tx.c.wallet_id == wallets_table.c.id).scalar_subquery()
+    result = await db.execute(
+        select(wallets_table.c.id, wallets_table.c.balance, completed, latest)
+        .where(wallets_table.c.id.in_(wallet_ids))
+    )
+    rows = result.all()
+    await db.commit()
+    confirmed = []
+    for wallet_id, balance, expected, last_id in rows:
+        balance = balance or 0.0
+        if abs(balance - expected) > tolerance:
+            confirmed.append({
+                "wallet_id": wallet_id,
+                "balance": balance,
+                "expected": round(expected, 2),
+                "difference": round(balance - expected, 2),
+                "last_transaction_id": last_id or 0,
+            })
+    return confirmed
+
+
+async def _find_candidates(db, sums, start: int, chunk_size: int, tolerance: float):
+    """Wallets da faixa cujo saldo gravado difere do esperado pela varredura."""
+    result = await db.execute(
+        select(models.Wallet.id, models.Wallet.balance)
+        .where(models.Wallet.id >= start, models.Wallet.id < start + chunk_size)
+    )
+    rows = result.all()
+    await db.commit()
+    if not rows:
+        return [], 0
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    balances = np.fromiter((r[1] or 0.0 for r in rows), dtype=np.float64, count=len(rows))
+    mismatched = np.nonzero(np.abs(balances - sums[ids]) > tolerance)[0]
+    return ids[mismatched].tolist(), len(rows)
+
+
+async def _repair(db, discrepancies) -> int:
+    """Grava o saldo esperado, só se o saldo e as transações não mudaram desde a releitura."""
+    if not discrepancies:
+        return 0
+    newer = (
+        select(transactions_table.c.id)
+        .where(
+            transactions_table.c.wallet_id == bindparam("b_wallet_id"),
+            transactions_table.c.id > bindparam("b_last_transaction_id"),
+        )
+        .exists()
+    )
+    stmt = (
+        update(wallets_table)
+        .where(
+            wallets_table.c.id == bindparam("b_wallet_id"),
+            wallets_table.c.balance == bindparam("b_balance"),
+            ~newer,
+        )
+        .values(balance=bindparam("b_expected"))
+    )
+    result = await db.execute(stmt, [
+        {
+            "b_wallet_id": d["wallet_id"],
+            "b_balance": d["balance"],
+            "b_expected": d["expected"],
+            "b_last_transaction_id": d["last_transaction_id"],
+        }
+        for d in discrepancies
+    ])
+    await db.commit()
+    return result.rowcount
+
+
+async def reconcile_wallets(
+    repair: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    tolerance: float = DEFAULT_TOLERANCE,
+    max_discrepancies: int = DEFAULT_MAX_DISCREPANCIES,
+) -> dict:
+    """Executa a auditoria e devolve um relatório com as divergências encontradas.
+
+    O relatório lista no máximo `max_discrepancies` divergências;
+    `discrepancies_found` tem o total. Com `repair=True` cada faixa é
+    corrigida logo depois da releitura, com um UPDATE condicional: wallets
+    cujo saldo mudou ou que receberam transações entretanto são ignoradas
+    e aparecerão de novo na próxima execução.
+    """
+    started = time.monotonic()
+    discrepancies = []
+    found = 0
+    changed = 0
+    repaired = 0
+    checked = 0
+    async with AsyncSessionLocal() as db:
+        _, max_wallet_id = await _id_bounds(db, models.Wallet.id)
+        await db.commit()
+        if max_wallet_id is None:
+            return {
+                "wallets_checked": 0,
+                "transactions_scanned": 0,
+                "last_transaction_id": None,
+                "discrepancies_found": 0,
+                "discrepancies": [],
+                "changed_during_audit": 0,
+                "repaired": 0,
+                "elapsed_seconds": round(time.monotonic() - started, 3),
+            }
+
+        sums, scanned, last_transaction_id = await _expected_balances(db, max_wallet_id, chunk_size)
+        for start in range(0, max_wallet_id + 1, chunk_size):
+            candidates, rows = await _find_candidates(db, sums, start, chunk_size, tolerance)
+            checked += rows
+            if not candidates:
+                continue
+            # Relidas em blocos pequenos: a lista IN e a subconsulta por wallet ficam baratas
+            for i in range(0, len(candidates), RECHECK_BATCH):
+                batch = candidates[i:i + RECHECK_BATCH]
+                confirmed = await _recheck(db, batch, tolerance)
+                changed += len(batch) - len(confirmed)
+                found += len(confirmed)
+                discrepancies.extend(confirmed[:max_discrepancies - len(discrepancies)])
+                if repair:
+                    repaired += await _repair(db, confirmed)
+
+    return {
+        "wallets_checked": checked,
+        "transactions_scanned": scanned,
+        "last_transaction_id": last_transaction_id,
+        "discrepancies_found": found,
+        "discrepancies": discrepancies,
+        "changed_during_audit": changed,
+        "repaired": repaired,
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audita os saldos das wallets")
+    parser.add_argument("--repair", action="store_true", help="corrigir saldos divergentes")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--limit", type=int, default=50, help="divergências a mostrar")
+    args = parser.parse_args()
+
+    report = asyncio.run(reconcile_wallets(
+        repair=args.repair,
+        chunk_size=args.chunk_size,
+        tolerance=args.tolerance,
+        max_discrepancies=args.limit,
+    ))
+
+    discrepancies = report["discrepancies"]
+    print(f"Wallets verificadas: {report['wallets_checked']}")
+    print(f"Transações lidas: {report['transactions_scanned']}")
+    print(f"Divergências: {report['discrepancies_found']}")
+    if report["changed_during_audit"]:
+        print(f"Alteradas durante a auditoria (ignoradas): {report['changed_during_audit']}")
+    for d in discrepancies:
+        print(
+            f"  wallet {d['wallet_id']}: saldo={d['balance']:.2f} "
+            f"esperado={d['expected']:.2f} diferença={d['difference']:.2f}"
+        )
+    if args.repair:
+        print(f"Corrigidas: {report['repaired']}")
+    print(f"Tempo: {report['elapsed_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
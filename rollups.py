@@ -0,0 +1,251 @@
+"""Rollups diários por curso para os relatórios de admin.
+
+`course_daily_stats` guarda, por curso e dia, compras, receita, likes
+novos, downloads e conclusões. Uma task de fundo agrega a cada
+ROLLUP_INTERVAL_SECONDS só as linhas novas de cada tabela de origem,
+a partir do último id já agregado (high-water mark em `rollup_state`):
+
+    purchases   course_downloads (+ wallet_transactions para o valor pago)
+    likes       course_likes
+    events      download_events (downloads e conclusões)
+
+Para não perder linhas de transações ainda por confirmar quando a execução
+corre, cada execução só agrega até ao maior id visto na execução anterior;
+os relatórios ficam até dois intervalos atrasados. A atualização do
+high-water é condicional (`WHERE last_id = :lido`), por isso vários
+workers a correr o job ao mesmo tempo não contam nada duas vezes: quem
+perde a corrida faz rollback.
+
+Likes removidos não são descontados (a linha deixa de existir); `likes`
+conta os likes dados em cada dia.
+
+    python rollups.py            # agrega agora tudo o que estiver pendente
+    python rollups.py --rebuild  # recalcula do zero (com o job parado)
+"""
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from database import engine
+from engine_config import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INTERVAL_SECONDS = env_float("ROLLUP_INTERVAL_SECONDS", 60.0)
+ROLLUP_CHUNK_IDS = env_int("ROLLUP_CHUNK_IDS", 200_000)
+UPSERT_BATCH = 500
+COUNTERS = ("purchases", "revenue", "likes", "downloads", "completions")
+
+
+def _purchases(lo: int, hi: int):
+    download = models.CourseDownload
+    day = func.date(download.downloaded_at)
+    return (
+        select(
+            download.course_id,
+            day.label("day"),
+            func.count().label("purchases"),
+            # Matrículas antigas podem não ter a transação ligada: usa-se o preço do curso
+            func.sum(func.coalesce(-models.WalletTransaction.amount, models.Course.price, 0)).label("revenue"),
+        )
+        .outerjoin(models.WalletTransaction, models.WalletTransaction.id == download.transaction_id)
+        .outerjoin(models.Course, models.Course.id == download.course_id)
+        .where(download.id > lo, download.id <= hi)
+        .group_by(download.course_id, day)
+    )
+
+
+def _likes(lo: int, hi: int):
+    like = models.CourseLike
+    day = func.date(like.created_at)
+    return (
+        select(like.course_id, day.label("day"), func.count().label("likes"))
+        .where(like.id > lo, like.id <= hi)
+        .group_by(like.course_id, day)
+    )
+
+
+def _events(lo: int, hi: int):
+    event = models.DownloadEvent
+    day = func.date(event.created_at)
+    return (
+        select(
+            event.course_id,
+            day.label("day"),
+            func.sum(case((event.event_type == "download", 1), else_=0)).label("downloads"),
+            func.sum(case((event.event_type == "completion", 1), else_=0)).label("completions"),
+        )
+        .where(event.id > lo, event.id <= hi, event.event_type.in_(("download", "completion")))
+        .group_by(event.course_id, day)
+    )
+
+
+# nome -> (coluna id da origem, consulta agregada para o intervalo (lo, hi])
+SOURCES: Dict[str, Tuple[object, Callable]] = {
+    "purchases": (models.CourseDownload.id, _purchases),
+    "likes": (models.CourseLike.id, _likes),
+    "events": (models.DownloadEvent.id, _events),
+}
+
+
+class _LostRace(Exception):
+    pass
+
+
+def _as_date(value) -> date:
+    # func.date devolve date no MySQL e texto no SQLite
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _upsert_increments(conn, rows: List[dict]):
+    """Soma os contadores às linhas existentes (INSERT ... ON DUPLICATE KEY / ON CONFLICT)."""
+    table = models.CourseDailyStats.__table__
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise RuntimeError(f"Rollups not supported on {dialect}")
+
+    for start in range(0, len(rows), UPSERT_BATCH):
+        stmt = dialect_insert(table).values(rows[start:start + UPSERT_BATCH])
+        if dialect == "mysql":
+            stmt = stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in COUNTERS})
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.course_id, table.c.day],
+                set_={c: table.c[c] + stmt.excluded[c] for c in COUNTERS},
+            )
+        yield stmt
+
+
+async def _load_state(conn, source: str) -> Tuple[int, int]:
+    state = models.RollupState.__table__
+    row = (await conn.execute(
+        select(state.c.last_id, state.c.snapshot_id).where(state.c.source == source)
+    )).first()
+    if row is not None:
+        return row.last_id, row.snapshot_id
+    await conn.execute(insert(state).values(source=source, last_id=0, snapshot_id=0, updated_at=datetime.utcnow()))
+    return 0, 0
+
+
+async def _rollup_step(source: str, immediate: bool) -> bool:
+    """Agrega um pedaço de uma origem numa transação; devolve True se ainda há trabalho."""
+    id_column, query = SOURCES[source]
+    state = models.RollupState.__table__
+    async with engine.begin() as conn:
+        last_id, snapshot_id = await _load_state(conn, source)
+        current_max = (await conn.execute(select(func.max(id_column)))).scalar() or 0
+        target = current_max if immediate else snapshot_id
+        upper = min(target, last_id + ROLLUP_CHUNK_IDS)
+
+        rows = []
+        if upper > last_id:
+            for row in await conn.execute(query(last_id, upper)):
+                values = dict.fromkeys(COUNTERS, 0)
+                values.update({k: v for k, v in row._mapping.items() if k in COUNTERS})
+                values["revenue"] = float(values["revenue"] or 0)
+                rows.append({"course_id": row.course_id, "day": _as_date(row.day), **values})
+            for stmt in _upsert_increments(conn, rows):
+                await conn.execute(stmt)
+
+        done = upper >= target
+        result = await conn.execute(
+            update(state)
+            .where(state.c.source == source, state.c.last_id == last_id, state.c.snapshot_id == snapshot_id)
+            .values(
+                last_id=max(upper, last_id),
+                snapshot_id=current_max if done else snapshot_id,
+                updated_at=datetime.utcnow(),
+            )
+        )
+        if result.rowcount != 1:
+            # Outro worker agregou o mesmo intervalo: descartar tudo o que foi feito aqui
+            raise _LostRace(source)
+    if rows:
+        logger.info("Rolled up %s ids %d..%d into %d rows", source, last_id + 1, upper, len(rows))
+    return not done
+
+
+async def refresh_rollups(immediate: bool = False):
+    """Agrega o que houver de novo em todas as origens."""
+    for source in SOURCES:
+        try:
+            while await _rollup_step(source, immediate):
+                pass
+        except (_LostRace, IntegrityError):
+            logger.debug("Rollup of %s done concurrently by another worker", source)
+
+
+async def rebuild_rollups():
+    async with engine.begin() as conn:
+        await conn.execute(delete(models.CourseDailyStats.__table__))
+        await conn.execute(delete(models.RollupState.__table__))
+    await refresh_rollups(immediate=True)
+
+
+async def rollup_freshness(db) -> Dict[str, Optional[datetime]]:
+    result = await db.execute(select(models.RollupState.source, models.RollupState.updated_at))
+    return {row.source: row.updated_at for row in result}
+
+
+class RollupScheduler:
+    def __init__(self, interval: float = ROLLUP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stopped = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            try:
+                await refresh_rollups()
+            except Exception:
+                logger.exception("Rollup refresh failed")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._stopped.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopped.set()
+            await self._task
+            self._task = None
+
+
+rollup_scheduler = RollupScheduler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rollups diários por curso")
+    parser.add_argument("--rebuild", action="store_true", help="apagar e recalcular tudo")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    async def _run():
+        try:
+            if args.rebuild:
+                await rebuild_rollups()
+            else:
+                await refresh_rollups(immediate=True)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List
+from sqlalchemy import func
+from typing import List, Literal, Optional
+from datetime import date, datetime, timedelta
+import os
 
 import models
 from auth import get_current_admin, promote_to_admin
-from database import get_db
-from schemas import UserProfile
+from database import get_db, get_read_db, read_router
+from schemas import AdminUserRow, Job
+from profiling import list_profiles, profile_path
+from rollups import COUNTERS, rollup_freshness
+from user_deletion import enqueue_user_deletion
+from media_gc import MEDIA_GC_GRACE_HOURS, enqueue_media_gc
 
 admin_router = APIRouter()
 
+USER_COLUMNS = (
+    models.User.id,
+    models.User.username,
+    models.User.email,
+    models.User.is_admin,
+    models.User.profile_picture,
+    models.User.created_at,
+)
+USER_EXPORT_CHUNK = 1000
+
 @admin_router.post("/promote/{user_id}")
 async def promote_user_to_admin(
     user_id: int,
@@ -24,16 +42,113 @@ async def promote_user_to_admin(
     await promote_to_admin(db, user_id)
     return {"message": f"User {user.username} promoted to admin"}
 
-@admin_router.get("/users", response_model=List[UserProfile])
+def _user_filters(
+    is_admin: Optional[bool],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+    username_prefix: Optional[str],
+):
+    conditions = []
+    if is_admin is not None:
+        conditions.append(func.coalesce(models.User.is_admin, False) == is_admin)
+    if created_from is not None:
+        conditions.append(models.User.created_at >= created_from)
+    if created_to is not None:
+        conditions.append(models.User.created_at <= created_to)
+    if username_prefix:
+        # LIKE 'prefixo%' usa o índice de username; % e _ do prefixo são literais
+        escaped = username_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(models.User.username.like(escaped + "%", escape="\\"))
+    return conditions
+
+async def _user_counts(db: AsyncSession, user_ids: List[int]):
+    """Matrículas, likes e cursos criados dos usuários indicados, com um GROUP BY por tabela"""
+    counts = {user_id: {"enrollments": 0, "likes": 0, "courses_created": 0} for user_id in user_ids}
+    for name, column in (
+        ("enrollments", models.CourseDownload.user_id),
+        ("likes", models.CourseLike.user_id),
+        ("courses_created", models.Course.uploaded_by),
+    ):
+        result = await db.execute(
+            select(column, func.count()).where(column.in_(user_ids)).group_by(column)
+        )
+        for user_id, count in result:
+            counts[user_id][name] = count
+    return counts
+
+async def _user_rows(db: AsyncSession, conditions, after_id: int, limit: int, include_counts: bool):
+    result = await db.execute(
+        select(*USER_COLUMNS)
+        .where(*conditions, models.User.id > after_id)
+        .order_by(models.User.id)
+        .limit(limit)
+    )
+    users = [{**row._mapping, "is_admin": bool(row.is_admin)} for row in result]
+    if include_counts and users:
+        counts = await _user_counts(db, [user["id"] for user in users])
+        for user in users:
+            user.update(counts[user["id"]])
+    return users
+
+@admin_router.get("/users", response_model=List[AdminUserRow], response_model_exclude_none=True)
 async def list_users(
+    request: Request,
+    response: Response,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    is_admin: Optional[bool] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    username_prefix: Optional[str] = Query(None, max_length=100),
+    include_counts: bool = False,
     current_user: models.User = Depends(get_current_admin),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    result = await db.execute(select(models.User))
-    users = result.scalars().all()
+    """Diretório de usuários paginado por id: só as colunas da listagem, sem relações.
+
+    O corpo continua a ser uma lista, como antes da paginação. Quando há
+    mais páginas o cursor vai nos headers `X-Next-After-Id` e `Link`
+    (rel="next"); sem `after_id` a resposta é a primeira página.
+    """
+    conditions = _user_filters(is_admin, created_from, created_to, username_prefix)
+    users = await _user_rows(db, conditions, after_id, limit + 1, include_counts)
+    if len(users) > limit:
+        users = users[:limit]
+        next_after_id = users[-1]["id"]
+        next_url = request.url.include_query_params(after_id=next_after_id)
+        response.headers["X-Next-After-Id"] = str(next_after_id)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
     return users
 
-@admin_router.delete("/users/{user_id}")
+async def _export_users(conditions, include_counts: bool):
+    after_id = 0
+    while True:
+        # Uma sessão por bloco: um cliente lento não prende uma conexão do pool
+        async with read_router.session_factory()() as session:
+            users = await _user_rows(session, conditions, after_id, USER_EXPORT_CHUNK, include_counts)
+        if not users:
+            return
+        yield "".join(AdminUserRow(**user).model_dump_json(exclude_none=True) + "\n" for user in users)
+        after_id = users[-1]["id"]
+
+@admin_router.get("/users/export")
+async def export_users(
+    is_admin: Optional[bool] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    username_prefix: Optional[str] = Query(None, max_length=100),
+    include_counts: bool = False,
+    current_user: models.User = Depends(get_current_admin)
+):
+    """Todos os usuários que passam nos filtros, um objeto JSON por linha (NDJSON)"""
+    conditions = _user_filters(is_admin, created_from, created_to, username_prefix)
+    return StreamingResponse(
+        _export_users(conditions, include_counts),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="users.ndjson"'}
+    )
+
+@admin_router.delete("/users/{user_id}", status_code=202)
 async def delete_user(
     user_id: int,
     current_user: models.User = Depends(get_current_admin),
@@ -51,7 +166,145 @@ async def delete_user(
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
-    await db.delete(user)
-    await db.commit()
+    # O usuário e tudo o que depende dele são apagados em blocos por um job (ver user_deletion.py)
+    job = await enqueue_user_deletion(db, user.id, current_user.id)
     
-    return {"message": f"Usuário {user.username} foi deletado com sucesso"}
\ No newline at end of file
+    return {
+        "message": f"Exclusão do usuário {user.username} agendada",
+        "job_id": job.id,
+        "status": job.status
+    }
+
+@admin_router.post("/media/gc", status_code=202)
+async def schedule_media_gc(
+    dry_run: bool = True,
+    grace_hours: float = Query(MEDIA_GC_GRACE_HOURS, ge=1),
+    current_user: models.User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """Agenda a coleta de ficheiros órfãos; o relatório fica no `result` do job"""
+    job = await enqueue_media_gc(db, dry_run, grace_hours, current_user.id)
+    return {"job_id": job.id, "status": job.status}
+
+@admin_router.get("/jobs", response_model=List[Job])
+async def list_jobs(
+    status: Optional[Literal["queued", "running", "succeeded", "failed"]] = None,
+    job_type: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: models.User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """Jobs de fundo, do mais recente ao mais antigo"""
+    stmt = select(models.Job)
+    if status is not None:
+        stmt = stmt.where(models.Job.status == status)
+    if job_type is not None:
+        stmt = stmt.where(models.Job.job_type == job_type)
+    result = await db.execute(stmt.order_by(models.Job.id.desc()).limit(limit))
+    return result.scalars().all()
+
+@admin_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(
+    job_id: int,
+    current_user: models.User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """Estado e progresso (processed/total) de um job"""
+    job = await db.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@admin_router.get("/profiles")
+async def list_request_profiles(current_user: models.User = Depends(get_current_admin)):
+    """Perfis recentes gravados pelo ProfilingMiddleware, do mais novo ao mais antigo"""
+    return {"profiles": list_profiles()}
+
+@admin_router.get("/profiles/{name}")
+async def download_request_profile(
+    name: str,
+    current_user: models.User = Depends(get_current_admin)
+):
+    path = profile_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=os.path.basename(path), media_type="text/plain")
+
+def _report_range(start: Optional[date], end: Optional[date]):
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start, end
+
+def _counter_sums():
+    stats = models.CourseDailyStats
+    return [func.sum(getattr(stats, name)).label(name) for name in COUNTERS]
+
+def _totals(row):
+    return {name: (float(row[name]) if name == "revenue" else int(row[name])) if row[name] is not None else 0 for name in COUNTERS}
+
+@admin_router.get("/reports/courses")
+async def course_report(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    order_by: Literal["purchases", "revenue", "likes", "downloads", "completions"] = "revenue",
+    limit: int = Query(50, ge=1, le=1000),
+    current_user: models.User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Totais por curso no intervalo, lidos só dos rollups diários (ver rollups.py)"""
+    start, end = _report_range(start, end)
+    stats = models.CourseDailyStats
+    sums = _counter_sums()
+    order_column = next(c for c in sums if c.name == order_by)
+    result = await db.execute(
+        select(stats.course_id, *sums)
+        .where(stats.day >= start, stats.day <= end)
+        .group_by(stats.course_id)
+        .order_by(order_column.desc())
+        .limit(limit)
+    )
+    rows = result.mappings().all()
+
+    titles = {}
+    if rows:
+        courses = await db.execute(
+            select(models.Course.id, models.Course.title)
+            .where(models.Course.id.in_([row["course_id"] for row in rows]))
+        )
+        titles = dict(courses.all())
+
+    return {
+        "start": start,
+        "end": end,
+        "updated_at": await rollup_freshness(db),
+        "courses": [
+            {"course_id": row["course_id"], "title": titles.get(row["course_id"]), **_totals(row)}
+            for row in rows
+        ],
+    }
+
+@admin_router.get("/reports/daily")
+async def daily_report(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    course_id: Optional[int] = None,
+    current_user: models.User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Totais por dia no intervalo, de todos os cursos ou de um só"""
+    start, end = _report_range(start, end)
+    stats = models.CourseDailyStats
+    stmt = select(stats.day, *_counter_sums()).where(stats.day >= start, stats.day <= end)
+    if course_id is not None:
+        stmt = stmt.where(stats.course_id == course_id)
+    result = await db.execute(stmt.group_by(stats.day).order_by(stats.day))
+
+    return {
+        "start": start,
+        "end": end,
+        "course_id": course_id,
+        "updated_at": await rollup_freshness(db),
+        "days": [{"day": row["day"], **_totals(row)} for row in result.mappings()],
+    }
\ No newline at end of file
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Body
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Body, Header, Query, Response
 from fastapi.responses import FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List
+from sqlalchemy import insert, update, func
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
 import os
 import shutil
 import uuid
@@ -10,38 +12,62 @@ from datetime import datetime
 
 import models
 import schemas
-from auth import get_current_admin, get_current_user
-from database import get_db
+from auth import get_current_admin, get_current_user, get_current_user_read
+from database import get_db, get_read_db
 from config import COURSE_DIR
 from utils import get_course, get_wallet
+from idempotency import idempotency_store, request_fingerprint
+from events import publish_balance, publish_transaction, publish_transactions
+from progress_buffer import progress_buffer
+from download_log import download_log
+from recommendations import recommender
+from trending import trending, TRENDING_TOP_K
+from fieldsets import FieldSelection, SparseFields
+from course_validation import enqueue_course_validation
 
 course_router = APIRouter()
 
+# `?fields=` nas listagens e consultas (ver fieldsets.py)
+course_fields = SparseFields(schemas.Course, models.Course)
+enrollment_fields = SparseFields(schemas.CourseDownload, models.CourseDownload)
+
 @course_router.get("/code/{course_code}", response_model=schemas.Course)
 async def get_course_by_code(
     course_code: str,
-    db: AsyncSession = Depends(get_db)
+    fields: Optional[FieldSelection] = Depends(course_fields),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Buscar curso pelo código único"""
-    stmt = select(models.Course).where(models.Course.course_code == course_code)
+    stmt = (
+        select(models.Course)
+        .where(models.Course.course_code == course_code)
+        .options(*course_fields.load_options(fields))
+    )
     result = await db.execute(stmt)
     course = result.scalar_one_or_none()
     
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
-    return course
+    return fields.render(course) if fields else course
 
 @course_router.get("/enrollment/{enrollment_code}", response_model=schemas.CourseDownload)
 async def get_enrollment_by_code(
     enrollment_code: str,
+    user_agent: Optional[str] = Header(None),
+    fields: Optional[FieldSelection] = Depends(enrollment_fields),
     current_user: models.User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """Buscar matrícula pelo código único"""
     stmt = select(models.CourseDownload).where(
         models.CourseDownload.enrollment_code == enrollment_code
-    )
+    ).options(*enrollment_fields.load_options(
+        fields,
+        models.CourseDownload.user_id,
+        models.CourseDownload.course_id,
+        models.CourseDownload.status,
+    ))
     result = await db.execute(stmt)
     enrollment = result.scalar_one_or_none()
     
@@ -52,7 +78,10 @@ async def get_enrollment_by_code(
     if enrollment.user_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to access this enrollment")
     
-    return enrollment
+    if enrollment.user_id == current_user.id:
+        download_log.record("access", current_user.id, enrollment.course_id, enrollment.id, user_agent)
+    progress_buffer.overlay([enrollment])
+    return fields.render(enrollment) if fields else enrollment
 
 @course_router.post("/", response_model=schemas.Course)
 async def create_course(
@@ -65,7 +94,7 @@ async def create_course(
     current_user: models.User = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db)
 ):
-    # Validar arquivos
+    # Validar arquivos (o conteúdo do ZIP é validado depois, ver course_validation.py)
     if not course_file.filename.endswith('.zip'):
         raise HTTPException(status_code=400, detail="Course file must be a ZIP archive")
     
@@ -107,11 +136,21 @@ async def create_course(
         cover_image=cover_path,
         file_path=course_path,
         uploaded_by=current_user.id,
-        status="draft"  # Inicialmente como rascunho
+        status="draft",  # Inicialmente como rascunho
+        file_status="pending"
     )
     db.add(course)
-    await db.commit()
+    try:
+        await db.commit()
+    except Exception:
+        # Sem o curso os arquivos ficariam órfãos
+        await db.rollback()
+        for path in (cover_path, course_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
     await db.refresh(course)
+    await enqueue_course_validation(db, course.id, current_user.id)
 
     return course
 
@@ -129,6 +168,8 @@ async def update_course_status(
     course = await get_course(db, course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
+    if status == "published" and course.file_status != "ready":
+        raise HTTPException(status_code=409, detail=f"Course file is {course.file_status}; only validated courses can be published")
     
     course.status = status
     await db.commit()
@@ -136,10 +177,28 @@ async def update_course_status(
     
     return course
 
+@course_router.post("/{course_id}/validate", status_code=202)
+async def revalidate_course_file(
+    course_id: int,
+    current_user: models.User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """Validar de novo o arquivo do curso (ex.: validação que esgotou as tentativas)"""
+    course = await get_course(db, course_id)
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    job = await enqueue_course_validation(db, course.id, current_user.id)
+    return {"job_id": job.id, "status": job.status}
+
 @course_router.get("/public", response_model=List[schemas.Course])
-async def list_public_courses(db: AsyncSession = Depends(get_db)):
+async def list_public_courses(
+    fields: Optional[FieldSelection] = Depends(course_fields),
+    db: AsyncSession = Depends(get_read_db)
+):
     # Buscar todos os cursos disponíveis publicamente
-    courses = await db.execute(select(models.Course))
+    courses = await db.execute(
+        select(models.Course).options(*course_fields.load_options(fields))
+    )
     courses = courses.scalars().all()
     
     # Inicializar campos que requerem autenticação com valores padrão
@@ -147,47 +206,119 @@ async def list_public_courses(db: AsyncSession = Depends(get_db)):
         course.liked = False
         course.likes_count = 0
     
-    return courses
+    return fields.render(courses) if fields else courses
+
+async def _published_courses(
+    db: AsyncSession,
+    course_ids: List[int],
+    limit: int,
+    fields: Optional[FieldSelection] = None
+):
+    """Cursos publicados pela ordem de `course_ids`"""
+    if not course_ids:
+        return []
+    result = await db.execute(
+        select(models.Course)
+        .where(models.Course.id.in_(course_ids), models.Course.status == "published")
+        .options(*course_fields.load_options(fields))
+    )
+    by_id = {course.id: course for course in result.scalars().all()}
+    courses = [by_id[course_id] for course_id in course_ids if course_id in by_id][:limit]
+    return fields.render(courses) if fields else courses
+
+@course_router.get("/recommended", response_model=List[schemas.Course])
+async def recommended_courses(
+    limit: int = Query(10, ge=1, le=50),
+    fields: Optional[FieldSelection] = Depends(course_fields),
+    current_user: models.User = Depends(get_current_user_read),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Recomendações a partir dos cursos já comprados (ver recommendations.py)"""
+    owned = await db.execute(
+        select(models.CourseDownload.course_id)
+        .where(models.CourseDownload.user_id == current_user.id)
+    )
+    # Pedir mais do que o limite: alguns podem não estar publicados
+    course_ids = recommender.recommend(owned.scalars().all(), limit * 2)
+    return await _published_courses(db, course_ids, limit, fields)
+
+@course_router.get("/trending", response_model=List[schemas.Course])
+async def trending_courses(
+    limit: int = Query(10, ge=1, le=TRENDING_TOP_K),
+    fields: Optional[FieldSelection] = Depends(course_fields),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Cursos em alta: likes, compras e downloads recentes (ver trending.py)"""
+    return await _published_courses(db, trending.top(limit * 2), limit, fields)
+
+@course_router.get("/{course_id}/related", response_model=List[schemas.Course])
+async def related_courses(
+    course_id: int,
+    limit: int = Query(10, ge=1, le=50),
+    fields: Optional[FieldSelection] = Depends(course_fields),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Alunos que compraram este curso também compraram"""
+    return await _published_courses(db, recommender.related(course_id, limit * 2), limit, fields)
 
 @course_router.get("/", response_model=List[schemas.Course])
 async def list_courses(
-    current_user: models.User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    fields: Optional[FieldSelection] = Depends(course_fields),
+    current_user: models.User = Depends(get_current_user_read),
+    db: AsyncSession = Depends(get_read_db)
 ):
     # Buscar todos os cursos
-    courses = await db.execute(select(models.Course))
+    courses = await db.execute(
+        select(models.Course).options(*course_fields.load_options(fields))
+    )
     courses = courses.scalars().all()
-    
-    # Para cada curso, verificar se o usuário atual deu like
+
+    # Total de likes por curso, numa só consulta agrupada
+    likes = await db.execute(
+        select(models.CourseLike.course_id, func.count())
+        .group_by(models.CourseLike.course_id)
+    )
+    likes_count = dict(likes.all())
+
+    # Cursos em que o usuário atual deu like
+    liked = await db.execute(
+        select(models.CourseLike.course_id)
+        .where(models.CourseLike.user_id == current_user.id)
+    )
+    liked = set(liked.scalars().all())
+
     for course in courses:
-        reaction = await db.execute(
-            select(models.CourseLike)
-            .where(
-                models.CourseLike.user_id == current_user.id,
-                models.CourseLike.course_id == course.id
-            )
-        )
-        course.liked = reaction.scalar_one_or_none() is not None
-        
-        # Contar total de likes
-        likes = await db.execute(
-            select(models.CourseLike)
-            .where(models.CourseLike.course_id == course.id)
-        )
-        course.likes_count = len(likes.scalars().all())
+        course.liked = course.id in liked
+        course.likes_count = likes_count.get(course.id, 0)
     
-    return courses
+    return fields.render(courses) if fields else courses
 
 @course_router.post("/{course_id}/purchase")
 async def purchase_course(
     course_id: int,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: models.User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    result, replayed = await idempotency_store.run(
+        "course_purchase",
+        current_user.id,
+        idempotency_key,
+        request_fingerprint(course_id),
+        lambda: _purchase_course(course_id, current_user, db),
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def _purchase_course(course_id: int, current_user: models.User, db: AsyncSession):
     # Verificar se o curso existe
     course = await get_course(db, course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
+    if course.file_status != "ready":
+        raise HTTPException(status_code=409, detail="Course file is not available")
 
     # Verificar se o usuário já comprou o curso
     result = await db.execute(
@@ -213,6 +344,8 @@ async def purchase_course(
         status="completed"
     )
     db.add(transaction)
+    # Obter o id da transação para ligá-la à matrícula
+    await db.flush()
 
     # Atualizar saldo
     wallet.balance -= course.price
@@ -226,12 +359,147 @@ async def purchase_course(
     db.add(download)
     
     await db.commit()
+    publish_transaction(current_user.id, transaction)
+    publish_balance(current_user.id, wallet.balance)
+    recommender.record_purchase(current_user.id, [course_id])
+    trending.purchase([course_id])
 
     return {"message": "Course purchased successfully"}
 
+@course_router.post("/checkout")
+async def checkout_courses(
+    checkout: schemas.CheckoutRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Comprar vários cursos numa única transação (tudo ou nada)"""
+    course_ids = sorted(set(checkout.course_ids))
+    result, replayed = await idempotency_store.run(
+        "course_checkout",
+        current_user.id,
+        idempotency_key,
+        request_fingerprint(course_ids),
+        lambda: _checkout_courses(course_ids, current_user, db),
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def _checkout_courses(course_ids: List[int], current_user: models.User, db: AsyncSession):
+    # Preços de todos os cursos numa só consulta
+    result = await db.execute(
+        select(models.Course.id, models.Course.price, models.Course.file_status)
+        .where(models.Course.id.in_(course_ids))
+    )
+    rows = result.all()
+    prices = {row.id: row.price for row in rows}
+    missing = [course_id for course_id in course_ids if course_id not in prices]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Courses not found: {missing}")
+    unavailable = sorted(row.id for row in rows if row.file_status != "ready")
+    if unavailable:
+        raise HTTPException(status_code=409, detail=f"Course files not available: {unavailable}")
+
+    # Cursos do carrinho que o usuário já comprou
+    result = await db.execute(
+        select(models.CourseDownload.course_id)
+        .where(
+            models.CourseDownload.user_id == current_user.id,
+            models.CourseDownload.course_id.in_(course_ids)
+        )
+    )
+    owned = sorted(result.scalars().all())
+    if owned:
+        raise HTTPException(status_code=400, detail=f"Courses already purchased: {owned}")
+
+    total = sum(prices.values())
+    wallet = await get_wallet(db, current_user.id)
+
+    # Débito único e condicional: falha se o saldo não cobrir o total
+    debit = await db.execute(
+        update(models.Wallet)
+        .where(models.Wallet.id == wallet.id, models.Wallet.balance >= total)
+        .values(balance=models.Wallet.balance - total)
+        .execution_options(synchronize_session=False)
+    )
+    if debit.rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+
+    # Uma linha de extrato por curso; a referência liga cada uma à sua matrícula
+    checkout_ref = f"checkout:{uuid.uuid4()}"
+    now = datetime.utcnow()
+    transactions = [
+        {
+            "wallet_id": wallet.id,
+            "amount": -prices[course_id],
+            "transaction_type": "purchase",
+            "payment_ref": f"{checkout_ref}:{course_id}",
+            "status": "completed",
+            "created_at": now,
+        }
+        for course_id in course_ids
+    ]
+    await db.execute(insert(models.WalletTransaction).values(transactions))
+    result = await db.execute(
+        select(models.WalletTransaction.id, models.WalletTransaction.payment_ref)
+        .where(
+            models.WalletTransaction.wallet_id == wallet.id,
+            models.WalletTransaction.payment_ref.in_(
+                [f"{checkout_ref}:{course_id}" for course_id in course_ids]
+            )
+        )
+    )
+    transaction_ids = {
+        int(payment_ref.rsplit(":", 1)[1]): transaction_id
+        for transaction_id, payment_ref in result.all()
+    }
+
+    enrollments = [
+        {
+            "enrollment_code": models.generate_enrollment_code(),
+            "user_id": current_user.id,
+            "course_id": course_id,
+            "transaction_id": transaction_ids[course_id],
+            "downloaded_at": now,
+            "status": "active",
+            "progress": 0.0,
+        }
+        for course_id in course_ids
+    ]
+    try:
+        await db.execute(insert(models.CourseDownload).values(enrollments))
+        await db.commit()
+    except IntegrityError:
+        # Compra concorrente do mesmo curso: nada do checkout é gravado
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Checkout conflicted with another purchase, please retry")
+
+    # O débito foi feito em SQL; recarregar o saldo real depois do commit
+    await db.refresh(wallet)
+    for course_id, transaction in zip(course_ids, transactions):
+        transaction["id"] = transaction_ids[course_id]
+    publish_transactions(current_user.id, transactions)
+    publish_balance(current_user.id, wallet.balance)
+    recommender.record_purchase(current_user.id, course_ids)
+    trending.purchase(course_ids)
+
+    return {
+        "message": "Courses purchased successfully",
+        "total": total,
+        "wallet_balance": wallet.balance,
+        "enrollments": [
+            {"course_id": e["course_id"], "enrollment_code": e["enrollment_code"]}
+            for e in enrollments
+        ],
+    }
+
 @course_router.get("/{course_id}/download")
 async def download_course(
     course_id: int,
+    user_agent: Optional[str] = Header(None),
     current_user: models.User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -248,8 +516,15 @@ async def download_course(
             models.CourseDownload.course_id == course_id
         )
     )
-    if not result.scalar_one_or_none():
+    enrollment = result.scalar_one_or_none()
+    if not enrollment:
         raise HTTPException(status_code=400, detail="Course not purchased")
+    if course.file_status != "ready":
+        raise HTTPException(status_code=409, detail="Course file is not available")
+
+    # Registado em memória e gravado em lote, sem escrita no banco neste pedido
+    download_log.record("download", current_user.id, course_id, enrollment.id, user_agent)
+    trending.download(course_id)
 
     # Retornar o arquivo
     return FileResponse(
@@ -279,8 +554,10 @@ async def toggle_course_like(
     )
     existing_like = result.scalar_one_or_none()
 
+    liked_at = None
     if existing_like:
         # Se já existe um like, remover
+        liked_at = existing_like.created_at
         await db.delete(existing_like)
         await db.commit()
         message = "Like removed"
@@ -295,6 +572,7 @@ async def toggle_course_like(
         await db.commit()
         message = "Like added"
         liked = True
+    trending.like(course_id, liked, liked_at)
 
     # Contar total de likes
     likes_count = await db.execute(
@@ -310,17 +588,19 @@ async def toggle_course_like(
 
 @course_router.get("/enrollments", response_model=List[schemas.CourseDownload])
 async def get_user_enrollments(
-    current_user: models.User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    fields: Optional[FieldSelection] = Depends(enrollment_fields),
+    current_user: models.User = Depends(get_current_user_read),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Obter todas as matrículas do usuário atual"""
     stmt = select(models.CourseDownload).where(
         models.CourseDownload.user_id == current_user.id
-    )
+    ).options(*enrollment_fields.load_options(fields, models.CourseDownload.status))
     result = await db.execute(stmt)
     enrollments = result.scalars().all()
+    progress_buffer.overlay(enrollments)
     
-    return enrollments
+    return fields.render(enrollments) if fields else enrollments
 
 @course_router.put("/enrollment/{enrollment_code}/progress")
 async def update_enrollment_progress(
@@ -329,12 +609,8 @@ async def update_enrollment_progress(
     current_user: models.User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Atualizar o progresso de uma matrícula"""
-    stmt = select(models.CourseDownload).where(
-        models.CourseDownload.enrollment_code == enrollment_code
-    )
-    result = await db.execute(stmt)
-    enrollment = result.scalar_one_or_none()
+    """Atualizar o progresso de uma matrícula (gravado em lote, ver progress_buffer.py)"""
+    enrollment = await progress_buffer.lookup(db, enrollment_code)
     
     if not enrollment:
         raise HTTPException(status_code=404, detail="Enrollment not found")
@@ -343,15 +619,25 @@ async def update_enrollment_progress(
     if enrollment.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to update this enrollment")
     
-    # Atualizar progresso
-    enrollment.progress = min(100, max(0, progress))  # Limitar entre 0 e 100
-    enrollment.last_accessed = datetime.utcnow()
-    
-    # Se o progresso atingiu 100%, marcar como concluído
-    if enrollment.progress >= 100:
-        enrollment.status = "completed"
+    progress = min(100.0, max(0.0, progress))  # Limitar entre 0 e 100
     
-    await db.commit()
-    await db.refresh(enrollment)
+    # A conclusão é gravada de imediato; o resto fica no buffer até ao próximo flush
+    if progress >= 100 and not enrollment.completed:
+        await progress_buffer.complete(db, enrollment)
+    else:
+        progress_buffer.record(enrollment.id, progress)
     
-    return {"message": "Progress updated successfully", "progress": enrollment.progress}
\ No newline at end of file
+    return {"message": "Progress updated successfully", "progress": progress}
+
+@course_router.post("/enrollments/progress/sync")
+async def sync_enrollment_progress(
+    payload: schemas.ProgressSyncRequest,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Sincronizar eventos de progresso acumulados offline (vence o mais recente por matrícula)"""
+    results = await progress_buffer.sync(db, current_user.id, payload.events)
+    return {
+        "applied": sum(1 for r in results if r["status"] == "applied"),
+        "results": results,
+    }
\ No newline at end of file
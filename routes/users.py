@@ -3,18 +3,35 @@ from sqlalchemy.ext.asyncio import AsyncSession
 import os
 import shutil
 from sqlalchemy import select
+from typing import Optional
 
 import models
 import schemas
-from auth import get_current_user
-from database import get_db
+from auth import get_current_user, get_current_user_read
+from database import get_db, get_read_db
 from utils import get_wallet
+from fieldsets import FieldSelection, SparseFields
+from config import PROFILES_DIR
 
 user_router = APIRouter()
 
+profile_fields = SparseFields(schemas.UserProfile, models.User)
+
 @user_router.get("/profile", response_model=schemas.UserProfile)
-async def get_profile(current_user: models.User = Depends(get_current_user)):
-    return current_user
+async def get_profile(
+    fields: Optional[FieldSelection] = Depends(profile_fields),
+    current_user: models.User = Depends(get_current_user_read),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Carregar as relações serializadas em UserProfile com um SELECT ... IN por nível,
+    # só as pedidas em `fields`
+    result = await db.execute(
+        select(models.User)
+        .where(models.User.id == current_user.id)
+        .options(*profile_fields.load_options(fields))
+    )
+    user = result.scalar_one()
+    return fields.render(user) if fields else user
 
 @user_router.post("/profile/picture")
 async def update_profile_picture(
@@ -26,16 +43,24 @@ async def update_profile_picture(
         raise HTTPException(status_code=400, detail="Profile picture must be PNG or JPEG")
 
     # Create profiles directory if it doesn't exist
-    os.makedirs("profiles", exist_ok=True)
+    os.makedirs(PROFILES_DIR, exist_ok=True)
     
     # Save profile picture
-    file_path = f"profiles/{current_user.username}_{profile_picture.filename}"
+    file_path = f"{PROFILES_DIR}/{current_user.username}_{profile_picture.filename}"
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(profile_picture.file, buffer)
     
     # Update user profile picture path
+    previous = current_user.profile_picture
     current_user.profile_picture = file_path
     await db.commit()
+
+    # A foto anterior deixa de ser referenciada (o que falhar aqui fica para o media_gc.py)
+    if previous and previous != file_path:
+        try:
+            os.remove(previous)
+        except OSError:
+            pass
     
     return {"message": "Profile picture updated successfully"}
 
@@ -51,8 +76,8 @@ async def get_wallet_balance(
 
 @user_router.get("/wallet/transactions")
 async def get_wallet_transactions(
-    current_user: models.User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    current_user: models.User = Depends(get_current_user_read),
+    db: AsyncSession = Depends(get_read_db)
 ):
     wallet = await get_wallet(db, current_user.id)
     if not wallet:
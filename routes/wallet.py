@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Header, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import update
+from typing import Optional
 import uuid
 from jose import jwt, JWTError
 from dependencies import SECRET_KEY, ALGORITHM
+from engine_config import env_bool
 
 import models
 import schemas
@@ -13,18 +16,51 @@ from auth import get_current_user, get_user
 from database import get_db
 from utils import get_or_create_wallet, get_wallet
 from payment import paychangu
+from idempotency import idempotency_store, request_fingerprint
+from events import wallet_events, publish_balance, publish_transaction
 
 # Configurar templates
 templates = Jinja2Templates(directory="templates")
 
 wallet_router = APIRouter()
 
+# Creditar só em /verify-deposit, quando o gateway confirmar (o initialize fica pendente)
+DEPOSIT_CREDIT_ON_VERIFY = env_bool("DEPOSIT_CREDIT_ON_VERIFY", False)
+
+
+class EventStreamResponse(StreamingResponse):
+    """StreamingResponse que liberta a inscrição mesmo se o gerador nunca chegar a arrancar."""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
 @wallet_router.post("/deposit/initialize")
 async def initialize_deposit(
     deposit: schemas.DepositInitialize,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: models.User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    result, replayed = await idempotency_store.run(
+        "deposit_initialize",
+        current_user.id,
+        idempotency_key,
+        request_fingerprint(deposit.mobile, deposit.amount),
+        lambda: _initialize_deposit(deposit, current_user, db),
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def _initialize_deposit(deposit: schemas.DepositInitialize, current_user: models.User, db: AsyncSession):
     # Gerar charge_id único
     charge_id = str(uuid.uuid4())
     
@@ -39,9 +75,23 @@ async def initialize_deposit(
     payment_response = await paychangu.initialize_payment(payment)
     
     if payment_response["status"] == "success":
-        # Registrar transação e atualizar saldo imediatamente
         wallet = await get_or_create_wallet(db, current_user.id)
-        
+
+        if DEPOSIT_CREDIT_ON_VERIFY:
+            # Fica pendente: /verify-deposit credita quando o gateway confirmar
+            transaction = models.WalletTransaction(
+                wallet_id=wallet.id,
+                amount=float(deposit.amount),
+                transaction_type="deposit",
+                payment_ref=payment_response["data"]["ref_id"],
+                status="pending"
+            )
+            db.add(transaction)
+            await db.commit()
+            publish_transaction(current_user.id, transaction)
+            return payment_response
+
+        # Registrar transação e atualizar saldo imediatamente
         # Criar a transação como completed
         transaction = models.WalletTransaction(
             wallet_id=wallet.id,
@@ -56,6 +106,8 @@ async def initialize_deposit(
         wallet.balance += float(deposit.amount)
         
         await db.commit()
+        publish_transaction(current_user.id, transaction)
+        publish_balance(current_user.id, wallet.balance)
 
         # Retornar resposta com o novo saldo
         return {
@@ -77,21 +129,81 @@ async def verify_deposit(
     payment_status = await paychangu.verify_payment_status(payment_ref)
     
     if payment_status["status"] == "success":
+        wallet = await get_wallet(db, current_user.id)
         result = await db.execute(
             select(models.WalletTransaction)
-            .where(models.WalletTransaction.payment_ref == payment_ref)
+            .where(
+                models.WalletTransaction.payment_ref == payment_ref,
+                models.WalletTransaction.wallet_id == wallet.id
+            )
         )
         transaction = result.scalar_one_or_none()
-        
-        if transaction and transaction.status == "pending":
+
+        claimed = False
+        if transaction is not None:
+            # Só uma verificação passa o depósito a completed: repetições não creditam duas vezes
+            result = await db.execute(
+                update(models.WalletTransaction)
+                .where(
+                    models.WalletTransaction.id == transaction.id,
+                    models.WalletTransaction.status == "pending"
+                )
+                .values(status="completed")
+            )
+            claimed = result.rowcount == 1
+        if claimed:
             transaction.status = "completed"
-            wallet = await get_wallet(db, current_user.id)
             wallet.balance += transaction.amount
             await db.commit()
+            publish_transaction(current_user.id, transaction)
+            publish_balance(current_user.id, wallet.balance)
             return {"message": "Deposit completed successfully", "new_balance": wallet.balance}
     
     raise HTTPException(status_code=400, detail="Payment not completed")
 
+@wallet_router.get("/events")
+async def wallet_event_stream(
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream SSE com alterações de saldo e de estado das transações.
+
+    O primeiro evento de cada ligação é sempre o saldo atual, por isso um
+    cliente que reconecta fica sincronizado mesmo que tenha perdido eventos.
+    Os eventos são por worker: `Last-Event-ID` só retoma no worker que o
+    emitiu, e o que acontece noutros workers chega pelo relay de events.py
+    (com até WALLET_EVENTS_RELAY_SECONDS de atraso).
+    """
+    user_id = current_user.id
+
+    # Inscrever antes de ler o saldo: o que for publicado entretanto fica na fila
+    queue = wallet_events.subscribe(user_id)
+    if queue is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many event stream connections",
+            headers={"Retry-After": "5"}
+        )
+    try:
+        missed = wallet_events.replay(user_id, last_event_id)
+        result = await db.execute(
+            select(models.Wallet.balance).where(models.Wallet.user_id == user_id)
+        )
+        balance = result.scalar_one_or_none() or 0.0
+        # Devolver a conexão ao pool: o stream pode ficar aberto por muito tempo
+        await db.close()
+    except BaseException:
+        wallet_events.unsubscribe(user_id, queue)
+        raise
+
+    return EventStreamResponse(
+        wallet_events.stream(user_id, queue, {"balance": balance}, missed),
+        on_close=lambda: wallet_events.unsubscribe(user_id, queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @wallet_router.get("/deposit", response_class=HTMLResponse)
 async def show_deposit_page(
     request: Request,
@@ -148,6 +260,8 @@ async def deposit_result(
             wallet = await get_wallet(db, current_user.id)
             wallet.balance += transaction.amount
             await db.commit()
+            publish_transaction(current_user.id, transaction)
+            publish_balance(current_user.id, wallet.balance)
             return {"message": "Deposit completed successfully", "new_balance": wallet.balance}
     
     return {"message": "Payment failed or already processed"}
@@ -35,6 +35,8 @@ class Course(CourseBase):
     uploaded_by: int
     created_at: datetime
     status: str
+    file_status: str = "ready"
+    file_error: Optional[str] = None
     instructor: User
 
     class Config:
@@ -57,6 +59,17 @@ class CourseDownload(CourseDownloadBase):
     class Config:
         from_attributes = True
 
+class CheckoutRequest(BaseModel):
+    course_ids: List[int] = Field(..., min_length=1, max_length=100)
+
+class ProgressEvent(BaseModel):
+    enrollment_code: str = Field(..., max_length=8)
+    progress: float
+    timestamp: datetime
+
+class ProgressSyncRequest(BaseModel):
+    events: List[ProgressEvent] = Field(..., min_length=1, max_length=1000)
+
 class WalletBase(BaseModel):
     balance: float = 0.0
 
@@ -106,6 +119,39 @@ class UserProfile(BaseModel):
     class Config:
         from_attributes = True
 
+class AdminUserRow(BaseModel):
+    id: int
+    username: str
+    email: str
+    is_admin: bool = False
+    profile_picture: Optional[str] = None
+    created_at: Optional[datetime] = None
+    enrollments: Optional[int] = None
+    likes: Optional[int] = None
+    courses_created: Optional[int] = None
+
+class Job(BaseModel):
+    id: int
+    job_type: str
+    status: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+    processed: int = 0
+    total: Optional[int] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class DepositInitialize(BaseModel):
+    mobile: str
+    amount: str
+
 class PaymentInitialize(BaseModel):
     mobile: str
     amount: str
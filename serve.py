@@ -0,0 +1,269 @@
+"""Servidor de produção com vários workers (pre-fork).
+
+O processo mestre importa a aplicação (`main:app`) uma vez, aplica as
+migrações pendentes e faz fork de N workers uvicorn, que herdam o código já
+carregado. Os workers partilham o socket de escuta do mestre ou, com
+SERVE_REUSE_PORT=true, abrem cada um o seu com SO_REUSEPORT e o kernel
+distribui as conexões.
+
+    python serve.py --workers 4 --port 8080
+
+Variáveis reconhecidas (os argumentos da linha de comando têm prioridade):
+
+    HOST                          endereço de escuta (0.0.0.0)
+    PORT                          porta (8080)
+    WEB_CONCURRENCY               número de workers (núcleos disponíveis)
+    SERVE_REUSE_PORT              um socket SO_REUSEPORT por worker (false)
+    SERVE_MAX_REQUESTS            reciclar o worker após N pedidos, 0 = nunca (0)
+    SERVE_MAX_REQUESTS_JITTER     variação aleatória de N, para não reciclar todos juntos (0)
+    SERVE_GRACEFUL_TIMEOUT        segundos para terminar pedidos em curso ao parar (60)
+    METRICS_DIR                   pasta partilhada das métricas dos workers (temporária)
+
+Sinais do mestre: SIGTERM/SIGINT param os workers de forma ordenada (deixam
+de aceitar conexões e terminam os pedidos em curso, incluindo downloads,
+até SERVE_GRACEFUL_TIMEOUT); SIGHUP substitui os workers um a um.
+
+As chaves de idempotência ficam no banco e valem para todos os workers.
+As métricas são somadas entre workers através de ficheiros em METRICS_DIR
+(por omissão uma pasta temporária criada pelo mestre, ver metrics.py). O
+resto do estado em memória (eventos da wallet, caches) é por worker.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import uvicorn
+
+from engine_config import env_bool, env_int
+from metrics import reset_metrics_dir, retire_worker
+
+logger = logging.getLogger("serve")
+
+# Um worker que morre antes disto conta como falha de arranque
+MIN_WORKER_LIFETIME = 2.0
+
+
+def default_workers() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def bind_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+async def _prepare_database():
+    """Migrações feitas uma vez no mestre, antes do fork; o pool é esvaziado a seguir."""
+    from database import engine
+    from migrations import run_migrations
+
+    await run_migrations(engine)
+    await engine.dispose()
+
+
+def _reset_pools_after_fork():
+    """Descarta as conexões herdadas do mestre sem as fechar (continuam a ser dele)."""
+    from database import engine, read_router
+
+    engine.sync_engine.dispose(close=False)
+    for replica in read_router.replicas:
+        replica.engine.sync_engine.dispose(close=False)
+
+
+class Arbiter:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.workers = {}  # pid -> momento do arranque
+        self.listener = None
+        self.stopping = False
+        self.reload_requested = False
+        self.failed_boots = 0
+
+    def _worker_config(self) -> uvicorn.Config:
+        max_requests = None
+        if self.args.max_requests:
+            max_requests = self.args.max_requests + random.randint(0, self.args.max_requests_jitter)
+        return uvicorn.Config(
+            self.app,
+            lifespan="on",
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=self.args.graceful_timeout,
+            log_level=self.args.log_level,
+            access_log=self.args.access_log,
+            proxy_headers=True,
+        )
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+
+        # Processo filho
+        exit_code = 0
+        try:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            random.seed()
+            _reset_pools_after_fork()
+            if self.args.reuse_port:
+                sock = bind_socket(self.args.host, self.args.port, reuse_port=True)
+            else:
+                sock = self.listener
+            uvicorn.Server(self._worker_config()).run(sockets=[sock])
+        except BaseException:
+            logger.exception("Worker %d crashed", os.getpid())
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            try:
+                retire_worker(os.environ["METRICS_DIR"], pid)
+            except OSError:
+                logger.exception("Could not retire the metrics of worker %d", pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            if time.monotonic() - started < MIN_WORKER_LIFETIME and code != 0:
+                self.failed_boots += 1
+                logger.error("Worker %d failed during startup (exit %s)", pid, code)
+            else:
+                self.failed_boots = 0
+                logger.info("Worker %d exited (exit %s); starting a replacement", pid, code)
+
+    def _rolling_restart(self):
+        """Substitui os workers um a um; cada um termina os pedidos em curso."""
+        self.reload_requested = False
+        for pid in list(self.workers):
+            if self.stopping:
+                return
+            self.spawn()
+            os.kill(pid, signal.SIGTERM)
+            while pid in self.workers and not self.stopping:
+                time.sleep(0.1)
+                self._reap()
+
+    def _shutdown(self):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # Os workers param sozinhos após o timeout de graceful shutdown; a margem cobre o lifespan
+        deadline = time.monotonic() + self.args.graceful_timeout + 10
+        while self.workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self._reap()
+        for pid in self.workers:
+            logger.warning("Killing worker %d after graceful timeout", pid)
+            os.kill(pid, signal.SIGKILL)
+
+    def run(self):
+        if not self.args.reuse_port:
+            self.listener = bind_socket(self.args.host, self.args.port, reuse_port=False)
+            self.listener.listen(2048)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        logger.info(
+            "Serving on %s:%d with %d workers (pid %d)",
+            self.args.host, self.args.port, self.args.workers, os.getpid(),
+        )
+        try:
+            while not self.stopping:
+                self._reap()
+                if self.failed_boots >= self.args.workers:
+                    logger.error("Workers keep failing to start; giving up")
+                    self.stopping = True
+                    break
+                if self.reload_requested:
+                    self._rolling_restart()
+                while len(self.workers) < self.args.workers and not self.stopping:
+                    self.spawn()
+                time.sleep(0.2)
+        finally:
+            self._shutdown()
+            if self.listener is not None:
+                self.listener.close()
+        return 1 if self.failed_boots else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de produção com vários workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=env_int("PORT", 8080))
+    parser.add_argument("--workers", type=int, default=env_int("WEB_CONCURRENCY", 0) or default_workers())
+    parser.add_argument("--reuse-port", action=argparse.BooleanOptionalAction, default=env_bool("SERVE_REUSE_PORT", False))
+    parser.add_argument("--max-requests", type=int, default=env_int("SERVE_MAX_REQUESTS", 0))
+    parser.add_argument("--max-requests-jitter", type=int, default=env_int("SERVE_MAX_REQUESTS_JITTER", 0))
+    parser.add_argument("--graceful-timeout", type=int, default=env_int("SERVE_GRACEFUL_TIMEOUT", 60))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action=argparse.BooleanOptionalAction, default=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s")
+    if args.reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("SO_REUSEPORT is not available on this platform")
+
+    metrics_dir = os.getenv("METRICS_DIR")
+    created_metrics_dir = not metrics_dir
+    if created_metrics_dir:
+        metrics_dir = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="boolen-metrics-")
+
+    # Pré-carregar a aplicação: os workers herdam os módulos já importados
+    from main import app
+
+    reset_metrics_dir(metrics_dir)
+
+    if env_bool("DB_MIGRATE_ON_STARTUP", True):
+        asyncio.run(_prepare_database())
+    # Os workers não repetem as migrações (ver o lifespan em main.py)
+    os.environ["DB_MIGRATE_ON_STARTUP"] = "false"
+
+    try:
+        code = Arbiter(app, args).run()
+    finally:
+        if created_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Orçamentos de consultas SQL dos endpoints mais usados.
+
+A aplicação corre com um banco SQLite temporário; os usuários, cursos,
+compras e likes são criados pela API. Os orçamentos não dependem da
+quantidade de dados: um N+1 (uma consulta por curso ou por matrícula)
+ultrapassa-os.
+
+O banco é um ficheiro e não `sqlite://` em memória: aí todas as sessões
+partilham uma única conexão (StaticPool) e os serviços de fundo do lifespan
+desfazem as transações dos pedidos a meio.
+"""
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix="boolen-tests-")
+# Antes de importar a aplicação: nunca usar o banco configurado no ambiente
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(WORKDIR, 'test.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+
+COURSES = 6
+STUDENTS = 3
+PURCHASES_PER_STUDENT = 4
+READY_TIMEOUT_SECONDS = 60
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def _course_zip() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("aula_01/video.txt", b"conteudo " * 100)
+    return buffer.getvalue()
+
+
+def _login(client, username: str) -> dict:
+    response = client.post("/auth/register", json={
+        "email": f"{username}@example.com", "username": username, "password": "test-password",
+    })
+    assert response.status_code == 200, response.text
+    response = client.post("/auth/token", data={"username": username, "password": "test-password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    # Os uploads vão para courses/ e profiles/ relativos à pasta atual
+    previous = os.getcwd()
+    os.chdir(WORKDIR)
+    from fastapi.testclient import TestClient
+    from sqlalchemy import select, update
+
+    import main
+    import models
+    from database import AsyncSessionLocal
+
+    try:
+        with TestClient(main.app) as client:
+            admin = _login(client, "admin")
+
+            async def promote():
+                async with AsyncSessionLocal() as session:
+                    await session.execute(update(models.User).where(models.User.username == "admin").values(is_admin=True))
+                    await session.commit()
+
+            client.portal.call(promote)
+
+            course_zip = _course_zip()
+            course_ids = []
+            for i in range(COURSES):
+                response = client.post(
+                    "/courses/",
+                    headers=admin,
+                    data={"title": f"Curso {i}", "description": "Curso de teste", "price": "10", "duration_minutes": "30"},
+                    files={
+                        "cover_image": ("cover.png", TINY_PNG, "image/png"),
+                        "course_file": ("curso.zip", course_zip, "application/zip"),
+                    },
+                )
+                assert response.status_code == 200, response.text
+                course_ids.append(response.json()["id"])
+
+            async def pending_files():
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        select(models.Course.id).where(models.Course.file_status == "pending")
+                    )
+                    return result.scalars().all()
+
+            deadline = time.monotonic() + READY_TIMEOUT_SECONDS
+            while client.portal.call(pending_files):
+                assert time.monotonic() < deadline, "course validation did not finish"
+                time.sleep(0.2)
+            for course_id in course_ids:
+                response = client.put(f"/courses/{course_id}/status", headers=admin, params={"status": "published"})
+                assert response.status_code == 200, response.text
+
+            students = [_login(client, f"aluno{i}") for i in range(STUDENTS)]
+
+            async def fund():
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(select(models.User.id).where(models.User.username.like("aluno%")))
+                    for user_id in result.scalars():
+                        session.add(models.Wallet(user_id=user_id, balance=1000.0))
+                    await session.commit()
+
+            client.portal.call(fund)
+            for student in students:
+                for course_id in course_ids[:PURCHASES_PER_STUDENT]:
+                    assert client.post(f"/courses/{course_id}/purchase", headers=student).status_code == 200
+                    assert client.post(f"/courses/{course_id}/like", headers=student).status_code == 200
+
+            yield client, admin, students[0]
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+def test_courses_list_budget(seeded, query_budget):
+    client, admin, _ = seeded
+    with query_budget(5):
+        response = client.get("/courses/", headers=admin)
+    assert response.status_code == 200
+    assert len(response.json()) == COURSES
+
+
+def test_public_catalog_budget(seeded, query_budget):
+    client, _, _ = seeded
+    with query_budget(3):
+        response = client.get("/courses/public")
+    assert response.status_code == 200
+    assert len(response.json()) == COURSES
+
+
+def test_enrollments_budget(seeded, query_budget):
+    client, _, student = seeded
+    with query_budget(5):
+        response = client.get("/courses/enrollments", headers=student)
+    assert response.status_code == 200
+    assert len(response.json()) == PURCHASES_PER_STUDENT
+
+
+def test_profile_budget(seeded, query_budget):
+    client, _, student = seeded
+    # Utilizador, perfil e um SELECT ... IN por nível de relação, com qualquer número de matrículas
+    with query_budget(7):
+        response = client.get("/users/profile", headers=student)
+    assert response.status_code == 200
@@ -0,0 +1,274 @@
+"""Ranking de cursos em alta, com decaimento exponencial no tempo.
+
+Cada evento soma um peso à pontuação do curso (like, compra, download) e
+a pontuação cai para metade a cada TRENDING_HALF_LIFE_HOURS. Remover um like
+subtrai o que esse like vale agora (o peso decaído desde a sua criação),
+não um like novo. Em memória usa-se decaimento "para a frente": os
+pesos são guardados já multiplicados por 2^((t - L) / meia-vida), com L o
+momento da última sincronização, por isso um evento é uma soma num dict e a
+ordem entre cursos não muda com o passar do tempo. O top-K é recalculado em
+fundo só quando houve eventos (a cada TRENDING_REFRESH_SECONDS) e
+`/courses/trending` devolve a lista pronta, em O(K).
+
+Persistência em `course_trending` (pontuação e o instante a que se refere).
+A cada TRENDING_SYNC_SECONDS cada worker soma ao banco os seus eventos,
+decaindo o valor guardado no mesmo UPSERT
+(`score * POW(0.5, Δt / meia-vida) + delta`), e relê a tabela. A soma é
+atómica, por isso os workers não se sobrepõem; entre sincronizações cada um
+vê os valores globais mais os seus próprios eventos. As pontuações nunca
+descem abaixo de 0.
+
+A tabela é calculada a partir do histórico (`course_likes`,
+`course_downloads` e os downloads de `download_events`) pela migração 10 e
+por `python trending.py --rebuild`, que a substitui; só entram eventos das
+últimas TRENDING_BACKFILL_HALF_LIVES meias-vidas, o resto já não pesa.
+"""
+import argparse
+import asyncio
+import heapq
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select, update
+
+import models
+from database import AsyncSessionLocal, engine
+from engine_config import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+TRENDING_HALF_LIFE_HOURS = env_float("TRENDING_HALF_LIFE_HOURS", 24.0)
+TRENDING_TOP_K = env_int("TRENDING_TOP_K", 50)
+TRENDING_REFRESH_SECONDS = env_float("TRENDING_REFRESH_SECONDS", 2.0)
+TRENDING_SYNC_SECONDS = env_float("TRENDING_SYNC_SECONDS", 30.0)
+TRENDING_BACKFILL_HALF_LIVES = 20
+BACKFILL_CHUNK_IDS = 100_000
+UPSERT_BATCH = 500
+
+LIKE_WEIGHT = 1.0
+PURCHASE_WEIGHT = 5.0
+DOWNLOAD_WEIGHT = 2.0
+
+
+def backfill_scores(conn, half_life_hours: float = TRENDING_HALF_LIFE_HOURS, now: Optional[float] = None) -> int:
+    """Substitui `course_trending` pelas pontuações do histórico; recebe uma Connection síncrona."""
+    now = time.time() if now is None else now
+    half_life = half_life_hours * 3600
+    since = datetime.utcfromtimestamp(now) - timedelta(hours=half_life_hours * TRENDING_BACKFILL_HALF_LIVES)
+    sources = (
+        (models.CourseLike, models.CourseLike.created_at, LIKE_WEIGHT, ()),
+        (models.CourseDownload, models.CourseDownload.downloaded_at, PURCHASE_WEIGHT, ()),
+        (
+            models.DownloadEvent, models.DownloadEvent.created_at, DOWNLOAD_WEIGHT,
+            (models.DownloadEvent.event_type == "download",),
+        ),
+    )
+    scores: Dict[int, float] = defaultdict(float)
+    for model, time_column, weight, conditions in sources:
+        low, high = conn.execute(select(func.min(model.id), func.max(model.id))).one()
+        if low is None:
+            continue
+        # Faixas de ids: as tabelas de eventos podem ter milhões de linhas
+        for start in range(low, high + 1, BACKFILL_CHUNK_IDS):
+            result = conn.execute(
+                select(model.course_id, time_column)
+                .where(model.id >= start, model.id < start + BACKFILL_CHUNK_IDS, time_column >= since, *conditions)
+            )
+            for course_id, created_at in result:
+                age = now - created_at.replace(tzinfo=timezone.utc).timestamp()
+                scores[course_id] += weight * 0.5 ** (max(0.0, age) / half_life)
+
+    table = models.CourseTrending.__table__
+    conn.execute(delete(table))
+    rows = [{"course_id": course_id, "score": score, "updated_ts": now} for course_id, score in scores.items()]
+    for start in range(0, len(rows), UPSERT_BATCH):
+        conn.execute(insert(table), rows[start:start + UPSERT_BATCH])
+    return len(rows)
+
+
+class TrendingRanking:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        half_life_hours: float = TRENDING_HALF_LIFE_HOURS,
+        top_k: int = TRENDING_TOP_K,
+    ):
+        self.session_factory = session_factory
+        self.half_life = half_life_hours * 3600
+        self.top_k = top_k
+        self._epoch = time.time()
+        # Pontuações em unidades "para a frente", relativas a self._epoch
+        self._scores: Dict[int, float] = {}
+        # Eventos deste worker ainda não somados ao banco, nas mesmas unidades
+        self._unsynced: Dict[int, float] = {}
+        self._top: List[int] = []
+        self._dirty = False
+        self._stopped = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _growth(self, at: float) -> float:
+        return 2.0 ** ((at - self._epoch) / self.half_life)
+
+    def record(self, course_id: int, weight: float, at: Optional[float] = None):
+        value = weight * self._growth(time.time() if at is None else at)
+        self._scores[course_id] = max(0.0, self._scores.get(course_id, 0.0) + value)
+        self._unsynced[course_id] = self._unsynced.get(course_id, 0.0) + value
+        self._dirty = True
+
+    def like(self, course_id: int, liked: bool, liked_at: Optional[datetime] = None):
+        """`liked_at` (UTC, do banco) é a data do like removido, para tirar só o que ainda vale."""
+        if liked:
+            self.record(course_id, LIKE_WEIGHT)
+        elif liked_at is not None:
+            self.record(course_id, -LIKE_WEIGHT, liked_at.replace(tzinfo=timezone.utc).timestamp())
+
+    def purchase(self, course_ids):
+        for course_id in course_ids:
+            self.record(course_id, PURCHASE_WEIGHT)
+
+    def download(self, course_id: int):
+        self.record(course_id, DOWNLOAD_WEIGHT)
+
+    def top(self, limit: int) -> List[int]:
+        return self._top[:limit]
+
+    def score(self, course_id: int) -> float:
+        """Pontuação atual (já decaída) de um curso."""
+        return self._scores.get(course_id, 0.0) / self._growth(time.time())
+
+    def refresh_top(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        best = heapq.nlargest(self.top_k, self._scores.items(), key=lambda item: item[1])
+        self._top = [course_id for course_id, score in best if score > 0]
+
+    def _upsert(self, dialect: str, rows: List[dict]):
+        table = models.CourseTrending.__table__
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert as dialect_insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            raise RuntimeError(f"Trending persistence not supported on {dialect}")
+
+        stmt = dialect_insert(table).values(rows)
+        new = stmt.inserted if dialect == "mysql" else stmt.excluded
+        decayed = table.c.score * func.pow(0.5, (new.updated_ts - table.c.updated_ts) / self.half_life) + new.score
+        if dialect == "mysql":
+            # No MySQL cada atribuição já vê as anteriores: o score tem de vir antes do updated_ts
+            return stmt.on_duplicate_key_update([("score", decayed), ("updated_ts", new.updated_ts)])
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.course_id],
+            set_={"score": decayed, "updated_ts": new.updated_ts},
+        )
+
+    async def store_deltas(self, session, deltas: Dict[int, float], now: float):
+        """Soma `deltas` (pontuação no instante `now`) a `course_trending`, sem commit."""
+        rows = [{"course_id": course_id, "score": value, "updated_ts": now} for course_id, value in deltas.items()]
+        table = models.CourseTrending.__table__
+        dialect = session.bind.dialect.name
+        for start in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[start:start + UPSERT_BATCH]
+            await session.execute(self._upsert(dialect, batch))
+            # Um unlike pode tirar mais do que o guardado (ou criar a linha negativa): nunca abaixo de 0
+            await session.execute(
+                update(table)
+                .where(table.c.course_id.in_([row["course_id"] for row in batch]), table.c.score < 0)
+                .values(score=0.0)
+            )
+
+    async def sync(self):
+        """Soma ao banco os eventos deste worker e recarrega as pontuações globais."""
+        now = time.time()
+        unsynced, self._unsynced = self._unsynced, {}
+        shrink = self._growth(now)
+        table = models.CourseTrending.__table__
+        try:
+            async with self.session_factory() as session:
+                await self.store_deltas(
+                    session, {course_id: value / shrink for course_id, value in unsynced.items()}, now
+                )
+                await session.commit()
+                result = await session.execute(select(table.c.course_id, table.c.score, table.c.updated_ts))
+                stored = result.all()
+        except Exception:
+            # Devolver os eventos para a próxima tentativa
+            for course_id, value in unsynced.items():
+                self._unsynced[course_id] = self._unsynced.get(course_id, 0.0) + value
+            raise
+
+        # Nova época: valores do banco decaídos até agora, mais os eventos chegados durante a sincronização
+        pending = {course_id: value / shrink for course_id, value in self._unsynced.items()}
+        self._epoch = now
+        scores = {
+            row.course_id: max(0.0, row.score) * 0.5 ** ((now - row.updated_ts) / self.half_life)
+            for row in stored
+        }
+        for course_id, value in pending.items():
+            scores[course_id] = max(0.0, scores.get(course_id, 0.0) + value)
+        self._scores = scores
+        self._unsynced = pending
+        self._dirty = True
+        self.refresh_top()
+
+    async def _run(self):
+        next_sync = 0.0
+        while not self._stopped.is_set():
+            if time.monotonic() >= next_sync:
+                try:
+                    await self.sync()
+                except Exception:
+                    logger.exception("Trending sync failed")
+                next_sync = time.monotonic() + TRENDING_SYNC_SECONDS
+            self.refresh_top()
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=TRENDING_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._stopped.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopped.set()
+            await self._task
+            self._task = None
+        if self._unsynced:
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Lost %d trending updates on shutdown", len(self._unsynced))
+
+
+trending = TrendingRanking()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranking de cursos em alta")
+    parser.add_argument("--rebuild", action="store_true", help="recalcular course_trending a partir do histórico")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    async def _run():
+        try:
+            async with engine.begin() as conn:
+                courses = await conn.run_sync(backfill_scores)
+            print(f"Pontuações recalculadas para {courses} cursos")
+        finally:
+            await engine.dispose()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
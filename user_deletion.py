@@ -0,0 +1,178 @@
+"""Exclusão de usuários em segundo plano (job `delete_user`).
+
+Apagar um usuário com milhares de likes, matrículas e transações num só
+`db.delete(user)` falha nas chaves estrangeiras ou faz um DELETE por linha
+enquanto o admin espera. O job apaga as linhas dependentes em blocos de
+USER_DELETION_CHUNK ids (um SELECT dos ids e um `DELETE ... WHERE id IN`
+por bloco, cada um na sua transação), pela ordem das chaves estrangeiras:
+
+    download_events -> course_likes -> course_downloads
+    -> wallet_transactions -> wallets -> users
+
+No mesmo bloco em que apaga likes, matrículas e eventos, o job desconta-os
+de `course_trending` (o peso decaído de cada um, como num unlike) e dos
+contadores de `course_daily_stats` já agregados pelos rollups (likes,
+downloads e conclusões; compras e receita ficam no histórico). A contagem
+de likes do catálogo é feita sobre `course_likes` e baixa sozinha.
+
+Os cursos criados pelo usuário não são apagados (há alunos que os
+compraram): passam para o admin que pediu a exclusão. Se o usuário criar
+linhas novas durante o job, o DELETE final falha e o job é repetido,
+apanhando-as.
+"""
+import time
+from collections import defaultdict
+from datetime import timezone
+from typing import List, Optional
+
+from sqlalchemy import bindparam, delete, func, select, update
+
+import models
+from engine_config import env_int
+from jobs import JobContext, job_handler, job_runner
+from trending import DOWNLOAD_WEIGHT, LIKE_WEIGHT, PURCHASE_WEIGHT, trending
+
+USER_DELETION_CHUNK = env_int("USER_DELETION_CHUNK", 1000)
+JOB_TYPE = "delete_user"
+
+# Tabelas com atividade que conta no trending e nos rollups: (coluna da data, origem em rollup_state)
+ACTIVITY = {
+    "course_likes": ("created_at", "likes"),
+    "course_downloads": ("downloaded_at", "purchases"),
+    "download_events": ("created_at", "events"),
+}
+
+
+async def enqueue_user_deletion(db, user_id: int, requested_by: int) -> models.Job:
+    return await job_runner.enqueue(
+        db,
+        JOB_TYPE,
+        {"user_id": user_id, "transfer_courses_to": requested_by},
+        dedupe_key=f"{JOB_TYPE}:{user_id}",
+        requested_by=requested_by,
+    )
+
+
+def _dependents(user_id: int, wallet_ids: List[int]):
+    """(nome, tabela, condição) pela ordem em que têm de ser apagados."""
+    steps = [
+        ("download_events", models.DownloadEvent.__table__, models.DownloadEvent.user_id == user_id),
+        ("course_likes", models.CourseLike.__table__, models.CourseLike.user_id == user_id),
+        ("course_downloads", models.CourseDownload.__table__, models.CourseDownload.user_id == user_id),
+    ]
+    if wallet_ids:
+        steps.append((
+            "wallet_transactions",
+            models.WalletTransaction.__table__,
+            models.WalletTransaction.wallet_id.in_(wallet_ids),
+        ))
+    return steps
+
+
+def _weigh(name: str, row):
+    """(peso no trending, contador de course_daily_stats) de uma linha apagada."""
+    if name == "course_likes":
+        return LIKE_WEIGHT, "likes"
+    if name == "course_downloads":
+        return PURCHASE_WEIGHT, None
+    if row.event_type == "download":
+        return DOWNLOAD_WEIGHT, "downloads"
+    if row.event_type == "completion":
+        return 0.0, "completions"
+    return 0.0, None
+
+
+async def _discount(session, name: str, rows):
+    """Tira do trending e dos rollups já agregados a atividade das linhas a apagar."""
+    date_column, source = ACTIVITY[name]
+    state = models.RollupState.__table__
+    # Recuar o snapshot trava o estado e faz perder a corrida a um rollup em curso
+    # que já tenha lido estas linhas; o seguinte já não as encontra
+    await session.execute(update(state).where(state.c.source == source).values(snapshot_id=state.c.last_id))
+    rolled_up_to = (await session.execute(
+        select(state.c.last_id).where(state.c.source == source)
+    )).scalar() or 0
+
+    now = time.time()
+    scores = defaultdict(float)
+    counters = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        at = getattr(row, date_column)
+        if at is None:
+            continue
+        weight, counter = _weigh(name, row)
+        if weight:
+            age = now - at.replace(tzinfo=timezone.utc).timestamp()
+            scores[row.course_id] -= weight * 0.5 ** (age / trending.half_life)
+        if counter and row.id <= rolled_up_to:
+            counters[counter][(row.course_id, at.date())] += 1
+
+    stats = models.CourseDailyStats.__table__
+    for counter, days in counters.items():
+        await session.execute(
+            update(stats)
+            .where(stats.c.course_id == bindparam("c"), stats.c.day == bindparam("d"))
+            .values({counter: stats.c[counter] - bindparam("n")}),
+            [{"c": course_id, "d": day, "n": n} for (course_id, day), n in days.items()],
+        )
+    if scores:
+        await trending.store_deltas(session, scores, now)
+
+
+async def _delete_in_chunks(ctx: JobContext, name: str, table, condition, processed: int, total: int) -> int:
+    columns = [table.c.id]
+    if name in ACTIVITY:
+        columns += [table.c.course_id, table.c[ACTIVITY[name][0]]]
+        if name == "download_events":
+            columns.append(table.c.event_type)
+    deleted = 0
+    while True:
+        async with ctx.session_factory() as session:
+            rows = (await session.execute(
+                select(*columns).where(condition).order_by(table.c.id).limit(USER_DELETION_CHUNK)
+            )).all()
+            if not rows:
+                return deleted
+            if name in ACTIVITY:
+                await _discount(session, name, rows)
+            await session.execute(delete(table).where(table.c.id.in_([row.id for row in rows])))
+            await session.commit()
+        deleted += len(rows)
+        await ctx.progress(processed + deleted, max(total, processed + deleted))
+
+
+@job_handler(JOB_TYPE)
+async def delete_user(ctx: JobContext, payload: dict) -> dict:
+    user_id = payload["user_id"]
+    transfer_to: Optional[int] = payload.get("transfer_courses_to")
+
+    async with ctx.session_factory() as session:
+        wallet_ids = (await session.execute(
+            select(models.Wallet.id).where(models.Wallet.user_id == user_id)
+        )).scalars().all()
+        steps = _dependents(user_id, wallet_ids)
+        total = 0
+        for _, table, condition in steps:
+            total += (await session.execute(select(func.count()).select_from(table).where(condition))).scalar()
+    await ctx.progress(0, total)
+
+    counts = {}
+    processed = 0
+    for name, table, condition in steps:
+        counts[name] = await _delete_in_chunks(ctx, name, table, condition, processed, total)
+        processed += counts[name]
+
+    async with ctx.session_factory() as session:
+        transferred = await session.execute(
+            update(models.Course.__table__)
+            .where(models.Course.uploaded_by == user_id)
+            .values(uploaded_by=transfer_to)
+        )
+        wallets = await session.execute(delete(models.Wallet.__table__).where(models.Wallet.user_id == user_id))
+        removed = await session.execute(delete(models.User.__table__).where(models.User.id == user_id))
+        await session.commit()
+
+    counts["wallets"] = wallets.rowcount
+    counts["courses_transferred"] = transferred.rowcount
+    counts["users"] = removed.rowcount
+    return {"user_id": user_id, "transfer_courses_to": transfer_to, "counts": counts}
@@ -0,0 +1,129 @@
+"""Validação de arquivos ZIP de cursos.
+
+Só biblioteca padrão: `validate_zip` corre nos processos do pool de
+course_validation.py, que a importam sozinha.
+
+Verificações, por ordem (as baratas primeiro, só com o diretório central):
+
+    integridade    o diretório central tem de ser legível (BadZipFile)
+    entradas       no máximo `max_entries`, sem nomes repetidos
+    caminhos       relativos, sem `..`, sem unidade (C:), sem bytes nulos,
+                   sem links simbólicos
+    encriptação    entradas encriptadas são recusadas
+    sobreposição   cada entrada ocupa a sua zona do arquivo (bombas que
+                   reutilizam os mesmos dados comprimidos em várias entradas)
+    tamanho        soma dos tamanhos declarados <= `max_uncompressed_bytes`
+    rácio          tamanho / tamanho comprimido <= `max_ratio` nas entradas
+                   com pelo menos `ratio_min_bytes`
+    conteúdo       cada entrada é descomprimida em blocos de `chunk_size`
+                   (sem guardar nada) para verificar o CRC-32; os bytes
+                   reais contam para os limites, não só os declarados
+"""
+import re
+import stat
+import zipfile
+import zlib
+from typing import NamedTuple
+
+LOCAL_HEADER_SIZE = 30
+_DRIVE = re.compile(r"^[A-Za-z]:")
+
+
+class ZipLimits(NamedTuple):
+    max_uncompressed_bytes: int
+    max_ratio: float
+    ratio_min_bytes: int
+    max_entries: int
+    chunk_size: int = 1 << 20
+
+
+class ZipValidationError(ValueError):
+    """O arquivo é inválido ou perigoso; a mensagem diz porquê."""
+
+
+def _check_name(name: str):
+    if not name or "\x00" in name:
+        raise ZipValidationError(f"Invalid entry name {name!r}")
+    normalized = name.replace("\\", "/")
+    if normalized.startswith("/") or _DRIVE.match(normalized):
+        raise ZipValidationError(f"Absolute path in archive: {name!r}")
+    if ".." in normalized.split("/"):
+        raise ZipValidationError(f"Path traversal in archive: {name!r}")
+
+
+def _check_layout(infos, archive_size: int):
+    """Entradas ordenadas pelo offset não se podem sobrepor nem sair do arquivo."""
+    ordered = sorted(infos, key=lambda info: info.header_offset)
+    for current, following in zip(ordered, ordered[1:] + [None]):
+        # Limite inferior: o campo extra do cabeçalho local não conta
+        encoding = "utf-8" if current.flag_bits & 0x800 else "cp437"
+        name_length = len(current.orig_filename.encode(encoding, "surrogateescape"))
+        end = current.header_offset + LOCAL_HEADER_SIZE + name_length + current.compress_size
+        limit = following.header_offset if following is not None else archive_size
+        if end > limit:
+            raise ZipValidationError(f"Overlapping or truncated entry: {current.filename!r}")
+
+
+def _validate(path: str, limits: ZipLimits) -> dict:
+    with zipfile.ZipFile(path) as archive:
+        infos = archive.infolist()
+        if not infos:
+            raise ZipValidationError("Archive is empty")
+        if len(infos) > limits.max_entries:
+            raise ZipValidationError(f"Too many entries: {len(infos)} > {limits.max_entries}")
+
+        seen = set()
+        declared = 0
+        for info in infos:
+            _check_name(info.filename)
+            key = info.filename.replace("\\", "/").rstrip("/").lower()
+            if key in seen:
+                raise ZipValidationError(f"Duplicate entry: {info.filename!r}")
+            seen.add(key)
+            if stat.S_ISLNK(info.external_attr >> 16):
+                raise ZipValidationError(f"Symbolic link in archive: {info.filename!r}")
+            if info.flag_bits & 0x1:
+                raise ZipValidationError(f"Encrypted entry: {info.filename!r}")
+            if info.file_size >= limits.ratio_min_bytes and info.file_size > limits.max_ratio * max(info.compress_size, 1):
+                raise ZipValidationError(f"Compression ratio too high: {info.filename!r}")
+            declared += info.file_size
+        if declared > limits.max_uncompressed_bytes:
+            raise ZipValidationError(f"Uncompressed size too large: {declared} bytes")
+        archive.fp.seek(0, 2)
+        _check_layout(infos, archive.fp.tell())
+
+        total = 0
+        compressed = 0
+        for info in infos:
+            if info.is_dir():
+                continue
+            size = 0
+            # ZipExtFile verifica o CRC-32 ao chegar ao fim da entrada
+            with archive.open(info) as entry:
+                while True:
+                    chunk = entry.read(limits.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    total += len(chunk)
+                    if total > limits.max_uncompressed_bytes:
+                        raise ZipValidationError(f"Uncompressed size too large: more than {total} bytes")
+            if size != info.file_size:
+                raise ZipValidationError(f"Size mismatch in {info.filename!r}")
+            compressed += info.compress_size
+        return {"entries": len(infos), "uncompressed_bytes": total, "compressed_bytes": compressed}
+
+
+def validate_zip(path: str, limits: ZipLimits) -> dict:
+    """Valida o arquivo em streaming; devolve contagens ou levanta ZipValidationError."""
+    try:
+        return _validate(path, limits)
+    except ZipValidationError:
+        raise
+    except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+        raise ZipValidationError(f"Corrupt archive: {e}") from None
+    except NotImplementedError as e:
+        raise ZipValidationError(f"Unsupported archive: {e}") from None
+    except RuntimeError as e:
+        # zipfile levanta RuntimeError para entradas encriptadas sem senha
+        raise ZipValidationError(str(e)) from None